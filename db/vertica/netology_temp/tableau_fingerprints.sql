@@ -0,0 +1,7 @@
+CREATE TABLE netology_temp.tableau_fingerprints
+(
+    table_name VARCHAR(200),
+    row_key    VARCHAR(1000),
+    row_hash   VARCHAR(16),
+    CONSTRAINT tableau_fingerprints_pk PRIMARY KEY (table_name, row_key) ENABLED
+);
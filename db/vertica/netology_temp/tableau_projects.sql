@@ -6,5 +6,8 @@ CREATE TABLE netology_temp.tableau_projects
     name                VARCHAR(500),
     parent_id           UUID,
     path                VARCHAR(500),
+    depth               INT,
+    root_project_id     UUID,
+    ancestor_ids        VARCHAR(4000),
     CONSTRAINT tableau_projects_pk PRIMARY KEY (id) ENABLED
 );
@@ -1,3 +1,6 @@
+-- По умолчанию - пользователь и workbooks, которыми он владеет: по owner_id workbooks.
+-- С etl_tableau.py --membership-per-item - все workbooks, которые сервер возвращает пользователю:
+-- его собственные и доступные ему на просмотр
 CREATE TABLE netology_temp.tableau_users_workbooks
 (
     workbooks_id UUID NOT NULL,
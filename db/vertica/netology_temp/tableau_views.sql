@@ -11,5 +11,6 @@ CREATE TABLE netology_temp.tableau_views
     updated_at  TIMESTAMP,
     workbook_id UUID,
     position    INT,
+    total_views INT,
     CONSTRAINT tableau_views_pk PRIMARY KEY (id) ENABLED
 );
@@ -0,0 +1,108 @@
+"""
+Бенчмарк форматов COPY на Vertica: FJSONPARSER против нативного delimited парсера.
+
+Синтетическая таблица tableau_workbooks копируется во временную таблицу в STAGING_SCHEMA
+(основная таблица не затрагивается). Для каждого формата меряется время загрузки, CPU клиента
+на сериализацию и, если доступно, CPU сервера из v_monitor.query_consumption.
+
+Запуск из папки scripts:
+    python -m bench.bench_copy_formats --rows 100000 --repeat 3
+"""
+import argparse
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+import pandas as pd
+
+from vertica.table_importer import COPY_FORMATS, TableImporter
+
+TABLE_NAME = 'tableau_workbooks'
+
+
+def make_workbooks_df(rows: int) -> pd.DataFrame:
+    """
+    Синтетический DataFrame со столбцами tableau_workbooks
+    """
+    now = pd.Timestamp.now(tz='UTC')
+    project_ids = [str(uuid.uuid4()) for _ in range(100)]
+    owner_ids = [str(uuid.uuid4()) for _ in range(500)]
+    return pd.DataFrame({
+        'id'          : [str(uuid.uuid4()) for _ in range(rows)],
+        'content_url' : ['workbook_{}'.format(i) for i in range(rows)],
+        'created_at'  : [now - pd.Timedelta(minutes=i) for i in range(rows)],
+        'description' : ['Описание | с разделителем\nи переносом {}'.format(i) for i in range(rows)],
+        'name'        : ['Workbook {}'.format(i) for i in range(rows)],
+        'owner_id'    : [owner_ids[i % len(owner_ids)] for i in range(rows)],
+        'project_id'  : [project_ids[i % len(project_ids)] for i in range(rows)],
+        'project_name': ['Project {}'.format(i % len(project_ids)) for i in range(rows)],
+        'show_tabs'   : [i % 2 == 0 for i in range(rows)],
+        'size'        : [i % 1000 for i in range(rows)],
+        'tags'        : [{'tag{}'.format(i % 7)} for i in range(rows)],
+        'updated_at'  : [now - pd.Timedelta(seconds=i) for i in range(rows)],
+        'webpage_url' : ['views/workbook_{}'.format(i) for i in range(rows)],
+    })
+
+
+def server_consumption(cursor) -> Optional[Dict[str, Any]]:
+    """
+    Длительность и CPU последнего COPY в текущей сессии. None, если Data Collector недоступен
+    """
+    try:
+        cursor.execute("""
+            SELECT duration_ms, cpu_cycles_us
+            FROM v_monitor.query_consumption
+            WHERE session_id = CURRENT_SESSION()
+              AND request_type = 'LOAD'
+            ORDER BY end_time DESC
+            LIMIT 1
+        """)
+        row = cursor.fetchone()
+    except Exception:
+        return None
+    return dict(zip(['server_duration_ms', 'server_cpu_us'], row)) if row else None
+
+
+def run(copy_format: str, df: pd.DataFrame, repeat: int) -> pd.DataFrame:
+    """
+    Загружает df repeat раз в формате copy_format и возвращает замеры
+    """
+    importer = TableImporter(fields_names=df.columns, copy_format=copy_format, table_name=TABLE_NAME)
+    results = []
+
+    with importer.connect() as v_connector:
+        cursor = v_connector.cnx.cursor()
+        for n in range(repeat):
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            importer.copy_to_staging(v_connector, df)
+            result = {
+                'format'        : copy_format,
+                'run'           : n + 1,
+                'rows'          : len(df),
+                'wall_s'        : time.perf_counter() - wall_start,
+                'client_cpu_s'  : time.process_time() - cpu_start,
+            }
+            result.update(server_consumption(cursor) or {})
+            results.append(result)
+
+        cursor.execute('DROP TABLE IF EXISTS {}.{} CASCADE'.format(importer.vertica_schema_staging, TABLE_NAME))
+        cursor.close()
+
+    return pd.DataFrame(results)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark COPY formats on Vertica')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    df = make_workbooks_df(args.rows)
+    report = pd.concat([run(copy_format, df, args.repeat) for copy_format in COPY_FORMATS])
+    print(report.to_string(index=False))
+    print()
+    print(report.groupby('format').median(numeric_only=True).drop(columns=['run']).to_string())
+
+
+if __name__ == '__main__':
+    main()
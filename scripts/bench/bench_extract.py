@@ -0,0 +1,183 @@
+"""
+Бенчмарк выгрузки из Tableau Server: шаги extract, populate и transform etl_tableau.py
+на локальной замене сервера (bench.tableau_stub) с синтетическим сайтом заданного размера
+и задержкой ответов. Сервер работает в отдельном процессе.
+
+Для каждого шага - время, строки, число HTTP-запросов и их задержки (metrics), итог сравнивается
+с сохраненным baseline. Baseline имеет смысл только с теми же параметрами сайта и на той же машине.
+
+Запуск из папки scripts:
+    python -m bench.bench_extract --scale small --latency 0.02
+    python -m bench.bench_extract --scale large --revisions 100 --latency 0.05 --jitter 0.02
+    python -m bench.bench_extract --scale small --latency 0.02 --error-rate 0.02 --token-ttl 5
+    python -m bench.bench_extract --scale small --latency 0.02 --save-baseline bench/baselines/extract_small.json
+"""
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+import requests
+import tableauserverclient as TSC
+
+from bench.tableau_stub import add_site_arguments, site_params, start_process
+from helper import attributes, dtypes
+from metrics import metrics
+from tableau.project_hierarchy import ProjectHierarchy
+
+BASELINE_PATH = Path(__file__).parent / 'baselines' / 'extract_small.json'
+
+# Сущности, которые etl_tableau.py забирает целиком
+EXTRACT_METHODS = ('workbooks', 'views', 'datasources', 'projects', 'users', 'groups', 'subscriptions', 'schedules')
+
+# Шаги populate в старом режиме (запрос на каждый workbook или пользователя), по умолчанию не запускаются
+LEGACY_STAGES = ('populate:views', 'populate:users_workbooks')
+
+
+def make_stages(utils) -> Dict[str, Callable[[Dict[str, Any]], Any]]:
+    """
+    Шаги бенчмарка в порядке выполнения: функции от результатов extract, как в etl_tableau.py
+    """
+    def transform(results: Dict[str, Any]) -> List[pd.DataFrame]:
+        dfs = [utils.make_df(results[m], attributes[m], dtypes) for m in EXTRACT_METHODS]
+        return dfs + [ProjectHierarchy(results['projects']).to_df()]
+
+    return {
+        'extract'                         : lambda results: utils.get_items_many(
+            EXTRACT_METHODS, {'views': utils.sorted_options(TSC.RequestOptions.Field.Name)}),
+        'populate:revisions'              : lambda results: utils.get_revisions_df(
+            results['workbooks'], utils.get_endpoint('workbooks'), dtypes),
+        'populate:connections'            : lambda results: utils.get_populate_items(
+            results['workbooks'], utils.get_endpoint('workbooks'), 'connections'),
+        'populate:datasources_connections': lambda results: utils.get_populate_items(
+            results['datasources'], utils.get_endpoint('datasources'), 'connections'),
+        'populate:groups_users'           : lambda results: utils.get_group_members(results['groups']),
+        'populate:views'                  : lambda results: utils.get_populate_items(
+            results['workbooks'], utils.get_endpoint('workbooks'), 'views'),
+        'populate:users_workbooks'        : lambda results: utils.get_populate_items(
+            results['users'], utils.get_endpoint('users'), 'workbooks'),
+        'transform'                       : transform,
+    }
+
+
+def count_rows(result: Any) -> int:
+    if isinstance(result, dict):
+        return sum(len(items) for items, _ in result.values())
+    if isinstance(result, list) and result and isinstance(result[0], pd.DataFrame):
+        return sum(len(df) for df in result)
+    return len(result)
+
+
+def run(stages: Dict[str, Callable[[Dict[str, Any]], Any]], selected: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Выполняет выбранные шаги (extract - всегда) и возвращает метрики каждого шага
+    """
+    results: Dict[str, Any] = {}
+    rows = {}
+    for name, func in stages.items():
+        if name != 'extract' and name not in selected:
+            continue
+        with metrics.stage(name):
+            result = func(results)
+        if name == 'extract':
+            results = {method: items for method, (items, _) in result.items()}
+        rows[name] = count_rows(result)
+
+    report = metrics.report()['stages']
+    return {name: {'wall_s'       : round(report[name]['wall_s'], 3),
+                   'rows'         : rows[name],
+                   'http_requests': report[name]['http']['requests'],
+                   'http_retries' : report[name]['http']['retries'],
+                   'http_p50_s'   : report[name]['http']['p50_s'],
+                   'http_p95_s'   : report[name]['http']['p95_s']}
+            for name in rows}
+
+
+def compare(stages: Dict[str, Dict[str, Any]], baseline: Optional[Dict[str, Any]]) -> pd.DataFrame:
+    df = pd.DataFrame.from_dict(stages, orient='index')
+    df['rows_per_s'] = (df['rows'] / df['wall_s']).round(0)
+    if baseline:
+        df['baseline_wall_s'] = pd.Series({k: v['wall_s'] for k, v in baseline['stages'].items()})
+        df['baseline_requests'] = pd.Series({k: v['http_requests'] for k, v in baseline['stages'].items()})
+        df['change_%'] = ((df['wall_s'] / df['baseline_wall_s'] - 1) * 100).round(1)
+    return df
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark Tableau extract, populate and transform on a local stub')
+    add_site_arguments(parser)
+    parser.add_argument('--stages', nargs='+', metavar='STAGE', default=['*'],
+                        help='stages to run besides extract (patterns like populate:* are allowed), '
+                             'legacy {} only when named explicitly'.format(', '.join(LEGACY_STAGES)))
+    parser.add_argument('--max-rate', type=float, default=0,
+                        help='TABLEAU_MAX_REQUESTS_PER_SECOND for the run, 0 - no limit')
+    parser.add_argument('--workers', type=int, help='TABLEAU_POPULATE_WORKERS for the run')
+    parser.add_argument('--baseline', type=Path, default=BASELINE_PATH, help='baseline to compare with')
+    parser.add_argument('--save-baseline', type=Path, metavar='PATH', help='save results as a new baseline')
+    args = parser.parse_args()
+
+    params = site_params(args)
+    run_params = {**params, 'latency': args.latency, 'jitter': args.jitter}
+    # Сбои сервера - в параметрах, только если заданы: baseline без сбоев остается сопоставимым
+    run_params.update({k: getattr(args, k) for k in ('error_rate', 'token_ttl') if getattr(args, k)})
+    started_at = time.perf_counter()
+    url, stub = start_process(params, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                              token_ttl=args.token_ttl)
+    print('Stub {} is ready in {:.1f}s: {}'.format(url, time.perf_counter() - started_at, params))
+
+    os.environ.update({'TABLEAU_SERVER_URL': url, 'TABLEAU_TOKEN_NAME': 'bench', 'TABLEAU_TOKEN_VALUE': 'bench',
+                       'TABLEAU_SITENAME': '', 'TABLEAU_CACHE': 'off',
+                       'TABLEAU_MAX_REQUESTS_PER_SECOND': str(args.max_rate)})
+    if args.workers:
+        os.environ['TABLEAU_POPULATE_WORKERS'] = str(args.workers)
+
+    try:
+        # Число потоков и ограничения запросов читаются из переменных окружения при импорте tableau,
+        # адрес сервера и токен - при первом обращении к сессии
+        from tableau import throttle, utils
+        # Настройки клиента, с которыми выполнен замер: с другими потоками и ограничениями baseline несопоставим
+        run_params.update({'workers'            : utils.POPULATE_WORKERS,
+                           'page_workers'       : utils.PAGE_WORKERS,
+                           'max_rate'           : throttle.MAX_REQUESTS_PER_SECOND,
+                           'burst'              : throttle.BURST,
+                           'initial_concurrency': throttle.INITIAL_CONCURRENCY,
+                           'max_concurrency'    : throttle.MAX_CONCURRENCY,
+                           'max_retries'        : throttle.MAX_RETRIES})
+        stages = make_stages(utils)
+        selected = [name for name in stages if any(fnmatch.fnmatchcase(name, p) for p in args.stages)
+                    and (name not in LEGACY_STAGES or name in args.stages)]
+        results = run(stages, selected)
+        stub_requests = requests.get(url + '/_stub/stats').json()['requests']
+    finally:
+        stub.terminate()
+
+    baseline = None
+    if args.baseline and args.baseline.exists() and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['params'] != run_params:
+            print('Baseline {} has other parameters: {}'.format(args.baseline, baseline['params']))
+            baseline = None
+
+    print(compare(results, baseline).to_string())
+    print('Stub requests: {}'.format(json.dumps(stub_requests, sort_keys=True)))
+
+    if args.save_baseline:
+        args.save_baseline.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'params'       : run_params,
+                       'machine'      : {'python': platform.python_version(), 'platform': platform.platform(),
+                                         'cpus': os.cpu_count()},
+                       'recorded_at'  : time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'stages'       : results,
+                       'stub_requests': stub_requests}, f, indent=2, sort_keys=True)
+        print('Baseline saved to {}'.format(args.save_baseline))
+
+
+if __name__ == '__main__':
+    main()
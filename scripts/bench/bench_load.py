@@ -0,0 +1,123 @@
+"""
+Бенчмарк загрузок в Vertica без базы: load (json и delimited), merge и load_custom из vertica.utils
+пишут в LocalSink, который принимает те же потоки COPY и разбирает их форматом из COPY.
+
+Для каждого пути загрузки, размера таблицы и размера порции (step) - время сериализации
+(без времени разбора в LocalSink), строки в секунду, объем потока COPY и пиковая память Python (tracemalloc,
+отдельным проходом, потому что tracemalloc замедляет сериализацию). Таблица - синтетическая tableau_workbooks.
+
+Запуск из папки scripts:
+    python -m bench.bench_load --rows 10000 100000 1000000
+    python -m bench.bench_load --rows 5000000 --paths load:delimited load:json --no-parse --no-memory
+    python -m bench.bench_load --rows 1000000 --steps 10000 50000 250000 --paths load:*
+"""
+import argparse
+import fnmatch
+import gc
+import json
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+import pandas as pd
+
+from bench.bench_copy_formats import make_workbooks_df
+from vertica.config_files.config_netology import Config
+from vertica.sinks import LocalSink
+
+TABLE_NAME = 'workbooks'
+
+
+def make_paths(utils) -> Dict[str, Callable[[pd.DataFrame, int], None]]:
+    """
+    Пути загрузки: функции (df, step) -> None
+    """
+    return {
+        'load:json'      : lambda df, step: utils.load(df, table_name=TABLE_NAME, copy_format='json', step=step),
+        'load:delimited' : lambda df, step: utils.load(df, table_name=TABLE_NAME, copy_format='delimited',
+                                                       step=step),
+        'merge:json'     : lambda df, step: utils.merge(df, table_name=TABLE_NAME, key_columns=['id'],
+                                                        copy_format='json', step=step),
+        'merge:delimited': lambda df, step: utils.merge(df, table_name=TABLE_NAME, key_columns=['id'],
+                                                        copy_format='delimited', step=step),
+        'load_custom'    : lambda df, step: utils.load_custom(df, table_name=TABLE_NAME, step=step),
+    }
+
+
+def measure(func: Callable[[], None], sink: LocalSink, memory: bool) -> Dict[str, float]:
+    """
+    Один проход загрузки: время или, если memory, пиковая память новых объектов Python
+    """
+    sink.reset()
+    gc.collect()
+    if memory:
+        tracemalloc.start()
+    started_at, cpu_started_at = time.perf_counter(), time.process_time()
+    func()
+    result = {'wall_s': time.perf_counter() - started_at, 'cpu_s': time.process_time() - cpu_started_at}
+    if memory:
+        result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return result
+
+
+def run(utils, sink: LocalSink, rows: List[int], paths: List[str], steps: List[int], memory: bool) -> pd.DataFrame:
+    load_paths = make_paths(utils)
+    results = []
+    for n in rows:
+        df = make_workbooks_df(n)
+        for path in paths:
+            for step in steps:
+                timing = measure(lambda: load_paths[path](df, step), sink, memory=False)
+                stats = dict(sink.stats)
+                if sink.parse and stats['rows'] != n:
+                    raise AssertionError('{} loaded {} rows of {}'.format(path, stats['rows'], n))
+
+                serialize_s = timing['wall_s'] - stats['parse_s']
+                result = {
+                    'rows'         : n,
+                    'path'         : path,
+                    'step'         : step,
+                    'wall_s'       : round(timing['wall_s'], 3),
+                    'parse_s'      : round(stats['parse_s'], 3),
+                    'serialize_s'  : round(serialize_s, 3),
+                    'rows_per_s'   : round(n / serialize_s) if serialize_s > 0 else None,
+                    'mb_on_wire'   : round(stats['bytes'] / 2 ** 20, 2),
+                    'bytes_per_row': round(stats['bytes'] / n, 1),
+                    'copies'       : stats['copies'],
+                }
+                if memory:
+                    peak = measure(lambda: load_paths[path](df, step), sink, memory=True)['peak_mb']
+                    result['peak_mb'] = round(peak, 1)
+                results.append(result)
+                print(json.dumps(result))
+        del df
+    return pd.DataFrame(results)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark Vertica load paths against a local sink')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--paths', nargs='+', default=['*'], metavar='PATH',
+                        help='load paths (patterns like load:* are allowed)')
+    parser.add_argument('--steps', type=int, nargs='+', default=[Config.default_step],
+                        help='rows serialized per chunk of the COPY stream')
+    parser.add_argument('--no-parse', action='store_true',
+                        help='only read COPY streams in the sink, do not parse them (for millions of rows)')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    args = parser.parse_args()
+
+    # Пул соединений с Vertica создается только при первом обращении, поэтому с use_sink он не создается
+    from vertica import utils
+
+    sink = LocalSink(parse=not args.no_parse)
+    utils.use_sink(sink)
+
+    paths = [p for p in make_paths(utils) if any(fnmatch.fnmatchcase(p, pattern) for pattern in args.paths)]
+    report = run(utils, sink, args.rows, paths, args.steps, memory=not args.no_memory)
+    print()
+    print(report.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Микробенчмарк разбора ответов GET /workbooks/{id}/revisions: RevisionItem.from_response
+(ElementTree + объект на каждую ревизию) против потокового revisions_to_columns (сразу столбцы).
+
+Ответы синтетические, сеть и Tableau Server не нужны. В оба замера входит построение DataFrame
+с одинаковыми типами столбцов.
+
+Запуск из папки scripts:
+    python -m bench.bench_revision_parser --workbooks 200 --revisions 300 --repeat 5
+"""
+import argparse
+import time
+import uuid
+from typing import Callable, List
+
+import pandas as pd
+
+from helper import attributes
+from tableau.revision_item import RevisionItem, revisions_to_columns
+
+NAMESPACE = {'t': 'http://tableau.com/api'}
+
+REVISION_XML = ('<revision revisionNumber="{number}" publishedAt="2020-{month:02d}-{day:02d}T10:{minute:02d}:00Z" '
+                'deleted="false" current="{current}" sizeInBytes="{size}">'
+                '<publisher id="{publisher_id}" name="User {publisher}" /></revision>')
+
+
+def make_response(revisions: int, publisher_ids: List[str]) -> bytes:
+    """
+    Синтетический ответ с revisions ревизиями одного workbook
+    """
+    body = ''.join(REVISION_XML.format(number=n + 1, month=n % 12 + 1, day=n % 28 + 1, minute=n % 60,
+                                       current=str(n == revisions - 1).lower(), size=1000 + n * 17,
+                                       publisher_id=publisher_ids[n % len(publisher_ids)],
+                                       publisher=n % len(publisher_ids))
+                   for n in range(revisions))
+    return ('<?xml version="1.0" encoding="UTF-8"?><tsResponse xmlns="http://tableau.com/api">'
+            '<pagination pageNumber="1" pageSize="{0}" totalAvailable="{0}" /><revisions>{1}</revisions>'
+            '</tsResponse>'.format(revisions, body)).encode('utf-8')
+
+
+def typed(df: pd.DataFrame) -> pd.DataFrame:
+    df['revision_number'] = df['revision_number'].astype('Int64')
+    df['published_at'] = pd.to_datetime(df['published_at'], utc=True)
+    df['size_in_bytes'] = df['size_in_bytes'].astype('Int64')
+    return df
+
+
+def parse_items(responses: List[bytes]) -> pd.DataFrame:
+    """
+    Текущий путь: объекты RevisionItem, затем таблица по атрибутам
+    """
+    items = [x for resp in responses for x in RevisionItem.from_response(resp, NAMESPACE)]
+    return typed(pd.DataFrame([[getattr(x, a) for a in attributes['revisions']] for x in items],
+                              columns=attributes['revisions']))
+
+
+def parse_columns(responses: List[bytes]) -> pd.DataFrame:
+    """
+    Новый путь: столбцы из iterparse, склеенные в одну таблицу
+    """
+    columns = {c: [] for c in attributes['revisions']}
+    for resp in responses:
+        for c, values in revisions_to_columns(resp, NAMESPACE).items():
+            columns[c].extend(values)
+    return typed(pd.DataFrame(columns, columns=attributes['revisions']))
+
+
+def measure(func: Callable[[List[bytes]], pd.DataFrame], responses: List[bytes], repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        func(responses)
+        timings.append(time.perf_counter() - started_at)
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark revisions response parsing')
+    parser.add_argument('--workbooks', type=int, default=200)
+    parser.add_argument('--revisions', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    publisher_ids = [str(uuid.uuid4()) for _ in range(50)]
+    responses = [make_response(args.revisions, publisher_ids) for _ in range(args.workbooks)]
+
+    expected, actual = parse_items(responses), parse_columns(responses)
+    # RevisionItem не сохраняет deleted/current = false, сравниваем остальные столбцы
+    compared = ['revision_number', 'published_at', 'size_in_bytes', 'publisher_id', 'publisher_name']
+    pd.testing.assert_frame_equal(expected[compared], actual[compared])
+
+    rows = args.workbooks * args.revisions
+    report = pd.DataFrame([
+        {'parser': name, 'rows': rows, 'median_s': pd.Series(timings).median(),
+         'rows_per_s': rows / pd.Series(timings).median()}
+        for name, timings in (('RevisionItem.from_response', measure(parse_items, responses, args.repeat)),
+                              ('revisions_to_columns', measure(parse_columns, responses, args.repeat)))
+    ])
+    print(report.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
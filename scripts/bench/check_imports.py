@@ -0,0 +1,144 @@
+"""
+Проверка времени и побочных эффектов импорта модулей проекта.
+
+Каждый модуль импортируется в отдельном процессе с python -X importtime, без переменных окружения
+TABLEAU_* и VERTICA_* и с запрещенными сетевыми соединениями. Импорт не должен падать, обращаться к сети,
+менять настройки logging и запускать потоки. Время импорта (всего и собственных модулей проекта,
+без сторонних библиотек) сравнивается с бюджетом; при превышении или побочных эффектах код возврата 1.
+
+Запуск из папки scripts:
+    python -m bench.check_imports
+    python -m bench.check_imports tableau.utils vertica.utils --budget-ms 1500 --own-budget-ms 50
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Set
+
+SCRIPTS_PATH = Path(__file__).parent.parent
+
+MODULES = ('tableau.utils', 'tableau.session', 'vertica.utils', 'vertica.sinks', 'metrics', 'pipeline',
+           'checkpoints')
+
+# Бюджеты по умолчанию: все время импорта модуля (pandas и tableauserverclient - основная часть)
+# и собственное время модулей проекта
+BUDGET_MS = 3000
+OWN_BUDGET_MS = 100
+
+ENV_PREFIXES = ('TABLEAU_', 'VERTICA_')
+
+# Выполняется в дочернем процессе: импорт модуля с запрещенной сетью, результат - JSON в stdout
+CHILD_CODE = '''
+import json, logging, socket, sys, threading
+
+connections = []
+
+def connect(self, address, *args, **kwargs):
+    connections.append(repr(address))
+    raise OSError('network access during import: {!r}'.format(address))
+
+socket.socket.connect = connect
+socket.socket.connect_ex = connect
+root = logging.getLogger()
+handlers, level, threads = list(root.handlers), root.level, threading.active_count()
+error = None
+try:
+    __import__(sys.argv[1])
+except BaseException as e:
+    error = '{}: {}'.format(type(e).__name__, e)
+print(json.dumps({'error'      : error,
+                  'connections': connections,
+                  'logging'    : list(root.handlers) != handlers or root.level != level,
+                  'threads'    : threading.active_count() - threads}))
+'''
+
+
+def own_packages() -> Set[str]:
+    """
+    Имена модулей и пакетов верхнего уровня из папки scripts
+    """
+    return {p.stem for p in SCRIPTS_PATH.glob('*.py')} | {p.name for p in SCRIPTS_PATH.iterdir()
+                                                          if p.is_dir() and any(p.glob('*.py'))}
+
+
+def parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    """
+    Строки вывода -X importtime: import time: <self us> | <cumulative us> | <module>
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append({'module': name.strip(), 'self_ms': int(self_us) / 1000,
+                        'cumulative_ms': int(cumulative_us) / 1000})
+    return imports
+
+
+def check(module: str, own: Set[str]) -> Dict[str, Any]:
+    env = {k: v for k, v in os.environ.items() if not k.startswith(ENV_PREFIXES)}
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD_CODE, module], cwd=str(SCRIPTS_PATH),
+                             env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0 or not process.stdout.strip():
+        return {'module': module, 'error': 'exit code {}: {}'.format(process.returncode, process.stderr[-1000:])}
+
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    imports = parse_importtime(process.stderr)
+    total = [i['cumulative_ms'] for i in imports if i['module'] == module]
+    own_imports = [i for i in imports if i['module'].split('.')[0] in own]
+    return {'module'     : module,
+            'total_ms'   : round(total[-1] if total else sum(i['self_ms'] for i in imports), 1),
+            'own_ms'     : round(sum(i['self_ms'] for i in own_imports), 1),
+            'slowest_own': sorted(own_imports, key=lambda i: i['self_ms'], reverse=True)[:3],
+            **result}
+
+
+def problems(result: Dict[str, Any], budget_ms: float, own_budget_ms: float) -> List[str]:
+    if result['error']:
+        return ['import failed: {}'.format(result['error'])]
+    found = []
+    if result['connections']:
+        found.append('network access: {}'.format(', '.join(result['connections'])))
+    if result['logging']:
+        found.append('logging configured at import')
+    if result['threads']:
+        found.append('{} threads started at import'.format(result['threads']))
+    if result['total_ms'] > budget_ms:
+        found.append('import takes {} ms, budget {} ms'.format(result['total_ms'], budget_ms))
+    if result['own_ms'] > own_budget_ms:
+        found.append('project modules take {} ms, budget {} ms (slowest: {})'.format(
+            result['own_ms'], own_budget_ms,
+            ', '.join('{module} {self_ms} ms'.format(**i) for i in result['slowest_own'])))
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Check import time and import side effects of project modules')
+    parser.add_argument('modules', nargs='*', default=list(MODULES))
+    parser.add_argument('--budget-ms', type=float, default=BUDGET_MS, help='total import time budget per module')
+    parser.add_argument('--own-budget-ms', type=float, default=OWN_BUDGET_MS,
+                        help='budget for self time of project modules, without third-party libraries')
+    args = parser.parse_args()
+
+    own = own_packages()
+    failed = False
+    for module in args.modules:
+        result = check(module, own)
+        found = problems(result, args.budget_ms, args.own_budget_ms)
+        failed = failed or bool(found)
+        if result['error']:
+            print('{:<20} FAIL'.format(module))
+        else:
+            print('{:<20} {:>8.1f} ms total {:>7.1f} ms own  {}'.format(module, result['total_ms'], result['own_ms'],
+                                                                        'FAIL' if found else 'ok'))
+        for problem in found:
+            print('    {}'.format(problem))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
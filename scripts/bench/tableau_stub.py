@@ -0,0 +1,518 @@
+"""
+Локальная замена Tableau Server для бенчмарков: HTTP-сервер с теми endpoints REST API, которые использует ETL
+(вход, serverInfo, workbooks и их revisions/connections/views, views сайта, datasources и их connections,
+projects, users и их workbooks, groups и их users, subscriptions, schedules), на синтетическом сайте.
+
+Ответы - XML в формате Tableau REST API, который разбирает TSC: постраничные (pageSize, pageNumber,
+totalAvailable), с фильтром updatedAt:gte для инкрементальной выгрузки. Задержка каждого ответа
+задается latency и jitter, сбои - error_rate (ответы 429 и 503) и token_ttl (истечение токена).
+Число запросов по маршрутам отдает служебный GET /_stub/stats.
+
+Отдельный запуск из папки scripts, чтобы направить на него etl_tableau.py:
+    python -m bench.tableau_stub --workbooks 10000 --port 8765
+    TABLEAU_SERVER_URL=http://127.0.0.1:8765 TABLEAU_SITENAME= python etl_tableau.py
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import quoteattr
+
+from bench.bench_revision_parser import REVISION_XML
+
+API_VERSION = '3.7'
+NAMESPACE = 'http://tableau.com/api'
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Доля workbooks с длинной историей (от страницы до max_revisions ревизий)
+LONG_HISTORY_SHARE = 0.01
+
+# Размеры синтетического сайта по умолчанию
+SCALES = {
+    'small' : {'workbooks': 500, 'projects': 50, 'users': 200, 'groups': 20, 'datasources': 100},
+    'medium': {'workbooks': 2000, 'projects': 300, 'users': 1000, 'groups': 60, 'datasources': 400},
+    'large' : {'workbooks': 10000, 'projects': 2000, 'users': 5000, 'groups': 200, 'datasources': 2000},
+}
+
+# Маршруты относительно /api/<version>; site - id сайта, id - id родителя
+ROUTES = [
+    ('POST', re.compile(r'^/auth/signin$'), 'signin'),
+    ('POST', re.compile(r'^/auth/signout$'), 'signout'),
+    ('GET', re.compile(r'^/serverInfo$'), 'server_info'),
+    ('GET', re.compile(r'^/schedules$'), 'schedules'),
+    ('GET', re.compile(r'^/sites/(?P<site>[^/]+)/(?P<collection>workbooks|views|datasources|projects|users|groups|'
+                       r'subscriptions)$'), 'collection'),
+    ('GET', re.compile(r'^/sites/(?P<site>[^/]+)/workbooks/(?P<id>[^/]+)/revisions$'), 'revisions'),
+    ('GET', re.compile(r'^/sites/(?P<site>[^/]+)/(?P<parent>workbooks|datasources|users|groups)/(?P<id>[^/]+)/'
+                       r'(?P<collection>connections|views|workbooks|users)$'), 'children'),
+]
+
+class SyntheticSite(object):
+    """
+    Детерминированный (по seed) сайт Tableau: XML каждой сущности строится один раз при создании,
+    ревизии - при запросе страницы. Дерево проектов глубиной до project_depth уровней,
+    число ревизий workbook распределено экспоненциально со средним revisions, у LONG_HISTORY_SHARE workbooks -
+    длинные истории на нескольких страницах
+    """
+
+    def __init__(self, workbooks: int = 1000, projects: int = 100, project_depth: int = 6, revisions: int = 20,
+                 max_revisions: int = 5000, views: int = 5, connections: int = 2, datasources: int = 200,
+                 users: int = 500, groups: int = 40, group_size: int = 50, subscriptions: int = 200,
+                 schedules: int = 20, seed: int = 0):
+        self.params = {k: v for k, v in locals().items() if k != 'self'}
+        self._rng = random.Random(seed)
+        self.site_id = self._uuid()
+        self.now = datetime(2021, 6, 1)
+
+        self.items: Dict[str, List[Tuple[str, str]]] = {}
+        self.children: Dict[Tuple[str, str, str], List[str]] = {}
+        self.revision_counts: Dict[str, int] = {}
+
+        project_ids = self._make_projects(projects, project_depth)
+        user_ids = self._make_users(users)
+        datasource_ids = self._make_datasources(datasources, project_ids, user_ids)
+        workbook_ids = self._make_workbooks(workbooks, views, connections, revisions, max_revisions, project_ids,
+                                            user_ids, datasource_ids)
+        self._make_groups(groups, group_size, user_ids)
+        schedule_ids = self._make_schedules(schedules)
+        self._make_subscriptions(subscriptions, schedule_ids, user_ids, workbook_ids)
+
+    def _uuid(self) -> str:
+        return str(uuid.UUID(int=self._rng.getrandbits(128), version=4))
+
+    def _timestamp(self, max_days: int = 1000) -> str:
+        return (self.now - timedelta(minutes=self._rng.randrange(max_days * 24 * 60))).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def _add(self, collection: str, xml: str, updated_at: str = '') -> None:
+        self.items.setdefault(collection, []).append((updated_at, xml))
+
+    def _make_projects(self, count: int, depth: int) -> List[str]:
+        ids, depths = [], []
+        for i in range(count):
+            parent = None
+            if ids and self._rng.random() > 0.1:
+                # Чаще продолжаем последнюю ветку, чтобы дерево было глубоким
+                candidate = len(ids) - 1 if self._rng.random() < 0.5 else self._rng.randrange(len(ids))
+                if depths[candidate] < depth - 1:
+                    parent = candidate
+            project_id = self._uuid()
+            ids.append(project_id)
+            depths.append(depths[parent] + 1 if parent is not None else 0)
+            self._add('projects', '<project id="{}" name="Project {}" description="Synthetic project {}" '
+                                  'contentPermissions="ManagedByOwner"{} />'.format(
+                project_id, i, i, ' parentProjectId="{}"'.format(ids[parent]) if parent is not None else ''))
+        return ids
+
+    def _make_users(self, count: int) -> List[str]:
+        ids = []
+        for i in range(count):
+            user_id = self._uuid()
+            ids.append(user_id)
+            self._add('users', '<user id="{}" name="user{}" fullName="User {}" email="user{}@example.com" '
+                               'siteRole="{}" lastLogin="{}" authSetting="ServerDefault" />'.format(
+                user_id, i, i, i, 'Viewer' if i % 10 else 'Creator', self._timestamp(30)))
+        return ids
+
+    def _connections_xml(self, count: int, datasource_ids: List[str]) -> List[str]:
+        return ['<connection id="{}" type="postgres" embedPassword="false" serverAddress="db{}.example.com" '
+                'serverPort="5432" userName="etl"><datasource id="{}" name="Datasource {}" /></connection>'.format(
+                    self._uuid(), n, datasource_id, datasource_id[:8])
+                for n, datasource_id in enumerate(self._rng.choice(datasource_ids) for _ in range(count))]
+
+    def _make_datasources(self, count: int, project_ids: List[str], user_ids: List[str]) -> List[str]:
+        ids = []
+        for i in range(count):
+            datasource_id = self._uuid()
+            ids.append(datasource_id)
+            updated_at = self._timestamp()
+            project = self._rng.randrange(len(project_ids))
+            self._add('datasources', '<datasource id="{}" name="Datasource {}" contentUrl="datasource_{}" '
+                                     'type="postgres" createdAt="{}" updatedAt="{}" isCertified="false" '
+                                     'encryptExtracts="false" hasExtracts="{}" useRemoteQueryAgent="false" '
+                                     'webpageUrl="http://tableau4/#/site/NetologyGroup/datasources/{}">'
+                                     '<project id="{}" name="Project {}" /><owner id="{}" /><tags />'
+                                     '<askData enablement="UseSiteDefault" /></datasource>'.format(
+                datasource_id, i, i, updated_at, updated_at, str(i % 3 == 0).lower(), i, project_ids[project],
+                project, self._rng.choice(user_ids)), updated_at)
+        for datasource_id in ids:
+            self.children['datasources', datasource_id, 'connections'] = self._connections_xml(1, ids)
+        return ids
+
+    def _make_workbooks(self, count: int, views: int, connections: int, revisions: int, max_revisions: int,
+                        project_ids: List[str], user_ids: List[str], datasource_ids: List[str]) -> List[str]:
+        ids = []
+        for i in range(count):
+            workbook_id = self._uuid()
+            ids.append(workbook_id)
+            updated_at, created_at = sorted([self._timestamp(), self._timestamp()], reverse=True)
+            project = self._rng.randrange(len(project_ids))
+            owner_id = self._rng.choice(user_ids)
+            tags = ''.join('<tag label="tag{}" />'.format(t) for t in range(i % 3))
+            self._add('workbooks', '<workbook id="{}" name="Workbook {}" contentUrl="workbook_{}" '
+                                   'webpageUrl="http://tableau4/#/site/NetologyGroup/workbooks/{}" showTabs="true" '
+                                   'size="{}" createdAt="{}" updatedAt="{}" description={}>'
+                                   '<project id="{}" name="Project {}" /><owner id="{}" /><tags>{}</tags>'
+                                   '</workbook>'.format(
+                workbook_id, i, i, i, self._rng.randint(1, 50), created_at, updated_at,
+                quoteattr('Synthetic workbook {} & "quotes"'.format(i)), project_ids[project], project, owner_id,
+                tags), updated_at)
+
+            view_count = self._rng.randint(1, 2 * views - 1) if views else 0
+            workbook_views = []
+            for v in range(view_count):
+                view_open = ('<view id="{}" name="Sheet {}" contentUrl="workbook_{}/sheets/Sheet{}" createdAt="{}" '
+                             'updatedAt="{}" sheetType="{}"><workbook id="{}" /><owner id="{}" /><project id="{}" />'
+                             '<tags />'.format(self._uuid(), v, i, v, created_at, updated_at,
+                                               'dashboard' if v == 0 else 'worksheet', workbook_id, owner_id,
+                                               project_ids[project]))
+                workbook_views.append(view_open)
+                self._add('views', view_open)
+            self.children['workbooks', workbook_id, 'views'] = workbook_views
+            self.children['workbooks', workbook_id, 'connections'] = self._connections_xml(
+                self._rng.randint(0, 2 * connections), datasource_ids)
+            self.children['users', owner_id, 'workbooks'] = \
+                self.children.get(('users', owner_id, 'workbooks'), []) + [self.items['workbooks'][-1][1]]
+            if self._rng.random() < LONG_HISTORY_SHARE:
+                self.revision_counts[workbook_id] = self._rng.randint(min(max_revisions, MAX_PAGE_SIZE), max_revisions)
+            else:
+                self.revision_counts[workbook_id] = min(max_revisions, 1 + int(self._rng.expovariate(1 / revisions)))
+        return ids
+
+    def _make_groups(self, count: int, group_size: int, user_ids: List[str]) -> None:
+        for i in range(count):
+            group_id = self._uuid()
+            self._add('groups', '<group id="{}" name="Group {}" />'.format(group_id, i))
+            # Размер групп от пустых до нескольких страниц
+            size = min(len(user_ids), int(self._rng.expovariate(1 / group_size))) if group_size else 0
+            members = self._rng.sample(range(len(user_ids)), size)
+            self.children['groups', group_id, 'users'] = [
+                self.items['users'][m][1] for m in sorted(members)]
+
+    def _make_schedules(self, count: int) -> List[str]:
+        ids = []
+        for i in range(count):
+            schedule_id = self._uuid()
+            ids.append(schedule_id)
+            self._add('schedules', '<schedule id="{}" name="Schedule {}" state="Active" priority="50" '
+                                   'createdAt="{}" updatedAt="{}" type="{}" frequency="Daily" '
+                                   'nextRunAt="2021-06-02T0{}:00:00Z" executionOrder="Parallel">'
+                                   '<frequencyDetails start="0{}:00:00" /></schedule>'.format(
+                schedule_id, i, self._timestamp(), self._timestamp(), 'Subscription' if i % 2 else 'Extract',
+                i % 10, i % 10))
+        return ids
+
+    def _make_subscriptions(self, count: int, schedule_ids: List[str], user_ids: List[str],
+                            workbook_ids: List[str]) -> None:
+        for i in range(count):
+            self._add('subscriptions', '<subscription id="{}" subject="Subscription {}"><content id="{}" '
+                                       'type="Workbook" /><schedule id="{}" /><user id="{}" /></subscription>'.format(
+                self._uuid(), i, self._rng.choice(workbook_ids), self._rng.choice(schedule_ids),
+                self._rng.choice(user_ids)))
+
+    def revisions(self, workbook_id: str, first: int, last: int) -> List[str]:
+        """
+        XML ревизий workbook с номерами first..last
+        """
+        count = self.revision_counts[workbook_id]
+        seed = int(workbook_id[:8], 16)
+        return [REVISION_XML.format(number=n, month=n % 12 + 1, day=n % 28 + 1, minute=(n + seed) % 60,
+                                    current=str(n == count).lower(), size=1000 + n * 17,
+                                    publisher_id='{:08x}-0000-4000-8000-000000000000'.format((seed + n) % 2 ** 32),
+                                    publisher=(seed + n) % 100)
+                for n in range(first, last + 1)]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Обработчик запросов: маршрут, задержка, проверка токена, страница ответа
+    """
+    protocol_version = 'HTTP/1.1'
+    # Заголовки и тело уходят отдельными пакетами: без этого keep-alive ждет задержанного ACK
+    disable_nagle_algorithm = True
+    server: 'StubServer'
+
+    def do_GET(self) -> None:
+        self._handle('GET')
+
+    def do_POST(self) -> None:
+        self._handle('POST')
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def _handle(self, method: str) -> None:
+        url = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        if url.path == '/_stub/stats':
+            return self._send(200, json.dumps(self.server.stats()).encode('utf-8'), 'application/json')
+
+        path = re.sub(r'^/api/[\d.]+', '', url.path) if url.path.startswith('/api/') else None
+        route, match = None, None
+        for route_method, pattern, name in ROUTES:
+            match = pattern.match(path) if path is not None and route_method == method else None
+            if match:
+                route = name
+                break
+
+        self.server.count(self._route_key(route, match.groupdict() if route else {}))
+        self.server.delay()
+
+        if route is None:
+            return self._error(404, '404000', 'Resource Not Found',
+                               '{} {} is not served by stub'.format(method, url.path))
+        if route not in ('signin', 'server_info'):
+            if not self.server.is_valid(self.headers.get('X-Tableau-Auth')):
+                return self._error(401, '401002', 'Unauthorized Access', 'Invalid authentication credentials')
+            status = self.server.injected_error()
+            if status:
+                self.server.count('error:{}'.format(status))
+                return self._error(status, '{}000'.format(status), 'Injected error', 'Injected by stub')
+
+        getattr(self, 'route_{}'.format(route))(query, body, **match.groupdict())
+
+    def route_signin(self, query: Dict[str, str], body: bytes) -> None:
+        self._xml('<credentials token="{}"><site id="{}" contentUrl="" /><user id="{}" /></credentials>'.format(
+            self.server.issue_token(), self.server.site.site_id, uuid.uuid4()))
+
+    def route_signout(self, query: Dict[str, str], body: bytes) -> None:
+        self._send(204, b'')
+
+    def route_server_info(self, query: Dict[str, str], body: bytes) -> None:
+        self._xml('<serverInfo><productVersion build="20201.20.0220.1710">2020.1.0</productVersion>'
+                  '<restApiVersion>{}</restApiVersion></serverInfo>'.format(API_VERSION))
+
+    def route_schedules(self, query: Dict[str, str], body: bytes) -> None:
+        self._page('schedules', [xml for _, xml in self.server.site.items.get('schedules', [])], query)
+
+    def route_collection(self, query: Dict[str, str], body: bytes, site: str, collection: str) -> None:
+        items = self.server.site.items.get(collection, [])
+        updated_since = re.search(r'updatedAt:gte:([^,]+)', query.get('filter', ''))
+        if updated_since:
+            items = [x for x in items if x[0] >= updated_since.group(1)]
+        xml = [x for _, x in items]
+        if collection == 'views':
+            usage = query.get('includeUsageStatistics') == 'true'
+            xml = [self._close_view(x, usage) for x in xml]
+        self._page(collection, xml, query)
+
+    def route_children(self, query: Dict[str, str], body: bytes, site: str, parent: str, id: str,
+                       collection: str) -> None:
+        xml = self.server.site.children.get((parent, id, collection))
+        if xml is None and parent not in ('users', 'groups'):
+            return self._error(404, '404006', 'Resource Not Found', '{} {} not found'.format(parent, id))
+        xml = xml or []
+        if collection == 'views':
+            xml = [self._close_view(x, False) for x in xml]
+        self._page(collection, xml, query)
+
+    def route_revisions(self, query: Dict[str, str], body: bytes, site: str, id: str) -> None:
+        total = self.server.site.revision_counts.get(id)
+        if total is None:
+            return self._error(404, '404006', 'Resource Not Found', 'Workbook {} not found'.format(id))
+        page_number, page_size = self._paging(query)
+        first = (page_number - 1) * page_size + 1
+        if first > total and page_number > 1:
+            return self._error(400, '400006', 'Invalid page number', 'Page {} is out of range'.format(page_number))
+        revisions = self.server.site.revisions(id, first, min(total, first + page_size - 1))
+        self._xml(self._pagination(page_number, page_size, total) +
+                  '<revisions>{}</revisions>'.format(''.join(revisions)))
+
+    @staticmethod
+    def _route_key(route: Optional[str], groups: Dict[str, str]) -> str:
+        """
+        Маршрут для статистики: коллекция (workbooks) или родитель и коллекция (workbooks/connections)
+        """
+        if route == 'collection':
+            return groups['collection']
+        if route == 'children':
+            return '{}/{}'.format(groups['parent'], groups['collection'])
+        if route == 'revisions':
+            return 'workbooks/revisions'
+        return route or 'not_found'
+
+    @staticmethod
+    def _close_view(view_open: str, usage: bool) -> str:
+        return view_open + ('<usage totalViewCount="{}" />'.format(len(view_open) * 7 % 1000) if usage else '') + \
+               '</view>'
+
+    @staticmethod
+    def _paging(query: Dict[str, str]) -> Tuple[int, int]:
+        return max(1, int(query.get('pageNumber', 1))), \
+               min(MAX_PAGE_SIZE, max(1, int(query.get('pageSize', DEFAULT_PAGE_SIZE))))
+
+    @staticmethod
+    def _pagination(page_number: int, page_size: int, total: int) -> str:
+        return '<pagination pageNumber="{}" pageSize="{}" totalAvailable="{}" />'.format(page_number, page_size, total)
+
+    def _page(self, collection: str, xml: List[str], query: Dict[str, str]) -> None:
+        page_number, page_size = self._paging(query)
+        start = (page_number - 1) * page_size
+        if start >= len(xml) and page_number > 1:
+            return self._error(400, '400006', 'Invalid page number', 'Page {} is out of range'.format(page_number))
+        self._xml(self._pagination(page_number, page_size, len(xml)) + '<{0}>{1}</{0}>'.format(
+            collection, ''.join(xml[start:start + page_size])))
+
+    def _xml(self, content: str, status: int = 200) -> None:
+        self._send(status, '<?xml version="1.0" encoding="UTF-8"?><tsResponse xmlns="{}">{}</tsResponse>'.format(
+            NAMESPACE, content).encode('utf-8'), 'application/xml')
+
+    def _error(self, status: int, code: str, summary: str, detail: str) -> None:
+        self._xml('<error code="{}"><summary>{}</summary><detail>{}</detail></error>'.format(code, summary, detail),
+                  status)
+
+    def _send(self, status: int, content: bytes, content_type: Optional[str] = None) -> None:
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    HTTP-сервер на синтетическом сайте: каждый запрос в своем потоке, задержка latency +- jitter секунд.
+    error_rate - доля запросов с токеном, на которые сервер отвечает 429 или 503, token_ttl - через сколько
+    секунд после входа токен перестает действовать (0 - бессрочно)
+    """
+    daemon_threads = True
+
+    def __init__(self, site: SyntheticSite, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 jitter: float = 0.0, error_rate: float = 0.0, token_ttl: float = 0.0):
+        super(StubServer, self).__init__((host, port), StubHandler)
+        self.site = site
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.token_ttl = token_ttl
+        self._tokens: Dict[str, float] = {}
+        self._requests: Counter = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return 'http://{}:{}'.format(*self.server_address[:2])
+
+    def issue_token(self) -> str:
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._tokens[token] = time.monotonic()
+        return token
+
+    def is_valid(self, token: Optional[str]) -> bool:
+        with self._lock:
+            issued_at = self._tokens.get(token)
+        return issued_at is not None and (not self.token_ttl or time.monotonic() - issued_at < self.token_ttl)
+
+    def injected_error(self) -> Optional[int]:
+        if self.error_rate and random.random() < self.error_rate:
+            return random.choice((429, 503))
+        return None
+
+    def count(self, route: str) -> None:
+        with self._lock:
+            self._requests[route] += 1
+
+    def delay(self) -> None:
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {'requests': dict(self._requests), 'total': sum(self._requests.values())}
+
+    def start(self) -> threading.Thread:
+        """
+        Обслуживать запросы в фоновом потоке
+        """
+        thread = threading.Thread(target=self.serve_forever, name='tableau-stub', daemon=True)
+        thread.start()
+        return thread
+
+
+def _serve(site_params: Dict[str, int], latency: float, jitter: float, port: int, error_rate: float,
+           token_ttl: float, conn) -> None:
+    server = StubServer(SyntheticSite(**site_params), port=port, latency=latency, jitter=jitter,
+                        error_rate=error_rate, token_ttl=token_ttl)
+    conn.send(server.url)
+    conn.close()
+    server.serve_forever()
+
+
+def start_process(site_params: Dict[str, int], latency: float = 0.0, jitter: float = 0.0, port: int = 0,
+                  error_rate: float = 0.0, token_ttl: float = 0.0) -> Tuple[str, multiprocessing.Process]:
+    """
+    Запускает сервер в отдельном процессе, чтобы его работа не занимала GIL измеряемого процесса.
+    Возвращает адрес сервера и процесс (остановить - process.terminate())
+    """
+    parent_conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_serve, args=(site_params, latency, jitter, port, error_rate, token_ttl,
+                                                                    child_conn),
+                                      name='tableau-stub', daemon=True)
+    process.start()
+    url = parent_conn.recv()
+    return url, process
+
+
+def add_site_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Параметры синтетического сайта и задержки в командной строке
+    """
+    parser.add_argument('--scale', choices=SCALES, default='small', help='preset of site size')
+    for name in ('workbooks', 'projects', 'project_depth', 'revisions', 'max_revisions', 'views', 'connections',
+                 'datasources', 'users', 'groups', 'group_size', 'subscriptions', 'schedules', 'seed'):
+        parser.add_argument('--{}'.format(name.replace('_', '-')), type=int, dest=name,
+                            help='overrides --scale')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random +- seconds added to latency')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of authenticated requests answered with 429 or 503')
+    parser.add_argument('--token-ttl', type=float, default=0.0,
+                        help='seconds after sign-in when the token expires, 0 - never')
+
+
+def site_params(args: argparse.Namespace) -> Dict[str, int]:
+    params = dict(SCALES[args.scale])
+    params.update({k: v for k, v in vars(args).items()
+                   if v is not None and k in SyntheticSite.__init__.__code__.co_varnames})
+    return params
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Local Tableau REST API stand-in on a synthetic site')
+    add_site_arguments(parser)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    started_at = time.perf_counter()
+    site = SyntheticSite(**site_params(args))
+    server = StubServer(site, port=args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        token_ttl=args.token_ttl)
+    print('Site {} generated in {:.1f}s: {}'.format(site.site_id, time.perf_counter() - started_at, ', '.join(
+        '{} {}'.format(len(v), k) for k, v in site.items.items())))
+    print('Revisions: {}, pages of {}: {}'.format(
+        sum(site.revision_counts.values()), MAX_PAGE_SIZE,
+        sum(math.ceil(n / MAX_PAGE_SIZE) for n in site.revision_counts.values())))
+    print('Serving Tableau REST API {} on {}'.format(API_VERSION, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Состояние запуска пайплайна на диске: статус каждого шага и его результат,
+чтобы упавший запуск можно было продолжить с первого незавершенного шага
+"""
+import json
+import logging
+import pickle
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import pandas as pd
+
+STATE_PATH = Path.cwd().parent / 'data' / 'state' / 'pipeline'
+
+DONE = 'done'
+FAILED = 'failed'
+
+
+class RunState(object):
+    """
+    state.json хранит {stage: {status, file, duration, finished_at}}, результаты шагов лежат рядом:
+    DataFrame - в Parquet (столбцы со сложными объектами, которые Parquet не сохраняет, - через pickle),
+    остальное - через pickle. Результат, который нельзя сохранить, не сохраняется:
+    при продолжении такой шаг выполняется заново, если его результат нужен
+    """
+
+    def __init__(self, path: Path = STATE_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict[str, Any]] = {}
+        state_file = self.path / 'state.json'
+        if state_file.exists():
+            with open(state_file) as f:
+                self._stages = json.load(f)
+
+    def reset(self) -> None:
+        """
+        Начать новый запуск: удалить состояние и результаты предыдущего
+        """
+        with self._lock:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self._stages = {}
+
+    def status(self, name: str) -> Optional[str]:
+        return self._stages.get(name, {}).get('status')
+
+    def is_restorable(self, name: str) -> bool:
+        """
+        Шаг завершен и его результат сохранен
+        """
+        stage = self._stages.get(name, {})
+        return stage.get('status') == DONE and stage.get('file') is not None
+
+    def save(self, name: str, result: Any, duration: float) -> None:
+        """
+        Сохраняет результат шага и отмечает шаг выполненным
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        file_name = None
+        try:
+            file_name = self._write_result(name, result)
+        except Exception as e:
+            logging.warning('Result of stage {} is not checkpointed: {}'.format(name, e))
+
+        self._update(name, {'status': DONE, 'file': file_name, 'duration': duration, 'finished_at': time.time()})
+
+    def fail(self, name: str, error: BaseException) -> None:
+        self._update(name, {'status': FAILED, 'file': None, 'error': str(error), 'finished_at': time.time()})
+
+    def load(self, name: str) -> Any:
+        """
+        Результат завершенного шага
+        """
+        file_path = self.path / self._stages[name]['file']
+        if file_path.suffix == '.parquet':
+            return pd.read_parquet(file_path)
+        with open(file_path, 'rb') as f:
+            return pickle.load(f)
+
+    def _write_result(self, name: str, result: Any) -> str:
+        base_name = name.replace(':', '__')
+        if isinstance(result, pd.DataFrame):
+            try:
+                file_name = base_name + '.parquet'
+                self._atomic_write(file_name, lambda p: result.to_parquet(p, index=False))
+                return file_name
+            except (ImportError, ValueError, TypeError, NotImplementedError) as e:
+                # Например, объекты TSC в столбце interval_item
+                logging.info('Stage {} result is saved with pickle: {}'.format(name, e))
+
+        file_name = base_name + '.pickle'
+        self._atomic_write(file_name, lambda p: p.write_bytes(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)))
+        return file_name
+
+    def _atomic_write(self, file_name: str, write) -> None:
+        tmp_path = self.path / (file_name + '.tmp')
+        try:
+            write(tmp_path)
+            tmp_path.replace(self.path / file_name)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def _update(self, name: str, values: Dict[str, Any]) -> None:
+        with self._lock:
+            self._stages[name] = values
+            self.path.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path / 'state.json.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self._stages, f, indent=2, sort_keys=True)
+            tmp_path.replace(self.path / 'state.json')
@@ -2,168 +2,632 @@
 # coding: utf-8
 
 # # Import
+import argparse
 import logging.config
-from typing import Collection
+import math
+import time
+import warnings
+from pathlib import Path
+from typing import Any, Callable, Collection, Dict, List, Optional
 
 import pandas as pd
 import tableauserverclient as TSC
 
-from helper import attributes
-from tableau.utils import download, download_png, get_items, get_populate_items, make_df, make_project_path
-from vertica.utils import load, load_custom, make_foreign_keys, make_link_table
+from checkpoints import STATE_PATH, RunState
+from helper import attributes, dtypes
+from metrics import metrics
+from pipeline import Pipeline, StageFunc
+from shards import SHARD_KEYS, Shard, check_shards, merge_shard_results
+from tableau.downloads import DownloadManager
+from tableau.project_hierarchy import ProjectHierarchy
+from tableau.records import LinkRecord
+from tableau.utils import (count_items, download, download_png, get_endpoint, get_group_members, get_items,
+                           get_populate_items, get_revisions_df, make_df, sorted_options, updated_since_options)
+from tableau.watermarks import get_watermark, max_updated_at, set_watermark
+from vertica.utils import (bytes_saved, get_max_values, load, load_changed, load_custom, make_foreign_keys,
+                           make_link_table, make_reference_column, merge, referenced_tables)
 
 # # Logging
 
+warnings.filterwarnings("ignore")
+logging.captureWarnings(True)
 logging.config.fileConfig('logging.conf')
 logging.info('Start ETL Tableau')
 
+# # Arguments
+
+# Сущности, которые выгружаются целиком; вложенные сущности выгружаются вместе со своими родителями
+ENDPOINTS = ('workbooks', 'datasources', 'projects', 'users', 'groups', 'subscriptions', 'schedules')
+DOWNLOADS = ('preview_image', 'workbooks', 'datasources')
+
+parser = argparse.ArgumentParser(description='ETL Tableau Server -> Vertica')
+parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS), metavar='ENDPOINT',
+                    help='endpoints to process with their nested items: {}'.format(', '.join(ENDPOINTS)))
+parser.add_argument('--resume', action='store_true',
+                    help='continue the last run from the first incomplete stage')
+parser.add_argument('--only', nargs='+', metavar='STAGE',
+                    help='run only these stages (patterns like load:* are allowed), '
+                         'results of other stages are taken from the last run')
+parser.add_argument('--dry-run', action='store_true',
+                    help='print stages to run, planned Tableau Server requests and foreign keys to create, '
+                         'run nothing')
+parser.add_argument('--shard', metavar='INDEX/COUNT',
+                    help='populate nested items of workbooks and datasources only for shard INDEX (from 0) of COUNT, '
+                         'nothing is loaded: results are loaded by a run with --merge-shards COUNT')
+parser.add_argument('--shard-by', choices=SHARD_KEYS, default='id',
+                    help='split workbooks and datasources by id or by project (default id)')
+parser.add_argument('--merge-shards', type=int, metavar='COUNT',
+                    help='take results of sharded populate stages from COUNT shard runs instead of running them')
+parser.add_argument('--cycle-id', default=time.strftime('%Y-%m-%d'),
+                    help='ETL cycle of shard runs and their merge: the merge takes only shards of the same cycle '
+                         '(default today, pass it explicitly if shards and merge may run on different days)')
+parser.add_argument('--state-dir', type=Path, default=STATE_PATH,
+                    help='checkpoints of the run, shard runs keep theirs next to it (default {})'.format(STATE_PATH))
+parser.add_argument('--download', nargs='+', choices=DOWNLOADS, default=[], metavar='ITEM',
+                    help='download files: {}'.format(', '.join(DOWNLOADS)))
+parser.add_argument('--download-with-extract', action='store_true', help='download workbooks and datasources '
+                                                                         'with extracts')
+parser.add_argument('--incremental', action='store_true',
+                    help='only workbooks and datasources updated since the last run')
+parser.add_argument('--revisions-only-new', action='store_true',
+                    help='only revisions newer than the ones in tableau_workbooks_revisions')
+parser.add_argument('--views-bulk', action='store_true',
+                    help='take views from one site-wide list instead of populating views of every workbook: '
+                         'fewer requests, but position is order by view name instead of sheet order')
+parser.add_argument('--views-usage', action='store_true',
+                    help='load total_views of views (with --views-bulk: the site-wide list returns them at no cost)')
+parser.add_argument('--membership-per-item', action='store_true',
+                    help='populate workbooks of every user and users of every group. Without it '
+                         'tableau_users_workbooks links users only to workbooks they own; with it - to every workbook '
+                         'the server returns for the user, owned or viewable')
+parser.add_argument('--no-fingerprints', action='store_true', help='full loads without row fingerprints')
+parser.add_argument('--metrics-to-vertica', action='store_true', help='append run metrics to tableau_run_metrics')
+args = parser.parse_args()
+
+try:
+    SHARD = Shard.parse(args.shard, args.shard_by) if args.shard else None
+except ValueError as e:
+    parser.error(str(e))
+if SHARD and args.merge_shards:
+    parser.error('--shard and --merge-shards can not be used together')
+if args.views_usage and not args.views_bulk:
+    parser.error('--views-usage requires --views-bulk')
+if SHARD:
+    # Части обычно запускаются одновременно: отчет каждой - в своем файле
+    metrics.run_id += '_shard-{}-of-{}'.format(SHARD.index, SHARD.count)
+
 # # Variables
-DOWNLOAD_PNG = False
-DOWNLOAD_WORKBOOK = False
-DOWNLOAD_DATASOURCE = False
-DOWNLOAD_WITHOUT_EXTRACT = True
+DOWNLOAD_PNG = 'preview_image' in args.download
+DOWNLOAD_WORKBOOK = 'workbooks' in args.download
+DOWNLOAD_DATASOURCE = 'datasources' in args.download
+DOWNLOAD_WITHOUT_EXTRACT = not args.download_with_extract
+INCREMENTAL = args.incremental
+# Забирать только ревизии новее сохраненных в tableau_workbooks_revisions и дописывать их MERGE по ключу
+REVISIONS_ONLY_NEW = args.revisions_only_new
+
+# Views одним постраничным списком по всему сайту вместо запроса на каждый workbook (только с --views-bulk):
+# в общем списке нет порядка листов, position - номер view в workbook по имени, а не по порядку листов.
+# VIEWS_USAGE - вместе со статистикой просмотров (total_views)
+VIEWS_BULK = args.views_bulk
+VIEWS_USAGE = args.views_usage
+
+# Связи пользователей с workbooks по owner_id уже выгруженных workbooks, пользователи групп -
+# постраничными запросами в общем пуле потоков вместо populate на каждого пользователя и группу.
+# Смысл tableau_users_workbooks меняется: только владелец workbook, а не все workbooks, которые сервер
+# возвращает пользователю (его и доступные ему на просмотр), - те только с --membership-per-item
+MEMBERSHIP_BULK = not args.membership_per_item
+
+# Полные загрузки через отпечатки строк (tableau_fingerprints): в Vertica передаются только изменения
+FINGERPRINTS = not args.no_fingerprints
+
+# Кроме JSON-отчета в data/reports дописывать метрики запуска в Vertica (tableau_run_metrics)
+METRICS_TO_VERTICA = args.metrics_to_vertica
+
+# endpoints, которые в инкрементальном режиме забираются с фильтром по updatedAt
+INCREMENTAL_METHODS = ('workbooks', 'datasources')
+watermarks = {m: get_watermark(m) for m in INCREMENTAL_METHODS}
+
+# Без сохраненных watermarks (первый запуск) делаем полную выгрузку
+INCREMENTAL = INCREMENTAL and all(watermarks.values())
+
+# Сколько шагов одновременно: запросы к Tableau Server, преобразования в pandas, загрузки в Vertica
+BACKEND_LIMITS = {'tableau': 4, 'cpu': 2, 'vertica': 2}
+
+# Шаги populate, которые делятся между запусками с --shard: родители - workbooks и datasources
+SHARDED_METHODS = ('workbooks', 'datasources')
+SHARDED_STAGES = ('populate:workbooks_revisions', 'populate:connections', 'populate:datasources_connections',
+                  *([] if VIEWS_BULK else ['populate:views']))
+# От этого зависят результаты частей: у частей и сборки должно совпадать (shards.check_shards)
+SHARD_FLAGS = {'incremental': INCREMENTAL, 'revisions_only_new': REVISIONS_ONLY_NEW, 'views_bulk': VIEWS_BULK,
+               'watermarks': watermarks if INCREMENTAL else None}
+
+# Запросы шагов к Tableau Server для --dry-run: по одному на каждую сущность endpoint (populate и download)
+STAGE_REQUESTS = {
+    'populate:workbooks_revisions'    : 'workbooks',
+    'populate:connections'            : 'workbooks',
+    'populate:datasources_connections': 'datasources',
+    'populate:groups_users'           : 'groups',
+    'download:preview_image'          : 'workbooks',
+    'download:workbooks'              : 'workbooks',
+    'download:datasources'            : 'datasources',
+    **({} if VIEWS_BULK else {'populate:views': 'workbooks'}),
+    **({} if MEMBERSHIP_BULK else {'populate:users_workbooks': 'users'}),
+}
 
 
 # # Functions
 
-def et(method: str) -> (TSC.server.endpoint.endpoint.QuerysetEndpoint, Collection, pd.DataFrame):
+def extract(method: str) -> StageFunc:
+    """
+    Extract: забрать все сущности endpoint. В инкрементальном режиме workbooks и datasources - только измененные,
+    с --shard - только своя часть workbooks и datasources.
+    Результат - только список сущностей (без endpoint), чтобы его можно было сохранить в контрольной точке
+    """
+
+    def stage(results: Dict[str, Any]) -> List[object]:
+        items, _ = get_items(method, extract_options(method))
+        if SHARD and method in SHARDED_METHODS:
+            items = SHARD.select(items)
+            logging.info('Shard {}: {} {}'.format(SHARD, len(items), method))
+        return items
+
+    return stage
+
+
+def transform(method: str, func: Optional[Callable[[pd.DataFrame, Collection], pd.DataFrame]] = None) -> StageFunc:
+    """
+    Transform для обычного кейса: сделать таблицу из сущностей endpoint, func - дополнительная обработка таблицы
+    """
+
+    def stage(results: Dict[str, Any]) -> pd.DataFrame:
+        items = results['extract:{}'.format(method)]
+        df = make_df(items, attributes[method], dtypes)
+        return func(df, items) if func else df
+
+    return stage
+
+
+def populate(method: str, populate_method: str, column_id: Optional[str] = None) -> StageFunc:
     """
-    Extract and transform для обычного кейса: забрать все данные для одного endpoint и сделать таблицу
+    Забрать вложенные сущности populate_method для всех сущностей method и сделать таблицу.
+    column_id - столбец, в который записывается id родителя
     """
-    items, endpoint = get_items(method)
-    df = make_df(items, attributes[method])
-    return endpoint, items, df
+
+    def stage(results: Dict[str, Any]) -> pd.DataFrame:
+        items, endpoint = results['extract:{}'.format(method)], get_endpoint(method)
+        populate_items = get_populate_items(items, endpoint, populate_method)
+        df = make_df(populate_items, attributes[populate_method], dtypes)
+        if column_id:
+            df[column_id] = pd.Series([x.parent_id for x in populate_items], dtype='string')
+        return df
+
+    return stage
 
 
-def etl(method: str) -> (TSC.server.endpoint.endpoint.QuerysetEndpoint, Collection, pd.DataFrame):
+def populate_links(method: str, populate_method: str) -> StageFunc:
     """
-    ETL для обычного кейса: забрать все данные для одного endpoint и загрузить их в таблицу с соответствующим названием.
+    Забрать вложенные сущности populate_method для всех сущностей method и сделать таблицу связи
     """
-    endpoint, items, df = et(method)
-    load(df, table_name=method)
-    return endpoint, items, df
 
+    def stage(results: Dict[str, Any]) -> pd.DataFrame:
+        items, endpoint = results['extract:{}'.format(method)], get_endpoint(method)
+        populate_items = get_populate_items(items, endpoint, populate_method)
+        df, _ = make_link_table(populate_items, method, populate_method)
+        return df
 
-def make_df_for_populated(populate_method: str) -> pd.DataFrame:
-    populate_items = get_populate_items(items, endpoint, populate_method)
-    return make_df([x[0] for x in populate_items], attributes[populate_method])
+    return stage
 
 
-def make_df_for_populated_with_id(populate_method: str, column_id: str = 'workbook_id') -> pd.DataFrame:
-    populate_items = get_populate_items(items, endpoint, populate_method)
-    df = make_df([x[0] for x in populate_items], attributes[populate_method])
-    df[column_id] = [x[1] for x in populate_items]
+def populate_revisions(results: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Ревизии workbooks. В режиме REVISIONS_ONLY_NEW - начиная с последней сохраненной ревизии каждого workbook
+    """
+    items, endpoint = results['extract:workbooks'], get_endpoint('workbooks')
+    since = get_max_values('workbooks_revisions', 'workbook_id', 'revision_number') if REVISIONS_ONLY_NEW else None
+    return get_revisions_df(items, endpoint, dtypes, since=since)
+
+
+def load_full(df: pd.DataFrame, table_name: str, key_columns: Optional[List[str]] = None) -> None:
+    """
+    Полная загрузка таблицы. С FINGERPRINTS и ключом строки в Vertica передаются только изменения (load_changed)
+    """
+    if FINGERPRINTS and key_columns:
+        load_changed(df, table_name=table_name, key_columns=key_columns)
+    else:
+        load(df, table_name=table_name)
+
+
+def load_delta(df: pd.DataFrame, table_name: str, parent_column: Optional[str] = None,
+               key_columns: Optional[List[str]] = None, parent_ids: Optional[Collection[str]] = None) -> None:
+    """
+    Загрузка таблиц, зависящих от updated_at workbooks и datasources.
+    В инкрементальном режиме MERGE дельты: по id или, если задан parent_column, заменой всех строк измененных родителей
+    parent_ids (в том числе тех, у кого вложенных сущностей не осталось).
+    Иначе полная загрузка таблицы, key_columns - ключ строки для load_full
+    """
+    if not INCREMENTAL:
+        load_full(df, table_name=table_name, key_columns=key_columns)
+    elif parent_column:
+        merge(df, table_name=table_name, delete_by=parent_column, delete_ids=parent_ids)
+    else:
+        merge(df, table_name=table_name, key_columns=['id'])
+
+
+def add_load(name: str, source: str, table_name: str, columns: Collection[str],
+             func: Optional[Callable[..., None]] = None, deps: Collection[str] = (),
+             key_columns: Optional[List[str]] = None, parent: Optional[str] = None) -> None:
+    """
+    Добавляет шаг загрузки таблицы table_name из результата шага source.
+    columns нужны, чтобы вывести порядок загрузки из внешних ключей.
+    Без func таблица загружается полностью через load_full с ключом строки key_columns (по умолчанию id).
+    parent - endpoint родителей вложенных сущностей: func получает еще parent_ids, id выгруженных родителей
+    """
+    key_columns = key_columns or ['id']
+    func = func or (lambda df: load_full(df, table_name=table_name, key_columns=key_columns))
+    if parent:
+        extract_stage = 'extract:{}'.format(parent)
+        pipeline.add(name, lambda results: func(results[source], parent_ids=[i.id for i in results[extract_stage]]),
+                     deps=[source, extract_stage, *deps], backend='vertica')
+    else:
+        pipeline.add(name, lambda results: func(results[source]), deps=[source, *deps], backend='vertica')
+    loads[name] = (table_name, columns)
+
+
+def save_watermarks(results: Dict[str, Any]) -> None:
+    """
+    Сохраняем watermarks только после успешной загрузки, чтобы упавший запуск повторил ту же дельту
+    """
+    for method in INCREMENTAL_METHODS:
+        if 'extract:{}'.format(method) not in results:
+            continue
+        items = results['extract:{}'.format(method)]
+        watermark = max_updated_at(items) or watermarks[method]
+        if watermark:
+            set_watermark(method, watermark)
+
+
+def add_project_hierarchy(df: pd.DataFrame, items: Collection) -> pd.DataFrame:
+    """
+    path, depth, root_project_id, ancestor_ids из индекса иерархии, построенного один раз
+    """
+    return df.merge(ProjectHierarchy(items).to_df(), on='id', how='left')
+
+
+def split_subscription_target(df: pd.DataFrame, items: Collection) -> pd.DataFrame:
+    targets = df.pop('target')
+    df['target_type'] = pd.Series([x.type for x in targets], dtype='string')
+    df['target_id'] = pd.Series([x.id for x in targets], dtype='string')
     return df
 
 
-# # Workbooks
+def views_position(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Номер view внутри workbook в порядке строк df: для views одного workbook сервер возвращает их
+    в порядке листов, в bulk_views строки отсортированы по имени
+    """
+    df['position'] = df.groupby('workbook_id', sort=False).cumcount() + 1
+    del df['owner_id'], df['project_id'], df['tags']
+    return df
+
+
+def bulk_views(results: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Views из общего списка сайта для workbooks, выгруженных в этом запуске (в инкрементальном режиме - измененных).
+    Порядка листов в общем списке нет, поэтому position - номер view в workbook по имени (при равных именах - по id),
+    одинаковый от запуска к запуску
+    """
+    views = results['extract:views']
+    workbooks = results['extract:workbooks']
+    workbook_ids = {i.id for i in workbooks}
+    views = sorted((v for v in views if v.workbook_id in workbook_ids), key=lambda v: (v.name or '', v.id))
+
+    df = make_df(views, attributes['views'], dtypes)
+    if VIEWS_USAGE:
+        df['total_views'] = pd.Series([v.total_views for v in views], dtype='Int64')
+    return views_position(df)
+
 
-method = 'workbooks'
-endpoint, items, _ = etl(method)
+def download_all(method: str) -> StageFunc:
+    """
+    Скачать измененные с прошлого запуска workbooks или datasources
+    """
 
-# ## Download
+    def stage(results: Dict[str, Any]) -> Dict[str, int]:
+        items = results['extract:{}'.format(method)]
+        return DownloadManager(method).run(items, lambda i: download(i, method, no_extract=DOWNLOAD_WITHOUT_EXTRACT))
 
-# ### Download preview_image
+    return stage
 
-if DOWNLOAD_PNG:
-    for i in items:
+
+def download_previews(results: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Скачать preview_image измененных с прошлого запуска workbooks
+    """
+    items, endpoint = results['extract:workbooks'], get_endpoint('workbooks')
+
+    def fetch(i):
         endpoint.populate_preview_image(i)
-        download_png(i)
+        return download_png(i)
+
+    return DownloadManager('preview_image').run(items, fetch)
+
+
+def owner_links(results: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Связи пользователей с workbooks, которыми они владеют, по owner_id выгруженных workbooks.
+    Workbooks, доступные пользователю только на просмотр, сюда не входят - их дает --membership-per-item
+    """
+    workbooks = results['extract:workbooks']
+    links = [LinkRecord.from_item(w, w.owner_id) for w in workbooks if w.owner_id]
+    df, _ = make_link_table(links, 'users', 'workbooks')
+    return df
+
 
-# ### Download workbook
+def group_members(results: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Пользователи всех групп: все страницы по 1000 пользователей, группы и страницы - параллельно
+    """
+    df, _ = make_link_table(get_group_members(results['extract:groups']), 'groups', 'users')
+    return df
 
-if DOWNLOAD_WORKBOOK:
-    for i in items:
-        try:
-            download(i, method, no_extract=DOWNLOAD_WITHOUT_EXTRACT)
-        except:
-            logging.error('Error while save {}'.format(i.name))
 
-# ## Revisions
+def link_columns(method: str, populate_method: str) -> Collection[str]:
+    return [make_reference_column(x)['name'] for x in (populate_method, method)]
 
-populate_method = 'revisions'
-df = make_df_for_populated_with_id(populate_method, column_id='workbook_id')
-load(df, table_name='{}_{}'.format(method, populate_method))
 
-# ## Connections in Workbooks
+def add_populate(name: str, func: StageFunc, deps: Collection[str]) -> None:
+    """
+    Добавляет шаг populate. С --merge-shards результат шага из SHARDED_STAGES не запрашивается,
+    а собирается из состояний запусков всех частей
+    """
+    if args.merge_shards and name in SHARDED_STAGES:
+        pipeline.add(name, lambda results: merge_shard_results(name, args.merge_shards, args.state_dir), backend='cpu')
+    else:
+        pipeline.add(name, func, deps=deps)
 
-populate_method = 'connections'
-df = make_df_for_populated_with_id(populate_method, column_id='workbook_id')
-load(df, table_name=populate_method)
 
-# ## Views in Workbooks
+def extract_options(method: str) -> Optional[TSC.RequestOptions]:
+    """
+    В инкрементальном режиме - фильтр по updatedAt для workbooks и datasources
+    """
+    return updated_since_options(watermarks[method]) if INCREMENTAL and method in INCREMENTAL_METHODS else None
 
-populate_method = 'views'
-df = make_df_for_populated(populate_method)
-df['position'] = df.groupby('workbook_id').cumcount() + 1
-del df['owner_id'], df['project_id'], df['tags']
-load(df, table_name=populate_method)
+
+def dry_run() -> None:
+    """
+    Печатает шаги, которые будут выполнены, и сколько запросов к Tableau Server они сделают. Число сущностей каждого
+    endpoint узнается одним запросом (count_items), для части (--shard) - приблизительно, как доля от всех.
+    Для revisions и groups_users это нижняя оценка: длинные истории и большие группы забираются несколькими страницами.
+    Если выполняется шаг foreign_keys - план FOREIGN KEY по текущему каталогу Vertica (только чтение)
+    """
+    to_run, restored = pipeline.plan(only=args.only, resume=args.resume)
+    counts = {}
+
+    def count(method: str) -> int:
+        if method not in counts:
+            counts[method] = count_items(method, extract_options(method))
+        return counts[method]
+
+    rows = []
+    for name in to_run:
+        kind, method = name.split(':', 1) if ':' in name else (name, None)
+        if kind == 'extract':
+            requests = math.ceil(count(method) / 1000) or 1
+        elif name in STAGE_REQUESTS and not (args.merge_shards and name in SHARDED_STAGES):
+            method = STAGE_REQUESTS[name]
+            requests = count(method)
+            if SHARD and method in SHARDED_METHODS:
+                requests = math.ceil(requests / SHARD.count)
+        else:
+            requests = 0
+        rows.append({'stage': name, 'backend': pipeline.stages[name].backend, 'requests': requests})
+    rows += [{'stage': name, 'backend': 'checkpoint', 'requests': 0} for name in restored]
+
+    df = pd.DataFrame(rows, columns=['stage', 'backend', 'requests'])
+    print(df.to_string(index=False))
+    # Если нужны запросы, к ним добавляются вход на сервер и запрос версии REST API
+    session_requests = 2 if counts else 0
+    print('{} stages to run, {} restored from checkpoint, ~{} requests to Tableau Server ({} made by this dry run '
+          'to count items)'.format(len(to_run), len(restored), df['requests'].sum() + session_requests,
+                                   len(counts) + session_requests))
+
+    if 'foreign_keys' in to_run:
+        # Перезагруженные таблицы создаются без ключей: для них план уточнится после загрузок
+        print('Foreign keys to create by the current Vertica catalog:')
+        make_foreign_keys(dry_run=True)
+
+
+# # Pipeline
+
+# Запуск части (--shard) хранит состояние отдельно: по нему запуск со сборкой берет результаты части
+pipeline = Pipeline(limits=BACKEND_LIMITS,
+                    state=RunState(SHARD.state_path(args.state_dir) if SHARD else args.state_dir))
+loads = {}
+
+# # Workbooks
+
+if 'workbooks' in args.endpoints:
+    pipeline.add('extract:workbooks', extract('workbooks'))
+    pipeline.add('transform:workbooks', transform('workbooks'), deps=['extract:workbooks'], backend='cpu')
+    add_load('load:workbooks', 'transform:workbooks', 'workbooks', attributes['workbooks'],
+             func=lambda df: load_delta(df, table_name='workbooks', key_columns=['id']))
+
+    # ## Download
+
+    if DOWNLOAD_PNG:
+        pipeline.add('download:preview_image', download_previews, deps=['extract:workbooks'])
+
+    if DOWNLOAD_WORKBOOK:
+        pipeline.add('download:workbooks', download_all('workbooks'), deps=['extract:workbooks'])
+
+    # ## Revisions
+
+    add_populate('populate:workbooks_revisions', populate_revisions, deps=['extract:workbooks'])
+    add_load('load:workbooks_revisions', 'populate:workbooks_revisions', 'workbooks_revisions',
+             [*attributes['revisions'], 'workbook_id'],
+             func=lambda df, parent_ids: merge(df, table_name='workbooks_revisions',
+                                               key_columns=['workbook_id', 'revision_number'])
+             if REVISIONS_ONLY_NEW else load_delta(df, table_name='workbooks_revisions', parent_column='workbook_id',
+                                                   key_columns=['workbook_id', 'revision_number'],
+                                                   parent_ids=parent_ids),
+             parent='workbooks')
+
+    # ## Connections in Workbooks
+
+    add_populate('populate:connections', populate('workbooks', 'connections', column_id='workbook_id'),
+                 deps=['extract:workbooks'])
+    add_load('load:connections', 'populate:connections', 'connections', [*attributes['connections'], 'workbook_id'],
+             func=lambda df, parent_ids: load_delta(df, table_name='connections', parent_column='workbook_id',
+                                                    parent_ids=parent_ids),
+             parent='workbooks')
+
+    # ## Views in Workbooks
+
+    if VIEWS_BULK:
+        pipeline.add('extract:views', lambda results: get_items('views', sorted_options(TSC.RequestOptions.Field.Name),
+                                                                usage=VIEWS_USAGE)[0])
+        pipeline.add('populate:views', bulk_views, deps=['extract:views', 'extract:workbooks'], backend='cpu')
+    else:
+        add_populate('populate:views', lambda results: views_position(populate('workbooks', 'views')(results)),
+                     deps=['extract:workbooks'])
+    add_load('load:views', 'populate:views', 'views', ['id', 'workbook_id', 'position'],
+             func=lambda df, parent_ids: load_delta(df, table_name='views', parent_column='workbook_id',
+                                                    key_columns=['id'], parent_ids=parent_ids),
+             parent='workbooks')
 
 # # Datasources
 
-method = 'datasources'
-endpoint, items, _ = etl(method)
+if 'datasources' in args.endpoints:
+    pipeline.add('extract:datasources', extract('datasources'))
+    pipeline.add('transform:datasources', transform('datasources'), deps=['extract:datasources'], backend='cpu')
+    add_load('load:datasources', 'transform:datasources', 'datasources', attributes['datasources'],
+             func=lambda df: load_delta(df, table_name='datasources', key_columns=['id']))
 
-# ## Download datasource
+    # ## Download datasource
 
-if DOWNLOAD_DATASOURCE:
-    for i in items:
-        try:
-            download(i, method, no_extract=DOWNLOAD_WITHOUT_EXTRACT)
-        except:
-            logging.error('Error while save {}'.format(i.name))
+    if DOWNLOAD_DATASOURCE:
+        pipeline.add('download:datasources', download_all('datasources'), deps=['extract:datasources'])
 
-# ## Connections in Datasources
+    # ## Connections in Datasources
 
-populate_method = 'connections'
-df = make_df_for_populated_with_id(populate_method, column_id='datasource_id')
-load_custom(df, table_name=populate_method, skip_truncate=True, table_type='TABLE')
+    # Дописываются в tableau_connections, поэтому только после перезагрузки connections для workbooks.
+    # Без workbooks таблица не перезагружается: строки datasources заменяются MERGE
+    connections_reloaded = 'load:connections' in loads
+    add_populate('populate:datasources_connections',
+                 populate('datasources', 'connections', column_id='datasource_id'), deps=['extract:datasources'])
+    add_load('load:datasources_connections', 'populate:datasources_connections', 'connections',
+             [*attributes['connections'], 'datasource_id'],
+             func=lambda df, parent_ids: merge(df, table_name='connections', delete_by='datasource_id',
+                                               delete_ids=parent_ids)
+             if INCREMENTAL or not connections_reloaded else
+             load_custom(df, table_name='connections', skip_truncate=True, table_type='TABLE'),
+             deps=['load:connections'] if connections_reloaded else [], parent='datasources')
 
 # # Projects
 
-method = 'projects'
-_, items, df = et(method)
-df['path'] = df['id'].apply(lambda x: '/'.join(make_project_path(items)[x]))
-load(df, table_name=method)
+if 'projects' in args.endpoints:
+    pipeline.add('extract:projects', extract('projects'))
+    pipeline.add('transform:projects', transform('projects', add_project_hierarchy), deps=['extract:projects'],
+                 backend='cpu')
+    add_load('load:projects', 'transform:projects', 'projects', [*attributes['projects'], 'root_project_id'])
 
 # # Users
 
-method = 'users'
-endpoint, items, _ = etl(method)
-
-# ## Workbooks in Users
-
-populate_method = 'workbooks'
-populate_items = get_populate_items(items, endpoint, populate_method)
-df, columns = make_link_table(populate_items, method, populate_method)
-load(df, table_name='{}_{}'.format(method, populate_method))
+if 'users' in args.endpoints:
+    pipeline.add('extract:users', extract('users'))
+    pipeline.add('transform:users', transform('users'), deps=['extract:users'], backend='cpu')
+    add_load('load:users', 'transform:users', 'users', attributes['users'])
+
+    # ## Workbooks in Users
+
+    if MEMBERSHIP_BULK:
+        # Связи берутся из owner_id workbooks, поэтому только вместе с workbooks.
+        # В инкрементальном режиме workbooks только измененные: заменяем связи только для них
+        if 'workbooks' in args.endpoints:
+            pipeline.add('populate:users_workbooks', owner_links, deps=['extract:workbooks'], backend='cpu')
+            add_load('load:users_workbooks', 'populate:users_workbooks', 'users_workbooks',
+                     link_columns('users', 'workbooks'),
+                     func=lambda df, parent_ids: load_delta(df, table_name='users_workbooks',
+                                                            parent_column='workbooks_id',
+                                                            key_columns=link_columns('users', 'workbooks'),
+                                                            parent_ids=parent_ids),
+                     parent='workbooks')
+    else:
+        pipeline.add('populate:users_workbooks', populate_links('users', 'workbooks'), deps=['extract:users'])
+        add_load('load:users_workbooks', 'populate:users_workbooks', 'users_workbooks',
+                 link_columns('users', 'workbooks'), key_columns=link_columns('users', 'workbooks'))
 
 # # Groups
 
-method = 'groups'
-endpoint, items, _ = etl(method)
+if 'groups' in args.endpoints:
+    pipeline.add('extract:groups', extract('groups'))
+    pipeline.add('transform:groups', transform('groups'), deps=['extract:groups'], backend='cpu')
+    add_load('load:groups', 'transform:groups', 'groups', attributes['groups'])
 
-# ## Users in group
+    # ## Users in group
 
-populate_method = 'users'
-populate_items = get_populate_items(items, endpoint, populate_method)
-df, _ = make_link_table(populate_items, method, populate_method)
-load(df, table_name='{}_{}'.format(method, populate_method))
+    if MEMBERSHIP_BULK:
+        pipeline.add('populate:groups_users', group_members, deps=['extract:groups'])
+    else:
+        pipeline.add('populate:groups_users', populate_links('groups', 'users'), deps=['extract:groups'])
+    add_load('load:groups_users', 'populate:groups_users', 'groups_users', link_columns('groups', 'users'),
+             key_columns=link_columns('groups', 'users'))
 
 # # Subscriptions
 
-method = 'subscriptions'
-_, _, df = et(method)
-df['target_type'] = df['target'].apply(lambda x: getattr(x, 'type'))
-df['target_id'] = df['target'].apply(lambda x: getattr(x, 'id'))
-del df['target']
-load(df, table_name=method)
+if 'subscriptions' in args.endpoints:
+    pipeline.add('extract:subscriptions', extract('subscriptions'))
+    pipeline.add('transform:subscriptions', transform('subscriptions', split_subscription_target),
+                 deps=['extract:subscriptions'], backend='cpu')
+    add_load('load:subscriptions', 'transform:subscriptions', 'subscriptions', attributes['subscriptions'])
 
 # # Schedules
 
-method = 'schedules'
-_ = etl(method)
+if 'schedules' in args.endpoints:
+    pipeline.add('extract:schedules', extract('schedules'))
+    pipeline.add('transform:schedules', transform('schedules'), deps=['extract:schedules'], backend='cpu')
+    add_load('load:schedules', 'transform:schedules', 'schedules', attributes['schedules'])
+
+# ## Load order
+
+# Сначала загружаются таблицы, на которые ссылаются внешние ключи: перезагрузка таблицы удаляет ее вместе
+# с внешними ключами, ссылающимися на нее (drop cascade)
+for name, (table_name, columns) in loads.items():
+    pipeline.stages[name].deps += ['load:{}'.format(t) for t in referenced_tables(columns, table_name)
+                                   if 'load:{}'.format(t) in loads]
 
 # # Make foreign keys
 
-make_foreign_keys()
+pipeline.add('foreign_keys', lambda results: make_foreign_keys(), deps=list(loads), backend='vertica')
+
+# # Watermarks
+
+incremental_extracts = ['extract:{}'.format(m) for m in INCREMENTAL_METHODS if m in args.endpoints]
+if incremental_extracts:
+    pipeline.add('watermarks', save_watermarks, deps=['foreign_keys', *incremental_extracts], backend='cpu')
+
+# # Shard
+
+# Запуск части только забирает вложенные сущности своих workbooks и datasources, загружает их запуск со сборкой
+if SHARD:
+    sharded = [name for name in SHARDED_STAGES if name in pipeline.stages]
+    if not sharded:
+        parser.error('--shard needs workbooks or datasources in --endpoints')
+    pipeline.keep(sharded)
+
+if args.dry_run:
+    dry_run()
+else:
+    try:
+        if args.merge_shards:
+            check_shards(args.merge_shards, args.shard_by, args.cycle_id, SHARD_FLAGS, args.state_dir)
+        pipeline.run(only=args.only, resume=args.resume)
+        if SHARD:
+            SHARD.save_info(args.cycle_id, SHARD_FLAGS, args.state_dir)
+        if FINGERPRINTS:
+            logging.info('Fingerprints: {:.1f} MB not loaded into Vertica'.format(sum(bytes_saved.values()) / 2 ** 20))
+    finally:
+        # Отчет пишется и для упавшего запуска: по нему видно, где и сколько времени ушло до ошибки
+        metrics.write_report()
+        if METRICS_TO_VERTICA:
+            load_custom(metrics.to_df(), table_name='run_metrics', skip_truncate=True)
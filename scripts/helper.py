@@ -132,3 +132,36 @@ attributes = {
         'publisher_name',
     ]
 }
+
+# Типы атрибутов для make_df: uuid и str - строки, datetime - UTC timestamp, bool и int - nullable,
+# tags - отсортированный json-список, object - оставить как есть
+dtypes = {
+    'id'                    : 'uuid',
+    'datasource_id'         : 'uuid',
+    'owner_id'              : 'uuid',
+    'parent_id'             : 'uuid',
+    'project_id'            : 'uuid',
+    'publisher_id'          : 'uuid',
+    'schedule_id'           : 'uuid',
+    'user_id'               : 'uuid',
+    'workbook_id'           : 'uuid',
+    'created_at'            : 'datetime',
+    'last_login'            : 'datetime',
+    'published_at'          : 'datetime',
+    'updated_at'            : 'datetime',
+    'certified'             : 'bool',
+    'current'               : 'bool',
+    'deleted'               : 'bool',
+    'embed_password'        : 'bool',
+    'encrypt_extracts'      : 'bool',
+    'show_tabs'             : 'bool',
+    'use_remote_query_agent': 'bool',
+    'priority'              : 'int',
+    'revision_number'       : 'int',
+    'server_port'           : 'int',
+    'size'                  : 'int',
+    'size_in_bytes'         : 'int',
+    'tags'                  : 'tags',
+    'interval_item'         : 'object',
+    'target'                : 'object',
+}
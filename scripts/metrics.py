@@ -0,0 +1,229 @@
+"""
+Метрики запуска ETL по шагам пайплайна: время, HTTP-запросы к Tableau Server и их задержки,
+строки, объем данных для COPY, рост пиковой памяти. В конце запуска пишется JSON-отчет в data/reports
+"""
+import contextvars
+import functools
+import json
+import logging
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import pandas as pd
+
+REPORTS_PATH = Path.cwd().parent / 'data' / 'reports'
+
+# Шаг, к которому относятся метрики: задается пайплайном и переносится в потоки пулов через bind
+_current_stage: contextvars.ContextVar = contextvars.ContextVar('stage', default='setup')
+
+
+def bind(func: Callable) -> Callable:
+    """
+    Функция, которая выполняется с контекстом (текущим шагом) вызвавшего потока.
+    Нужна для задач, отправляемых в ThreadPoolExecutor: контекст в потоки пула сам не переносится
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Копия на каждый вызов: один Context нельзя выполнять одновременно в нескольких потоках
+        return context.copy().run(func, *args, **kwargs)
+
+    return wrapper
+
+
+def peak_rss_mb() -> float:
+    """
+    Пиковый RSS процесса с начала запуска
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # На macOS в байтах, на Linux в килобайтах
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def count_rows(args: tuple, result: Any) -> Optional[int]:
+    """
+    Число строк операции: размер результата (DataFrame, список, (items, endpoint)) или первого DataFrame в аргументах
+    """
+    if isinstance(result, (pd.DataFrame, list)):
+        return len(result)
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])
+    if isinstance(result, dict) and all(isinstance(v, tuple) for v in result.values()):
+        return sum(len(v[0]) for v in result.values())
+    for arg in args:
+        if isinstance(arg, pd.DataFrame):
+            return len(arg)
+    return None
+
+
+class RunMetrics(object):
+    """
+    Потокобезопасный сборщик метрик. Метрики операций и HTTP-запросов относятся к текущему шагу
+    """
+
+    def __init__(self):
+        self.run_id = time.strftime('%Y%m%dT%H%M%S')
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict[str, Any]] = {}
+
+    def _entry(self, stage: Optional[str] = None) -> Dict[str, Any]:
+        stage = stage or _current_stage.get()
+        if stage not in self._stages:
+            self._stages[stage] = {'wall_s': None, 'status': None, 'rows': 0, 'bytes': 0, 'peak_rss_growth_mb': None,
+                                   'ops': {}, 'latencies': [], 'http_bytes': 0, 'http_errors': 0, 'http_retries': 0,
+                                   'http_wait_s': 0.0}
+        return self._stages[stage]
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Контекст шага: время, статус и насколько за время шага вырос пиковый RSS процесса (peak_rss_growth_mb,
+        0 - максимум не изменился). Сам пиковый RSS - максимум процесса с начала запуска, он есть в отчете один раз.
+        Шаги идут параллельно: рост мог вызвать соседний шаг
+        """
+        token = _current_stage.set(name)
+        started_at = time.monotonic()
+        peak_at_start = peak_rss_mb()
+        status = 'failed'
+        try:
+            yield
+            status = 'done'
+        finally:
+            _current_stage.reset(token)
+            with self._lock:
+                entry = self._entry(name)
+                entry.update(wall_s=time.monotonic() - started_at, status=status,
+                             peak_rss_growth_mb=peak_rss_mb() - peak_at_start)
+
+    def timed(self, op: str) -> Callable[[Callable], Callable]:
+        """
+        Декоратор операции: число вызовов, время и строки в метриках текущего шага
+        """
+
+        def decorator(func: Callable) -> Callable:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started_at = time.monotonic()
+                result = func(*args, **kwargs)
+                elapsed = time.monotonic() - started_at
+                rows = count_rows(args, result)
+                with self._lock:
+                    stats = self._entry()['ops'].setdefault(op, {'calls': 0, 'seconds': 0.0, 'rows': 0})
+                    stats['calls'] += 1
+                    stats['seconds'] += elapsed
+                    stats['rows'] += rows or 0
+                return result
+
+            return wrapper
+
+        return decorator
+
+    def add(self, key: str, value: float) -> None:
+        """
+        Увеличивает счетчик текущего шага: rows, bytes (объем, отправленный в COPY),
+        http_retries и http_wait_s (повторы и ожидание лимитов запросов к Tableau Server)
+        """
+        with self._lock:
+            self._entry()[key] += value
+
+    def record_response(self, response, *args, **kwargs) -> None:
+        """
+        Хук requests.Session: задержка, размер и статус каждого ответа. Задержка включает ожидание лимитов
+        и повторы в RequestGovernor (tableau.throttle), ожидание отдельно - в http_wait_s
+        """
+        size = response.headers.get('Content-Length')
+        with self._lock:
+            entry = self._entry()
+            entry['latencies'].append(response.elapsed.total_seconds())
+            entry['http_bytes'] += int(size) if size and size.isdigit() else 0
+            entry['http_errors'] += response.status_code >= 400
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {}
+            for name, entry in self._stages.items():
+                latencies = entry['latencies']
+                wall_s = entry['wall_s']
+                stages[name] = {
+                    'status'            : entry['status'],
+                    'wall_s'            : wall_s,
+                    'rows'              : entry['rows'],
+                    'rows_per_s'        : entry['rows'] / wall_s if wall_s else None,
+                    'bytes'             : entry['bytes'],
+                    'peak_rss_growth_mb': entry['peak_rss_growth_mb'],
+                    'http'              : {
+                        'requests': len(latencies),
+                        'errors'  : entry['http_errors'],
+                        'retries' : entry['http_retries'],
+                        'wait_s'  : entry['http_wait_s'],
+                        'bytes'   : entry['http_bytes'],
+                        'p50_s'   : percentile(latencies, 50),
+                        'p95_s'   : percentile(latencies, 95),
+                        'p99_s'   : percentile(latencies, 99),
+                        'max_s'   : max(latencies) if latencies else None,
+                    },
+                    'ops'               : {op: dict(stats) for op, stats in entry['ops'].items()},
+                }
+
+        return {
+            'run_id'     : self.run_id,
+            'started_at' : time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started_at)),
+            'wall_s'     : time.time() - self.started_at,
+            'peak_rss_mb': peak_rss_mb(),
+            'http'       : {'requests': sum(s['http']['requests'] for s in stages.values()),
+                            'bytes': sum(s['http']['bytes'] for s in stages.values())},
+            'stages'     : stages,
+        }
+
+    def to_df(self, report: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+        """
+        Отчет плоской таблицей: строка на шаг
+        """
+        report = report or self.report()
+        return pd.DataFrame([{
+            'run_id'            : report['run_id'],
+            'stage'             : name,
+            'status'            : stage['status'],
+            'wall_s'            : stage['wall_s'],
+            'rows'              : stage['rows'],
+            'bytes'             : stage['bytes'],
+            'peak_rss_growth_mb': stage['peak_rss_growth_mb'],
+            'http_requests'     : stage['http']['requests'],
+            'http_bytes'        : stage['http']['bytes'],
+            'http_retries'      : stage['http']['retries'],
+            'http_p50_s'        : stage['http']['p50_s'],
+            'http_p95_s'        : stage['http']['p95_s'],
+            'http_p99_s'        : stage['http']['p99_s'],
+            'ops'               : json.dumps(stage['ops']),
+        } for name, stage in report['stages'].items()])
+
+    def write_report(self, path: Path = REPORTS_PATH) -> Path:
+        """
+        Пишет JSON-отчет run_<run_id>.json и возвращает путь к нему
+        """
+        report = self.report()
+        path.mkdir(parents=True, exist_ok=True)
+        report_file = path / 'run_{}.json'.format(self.run_id)
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=2)
+        logging.info('Run report: {} ({:.1f}s, {} HTTP requests, peak RSS {:.0f} MB)'.format(
+            report_file, report['wall_s'], report['http']['requests'], report['peak_rss_mb']))
+        return report_file
+
+
+# Метрики текущего запуска
+metrics = RunMetrics()
@@ -0,0 +1,231 @@
+"""
+Планировщик шагов ETL: шаги объявляются вместе с зависимостями и выполняются параллельно,
+как только готовы все их зависимости, с ограничением числа одновременных шагов на каждый backend
+"""
+import fnmatch
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Collection, Dict, List, Optional, Set, Tuple
+
+from checkpoints import DONE, RunState
+from metrics import metrics
+
+StageFunc = Callable[[Dict[str, Any]], Any]
+
+
+class Stage(object):
+    """
+    Шаг пайплайна: func получает словарь результатов уже выполненных шагов и возвращает свой результат
+    """
+
+    def __init__(self, name: str, func: StageFunc, deps: Collection[str] = (), backend: str = 'tableau'):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.backend = backend
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def duration(self) -> float:
+        if self.started_at is None or self.finished_at is None:
+            return 0.0
+        return self.finished_at - self.started_at
+
+
+class Pipeline(object):
+    """
+    Набор шагов с зависимостями. limits - сколько шагов каждого backend может выполняться одновременно.
+    С state результат и статус каждого шага сохраняются на диск, и запуск можно продолжить (resume)
+    или выполнить только часть шагов (only), взяв результаты зависимостей из сохраненного состояния
+    """
+
+    def __init__(self, limits: Optional[Dict[str, int]] = None, state: Optional[RunState] = None):
+        self.limits = limits or {}
+        self.state = state
+        self.stages: Dict[str, Stage] = {}
+        self.results: Dict[str, Any] = {}
+
+    def add(self, name: str, func: StageFunc, deps: Collection[str] = (), backend: str = 'tableau') -> Stage:
+        """
+        Добавляет шаг. Зависимости можно объявлять и на шаги, добавленные позже
+        """
+        if name in self.stages:
+            raise ValueError('Stage {} already exists'.format(name))
+        stage = Stage(name, func, deps, backend)
+        self.stages[name] = stage
+        return stage
+
+    def run(self, only: Optional[Collection[str]] = None, resume: bool = False) -> Dict[str, Any]:
+        """
+        Выполняет шаги. При ошибке новые шаги не запускаются, уже запущенные дорабатывают,
+        после чего ошибка пробрасывается дальше
+
+        :param only: выполнить только эти шаги (можно шаблоны вида load:*), зависимости - из сохраненного состояния
+        :param resume: продолжить прошлый запуск: выполнить только незавершенные шаги
+        """
+        for stage in self.stages.values():
+            unknown = [d for d in stage.deps if d not in self.stages]
+            if unknown:
+                raise ValueError('Stage {} depends on unknown stages {}'.format(stage.name, unknown))
+
+        pending = [self.stages[name] for name in self._plan(only, resume)]
+        running: Dict[Any, Stage] = {}
+        error: Optional[BaseException] = None
+        started_at = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=max(sum(self.limits.values()), 1)) as executor:
+            while pending or running:
+                if error is None:
+                    for stage in self._ready(pending, running.values()):
+                        pending.remove(stage)
+                        logging.info('Stage {} started'.format(stage.name))
+                        running[executor.submit(self._run_stage, stage)] = stage
+
+                if not running:
+                    if error is None and pending:
+                        raise RuntimeError('Stages {} can not be scheduled: dependency cycle'.format(
+                            [s.name for s in pending]))
+                    break
+
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    try:
+                        self.results[stage.name] = future.result()
+                        logging.info('Stage {} finished in {:.1f}s'.format(stage.name, stage.duration))
+                    except Exception as e:
+                        logging.error('Stage {} failed: {}'.format(stage.name, e))
+                        if self.state is not None:
+                            self.state.fail(stage.name, e)
+                        error = error or e
+
+        if error is not None:
+            raise error
+
+        path, length = self.critical_path()
+        logging.info('Pipeline finished in {:.1f}s. Critical path ({:.1f}s): {}'.format(
+            time.monotonic() - started_at, length, ' -> '.join(path)))
+        return self.results
+
+    def critical_path(self) -> Tuple[List[str], float]:
+        """
+        Самая длинная по суммарному времени цепочка зависимых шагов: именно она ограничивает время запуска
+        """
+        longest: Dict[str, Tuple[float, Optional[str]]] = {}
+
+        def visit(name: str) -> float:
+            if name not in longest:
+                stage = self.stages[name]
+                best, best_dep = 0.0, None
+                for dep in stage.deps:
+                    length = visit(dep)
+                    if length > best:
+                        best, best_dep = length, dep
+                longest[name] = (best + stage.duration, best_dep)
+            return longest[name][0]
+
+        if not self.stages:
+            return [], 0.0
+
+        last = max(self.stages, key=visit)
+        path = []
+        while last is not None:
+            path.append(last)
+            last = longest[last][1]
+        return path[::-1], longest[path[0]][0]
+
+    def keep(self, names: Collection[str]) -> None:
+        """
+        Оставляет только шаги names и все их зависимости, остальные шаги удаляются
+        """
+        kept: Set[str] = set()
+
+        def visit(name: str) -> None:
+            if name not in kept:
+                kept.add(name)
+                for dep in self.stages[name].deps:
+                    visit(dep)
+
+        for name in names:
+            visit(name)
+        self.stages = {name: stage for name, stage in self.stages.items() if name in kept}
+
+    def plan(self, only: Optional[Collection[str]] = None, resume: bool = False) -> Tuple[List[str], List[str]]:
+        """
+        Шаги, которые будут выполнены, в порядке объявления, и шаги, результаты которых будут взяты
+        из сохраненного состояния. Ни состояние, ни результаты не меняются
+        """
+        if (only is not None or resume) and self.state is None:
+            raise ValueError('Pipeline without state can not resume or run only selected stages')
+
+        if only is not None:
+            selected = {name for name in self.stages if any(fnmatch.fnmatchcase(name, p) for p in only)}
+            if not selected:
+                raise ValueError('No stages match {}'.format(list(only)))
+        elif resume:
+            selected = {name for name in self.stages if self.state.status(name) != DONE}
+        else:
+            selected = set(self.stages)
+        restorable = only is not None or resume
+
+        to_run: Set[str] = set()
+        restored: Set[str] = set()
+
+        def require(name: str) -> None:
+            if name in to_run or name in restored or name in self.results:
+                return
+            if name not in selected and restorable and self.state.is_restorable(name):
+                restored.add(name)
+                return
+            to_run.add(name)
+            for dep in self.stages[name].deps:
+                require(dep)
+
+        for name in selected:
+            require(name)
+
+        return [name for name in self.stages if name in to_run], [name for name in self.stages if name in restored]
+
+    def _plan(self, only: Optional[Collection[str]], resume: bool) -> List[str]:
+        """
+        Шаги, которые нужно выполнить (plan). Результаты остальных нужных шагов загружаются из сохраненного
+        состояния, а если результата там нет - шаг тоже выполняется. Новый запуск удаляет прошлое состояние
+        """
+        if only is None and not resume and self.state is not None:
+            self.state.reset()
+
+        to_run, restored = self.plan(only, resume)
+        for name in restored:
+            self.results[name] = self.state.load(name)
+        if restored:
+            logging.info('Restored {} stages from checkpoint, {} to run'.format(len(restored), len(to_run)))
+        return to_run
+
+    def _ready(self, pending: List[Stage], running: Collection[Stage]) -> List[Stage]:
+        busy = {}
+        for stage in running:
+            busy[stage.backend] = busy.get(stage.backend, 0) + 1
+
+        ready = []
+        for stage in pending:
+            if not all(d in self.results for d in stage.deps):
+                continue
+            limit = self.limits.get(stage.backend, 1)
+            if busy.get(stage.backend, 0) < limit:
+                busy[stage.backend] = busy.get(stage.backend, 0) + 1
+                ready.append(stage)
+        return ready
+
+    def _run_stage(self, stage: Stage) -> Any:
+        stage.started_at = time.monotonic()
+        try:
+            with metrics.stage(stage.name):
+                result = stage.func(self.results)
+        finally:
+            stage.finished_at = time.monotonic()
+        # Сохраняем в потоке шага, до того как зависимые шаги получат результат и смогут его изменить
+        if self.state is not None:
+            self.state.save(stage.name, result, stage.duration)
+        return result
@@ -0,0 +1,119 @@
+"""
+Разбиение populate по workbooks и datasources на части (shards), которые выполняются отдельными запусками
+на разных процессах или хостах: каждый запуск забирает вложенные сущности только своей части родителей,
+а запуск со сборкой (etl_tableau.py --merge-shards) объединяет результаты всех частей и загружает их.
+Успешный запуск части записывает shard.json: цикл ETL, разбиение и флаги, с которыми он выполнялся.
+Сборка принимает только части того же цикла с тем же разбиением и флагами
+"""
+import json
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Collection, Dict, List
+
+import pandas as pd
+
+from checkpoints import STATE_PATH, RunState
+
+# По какому атрибуту сущности выбирается часть: id или project_id (все сущности проекта - в одной части)
+SHARD_KEYS = ('id', 'project')
+
+SHARD_INFO_FILE = 'shard.json'
+
+
+class Shard(object):
+    """
+    Часть index из count (index от 0). Сущность относится к части по crc32 ключа, поэтому разбиение
+    одинаково в разных процессах и запусках
+    """
+
+    def __init__(self, index: int, count: int, by: str = 'id'):
+        if count < 1 or not 0 <= index < count:
+            raise ValueError('Shard index must be from 0 to {}, got {}'.format(count - 1, index))
+        if by not in SHARD_KEYS:
+            raise ValueError('Unknown shard key {}, expected one of {}'.format(by, SHARD_KEYS))
+        self.index = index
+        self.count = count
+        self.by = by
+
+    @classmethod
+    def parse(cls, spec: str, by: str = 'id') -> 'Shard':
+        """
+        Часть из строки INDEX/COUNT, например 0/4
+        """
+        try:
+            index, count = (int(x) for x in spec.split('/'))
+        except ValueError:
+            raise ValueError('Shard must be INDEX/COUNT, got {!r}'.format(spec))
+        return cls(index, count, by)
+
+    def key(self, item: Any) -> str:
+        return (item.project_id if self.by == 'project' else item.id) or ''
+
+    def owns(self, item: Any) -> bool:
+        return zlib.crc32(self.key(item).encode('utf-8')) % self.count == self.index
+
+    def select(self, items: Collection[Any]) -> List[Any]:
+        return [i for i in items if self.owns(i)]
+
+    def state_path(self, path: Path = STATE_PATH) -> Path:
+        """
+        Состояние запуска части - рядом с состоянием основного запуска, а не внутри: новый основной запуск
+        удаляет свое состояние целиком
+        """
+        return path.with_name('{}-shard-{}-of-{}'.format(path.name, self.index, self.count))
+
+    def info(self, cycle_id: str, flags: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Что должно совпадать у всех частей и сборки: цикл ETL, число частей, ключ разбиения и флаги запуска
+        """
+        # Через JSON, чтобы сравнивать с прочитанным из shard.json (кортежи становятся списками)
+        return json.loads(json.dumps({'cycle_id': cycle_id, 'count': self.count, 'by': self.by, 'flags': flags}))
+
+    def save_info(self, cycle_id: str, flags: Dict[str, Any], path: Path = STATE_PATH) -> None:
+        """
+        Записывается после успешного запуска части. Новый запуск части удаляет состояние вместе с shard.json,
+        поэтому незавершенная часть его не имеет
+        """
+        state_path = self.state_path(path)
+        state_path.mkdir(parents=True, exist_ok=True)
+        info = dict(self.info(cycle_id, flags), index=self.index, finished_at=time.time())
+        tmp_path = state_path / (SHARD_INFO_FILE + '.tmp')
+        tmp_path.write_text(json.dumps(info, indent=2, sort_keys=True))
+        tmp_path.replace(state_path / SHARD_INFO_FILE)
+
+    def __str__(self) -> str:
+        return '{}/{} by {}'.format(self.index, self.count, self.by)
+
+
+def check_shards(count: int, by: str, cycle_id: str, flags: Dict[str, Any], path: Path = STATE_PATH) -> None:
+    """
+    Проверяет, что все count частей успешно выполнены в цикле cycle_id с тем же разбиением и флагами, что у сборки.
+    Иначе RuntimeError: результаты старого или другого запуска части не должны попасть в загрузку
+    """
+    problems = []
+    for index in range(count):
+        shard = Shard(index, count, by)
+        info_file = shard.state_path(path) / SHARD_INFO_FILE
+        if not info_file.exists():
+            problems.append('shard {}: no finished run in {}'.format(shard, info_file.parent))
+            continue
+        info = json.loads(info_file.read_text())
+        for key, expected in shard.info(cycle_id, flags).items():
+            if info.get(key) != expected:
+                problems.append('shard {}: {} is {!r}, expected {!r}'.format(shard, key, info.get(key), expected))
+    if problems:
+        raise RuntimeError('Shard results can not be merged:\n    {}'.format('\n    '.join(problems)))
+
+
+def merge_shard_results(name: str, count: int, path: Path = STATE_PATH) -> pd.DataFrame:
+    """
+    Результат шага name, собранный из сохраненных состояний запусков всех count частей
+    """
+    dfs = []
+    for index in range(count):
+        state = RunState(Shard(index, count).state_path(path))
+        if not state.is_restorable(name):
+            raise RuntimeError('Shard {}/{} has no result of stage {} in {}'.format(index, count, name, state.path))
+        dfs.append(state.load(name))
+    return pd.concat(dfs, ignore_index=True)
@@ -0,0 +1,66 @@
+"""
+Асинхронная постраничная выгрузка из Tableau REST API.
+
+Запросы выполняет тот же блокирующий TSC endpoint (с тем же токеном сессии), но страницы
+запрашиваются параллельно в пуле потоков, как только первая страница сообщила total_available.
+"""
+import asyncio
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import tableauserverclient as TSC
+
+from metrics import bind
+
+# Сколько страниц запрашивать одновременно (на все endpoints вместе)
+PAGE_WORKERS = int(os.getenv('TABLEAU_PAGE_WORKERS', 8))
+
+FetchPage = Callable[[TSC.RequestOptions], Tuple[List[object], TSC.PaginationItem]]
+
+
+def page_options(req_options: TSC.RequestOptions, pagenumber: int) -> TSC.RequestOptions:
+    """
+    Копия req_options для страницы pagenumber с теми же фильтрами и сортировкой
+    """
+    opts = TSC.RequestOptions(pagenumber=pagenumber, pagesize=req_options.pagesize)
+    opts.sort, opts.filter = req_options.sort, req_options.filter
+    return opts
+
+
+async def fetch_all_pages(fetch_page: FetchPage, req_options: Optional[TSC.RequestOptions] = None,
+                          executor: Optional[ThreadPoolExecutor] = None,
+                          semaphore: Optional[asyncio.Semaphore] = None) -> Tuple[List[object], Optional[int]]:
+    """
+    Забирает все страницы: сначала первую, затем все остальные параллельно.
+    Возвращает объекты в порядке страниц и total_available
+
+    :param fetch_page: блокирующая функция вида endpoint.get(req_options) -> (items, pagination_item)
+    :param req_options: размер страницы, фильтры и сортировка; pagenumber задает первую страницу
+    :param executor: пул потоков для блокирующих запросов
+    :param semaphore: ограничение числа одновременных запросов
+    """
+    loop = asyncio.get_running_loop()
+    fetch_page = bind(fetch_page)
+    req_options = req_options or TSC.RequestOptions(pagesize=1000)
+    semaphore = semaphore or asyncio.Semaphore(PAGE_WORKERS)
+
+    async def fetch(pagenumber: int) -> Tuple[List[object], TSC.PaginationItem]:
+        async with semaphore:
+            return await loop.run_in_executor(executor, fetch_page, page_options(req_options, pagenumber))
+
+    first_page = req_options.pagenumber
+    items, pagination_item = await fetch(first_page)
+    total_available = pagination_item.total_available
+    if total_available is None:
+        # endpoint не поддерживает пагинацию
+        return list(items), None
+
+    last_page = math.ceil(int(total_available) / req_options.pagesize)
+    pages = await asyncio.gather(*[fetch(n) for n in range(first_page + 1, last_page + 1)])
+
+    items = list(items)
+    for page_items, _ in pages:
+        items.extend(page_items)
+    return items, int(total_available)
@@ -0,0 +1,242 @@
+"""
+Локальный кэш ответов Tableau REST API на диске.
+
+Ответы хранятся по хешу содержимого (objects/<sha256>), индекс (index/<sha256 запроса>.json) связывает
+метод и URL запроса с ответом. Кэш подключается к requests.Session сервера как HTTPAdapter, поэтому
+через него идут все запросы TSC: страницы get_items, populate, serverInfo.
+
+Режимы:
+    off    - кэш не используется
+    on     - ответы моложе ttl берутся из кэша, остальные запрашиваются и сохраняются
+    replay - все ответы только из кэша, независимо от возраста; запрос, которого нет в снимке, - ошибка
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+CACHE_PATH = Path.cwd().parent / 'data' / 'cache' / 'tableau'
+CACHE_MODES = ('off', 'on', 'replay')
+
+# Ответ на вход в режиме on всегда запрашивается заново, а сохраняется без токена: в replay нужны только
+# id сайта и пользователя из него (по id сайта строятся URL остальных запросов), токен заменяется на REPLAY_TOKEN
+SIGNIN_SUFFIX = '/auth/signin'
+REPLAY_TOKEN = b'replay'
+TOKEN_PATTERN = re.compile(rb'(<credentials\b[^>]*?\btoken=")[^"]*(")')
+# Заголовки с сессией сервера не сохраняются
+SECRET_HEADERS = ('set-cookie', 'x-tableau-auth')
+
+
+class CacheMissError(requests.exceptions.RequestException):
+    """
+    Запроса нет в снимке (режим replay)
+    """
+
+
+class ResponseCache(object):
+    """
+    Хранилище ответов с ограничением по возрасту (ttl) и общему размеру (max_bytes).
+    При превышении размера удаляются записи, которые дольше всего не читались
+    """
+
+    def __init__(self, path: Path = CACHE_PATH, ttl: float = 24 * 3600, max_bytes: int = 1024 * 2 ** 20):
+        """
+        :param path: папка кэша
+        :param ttl: сколько секунд ответ считается свежим
+        :param max_bytes: максимальный общий размер сохраненных ответов
+        """
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None
+        (self.path / 'index').mkdir(parents=True, exist_ok=True)
+        (self.path / 'objects').mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(method: str, url: str) -> str:
+        return hashlib.sha256('{} {}'.format(method, url).encode('utf-8')).hexdigest()
+
+    def get(self, key: str, max_age: Optional[float] = None) -> Optional[Tuple[Dict[str, Any], bytes]]:
+        """
+        Запись индекса и содержимое ответа или None, если записи нет или она старше max_age секунд
+        """
+        index_file = self.path / 'index' / '{}.json'.format(key)
+        try:
+            with open(index_file) as f:
+                entry = json.load(f)
+            content = (self.path / 'objects' / entry['content_sha']).read_bytes()
+        except (OSError, ValueError, KeyError):
+            return None
+
+        if max_age is not None and time.time() - entry['created_at'] > max_age:
+            return None
+
+        # Время последнего чтения - для вытеснения
+        os.utime(index_file)
+        return entry, content
+
+    def put(self, key: str, method: str, url: str, status_code: int, headers: Dict[str, str], content: bytes) -> None:
+        content_sha = hashlib.sha256(content).hexdigest()
+        object_file = self.path / 'objects' / content_sha
+        if not object_file.exists():
+            self._write(object_file, content)
+            with self._lock:
+                self._size = self._current_size() + len(content)
+                full = self._size > self.max_bytes
+        else:
+            full = False
+
+        entry = {'method': method, 'url': url, 'status_code': status_code, 'headers': headers,
+                 'content_sha': content_sha, 'created_at': time.time()}
+        self._write(self.path / 'index' / '{}.json'.format(key), json.dumps(entry).encode('utf-8'))
+
+        if full:
+            self.evict()
+
+    def evict(self) -> None:
+        """
+        Удаляет записи, которые дольше всего не читались, пока размер кэша больше max_bytes,
+        и ответы, на которые не ссылается ни одна запись
+        """
+        with self._lock:
+            entries = []
+            for index_file in (self.path / 'index').glob('*.json'):
+                try:
+                    with open(index_file) as f:
+                        entries.append((index_file.stat().st_mtime, index_file, json.load(f)['content_sha']))
+                except (OSError, ValueError, KeyError):
+                    continue
+            entries.sort(key=lambda x: x[0])
+
+            sizes = {p.name: p.stat().st_size for p in (self.path / 'objects').iterdir() if not p.name.endswith('.tmp')}
+            refs: Dict[str, int] = {}
+            for _, _, content_sha in entries:
+                refs[content_sha] = refs.get(content_sha, 0) + 1
+
+            size = sum(sizes.values())
+            removed = 0
+            for _, index_file, content_sha in entries:
+                if size <= self.max_bytes:
+                    break
+                index_file.unlink()
+                removed += 1
+                refs[content_sha] -= 1
+                if not refs[content_sha] and content_sha in sizes:
+                    (self.path / 'objects' / content_sha).unlink()
+                    size -= sizes.pop(content_sha)
+
+            for content_sha in [s for s in sizes if not refs.get(s)]:
+                (self.path / 'objects' / content_sha).unlink()
+                size -= sizes.pop(content_sha)
+
+            self._size = size
+        logging.info('Tableau cache: evicted {} responses, {:.1f} MB left'.format(removed, size / 2 ** 20))
+
+    def _current_size(self) -> int:
+        if self._size is None:
+            self._size = sum(p.stat().st_size for p in (self.path / 'objects').iterdir())
+        return self._size
+
+    @staticmethod
+    def _write(path: Path, data: bytes) -> None:
+        # Уникальный временный файл: одинаковые ответы могут сохраняться из нескольких потоков
+        tmp_path = path.with_name('{}.{}.tmp'.format(path.name, uuid.uuid4().hex))
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+
+
+class CachingAdapter(HTTPAdapter):
+    """
+    HTTPAdapter, который отвечает на GET (и вход) из ResponseCache, а остальные запросы передает inner.
+    Потоковые скачивания (stream=True: файлы workbooks и datasources) не кэшируются
+    """
+
+    def __init__(self, cache: ResponseCache, mode: str = 'on', inner: Optional[HTTPAdapter] = None, **kwargs):
+        if mode not in CACHE_MODES:
+            raise ValueError('Unknown cache mode {}, expected one of {}'.format(mode, CACHE_MODES))
+        super(CachingAdapter, self).__init__(**kwargs)
+        self.cache = cache
+        self.mode = mode
+        self.inner = inner or HTTPAdapter()
+        self.stats = {'hits': 0, 'misses': 0}
+        self._lock = threading.Lock()
+
+    def send(self, request: requests.PreparedRequest, stream: bool = False, **kwargs) -> requests.Response:
+        signin = request.method == 'POST' and request.url.split('?', 1)[0].endswith(SIGNIN_SUFFIX)
+        if self.mode == 'off' or stream or (request.method != 'GET' and not signin):
+            return self.inner.send(request, stream=stream, **kwargs)
+
+        key = self.cache.key(request.method, request.url)
+        if self.mode == 'replay':
+            cached = self.cache.get(key)
+            if cached is None:
+                raise CacheMissError('{} {} is not in Tableau cache snapshot'.format(request.method, request.url),
+                                     request=request)
+        else:
+            cached = None if signin else self.cache.get(key, max_age=self.cache.ttl)
+
+        if cached is not None:
+            self._count('hits')
+            entry, content = cached
+            # Снимки, сохраненные до удаления токенов, тоже отдают только фиктивный токен
+            return self._build_cached_response(request, entry, without_token(content) if signin else content)
+
+        self._count('misses')
+        response = self.inner.send(request, stream=stream, **kwargs)
+        if 200 <= response.status_code < 300:
+            content = without_token(response.content) if signin else response.content
+            headers = {k: v for k, v in response.headers.items() if k.lower() not in SECRET_HEADERS}
+            self.cache.put(key, request.method, request.url, response.status_code, headers, content)
+        return response
+
+    def close(self) -> None:
+        self.inner.close()
+        super(CachingAdapter, self).close()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+    @staticmethod
+    def _build_cached_response(request: requests.PreparedRequest, entry: Dict[str, Any],
+                               content: bytes) -> requests.Response:
+        response = requests.Response()
+        response.status_code = entry['status_code']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        # Тело уже распаковано
+        response.headers.pop('Content-Encoding', None)
+        response._content = content
+        response.url = request.url
+        response.request = request
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        return response
+
+
+def without_token(content: bytes) -> bytes:
+    """
+    Ответ на вход с REPLAY_TOKEN вместо токена сессии
+    """
+    return TOKEN_PATTERN.sub(lambda m: m.group(1) + REPLAY_TOKEN + m.group(2), content)
+
+
+def install_cache(session: requests.Session, mode: str, cache: Optional[ResponseCache] = None) -> CachingAdapter:
+    """
+    Подключает кэш ко всем http(s) запросам session (server.session у TSC). Прежние адаптеры становятся внутренними
+    """
+    cache = cache or ResponseCache()
+    adapter = CachingAdapter(cache, mode, inner=session.get_adapter('https://'))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    logging.info('Tableau cache: {} mode in {}'.format(mode, cache.path))
+    return adapter
@@ -0,0 +1,122 @@
+"""
+Параллельное инкрементальное скачивание файлов с Tableau Server
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Collection, Dict, Optional
+
+from metrics import bind
+
+MANIFEST_PATH = Path.cwd().parent / 'data' / 'state' / 'downloads.json'
+DOWNLOAD_WORKERS = int(os.getenv('TABLEAU_DOWNLOAD_WORKERS', 4))
+
+# Один манифест на все разделы, которые могут скачиваться одновременно
+_manifest_lock = threading.Lock()
+
+
+class DownloadManager(object):
+    """
+    Скачивает файлы для items в пуле потоков. Манифест хранит версию (updated_at) каждого скачанного файла:
+    файлы, которые не изменились с прошлого запуска и все еще лежат на диске, пропускаются.
+    Ошибки повторяются с экспоненциальной задержкой, неудачные файлы перечисляются в логе
+    """
+
+    def __init__(self, name: str, workers: int = DOWNLOAD_WORKERS, retries: int = 3, backoff: float = 2.0,
+                 manifest_path: Path = MANIFEST_PATH):
+        """
+        :param name: раздел манифеста: workbooks/datasources/preview_image
+        :param workers: число параллельных потоков
+        :param retries: сколько раз повторять скачивание после ошибки
+        :param backoff: задержка перед первым повтором в секундах, дальше удваивается
+        :param manifest_path: путь к файлу манифеста
+        """
+        self.name = name
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.manifest_path = manifest_path
+        self._lock = threading.Lock()
+
+    def run(self, items: Collection[object], fetch: Callable[[object], Path]) -> Dict[str, int]:
+        """
+        Скачивает измененные items функцией fetch, которая возвращает путь к сохраненному файлу
+
+        :return: число скачанных, пропущенных и неудачных файлов и скачанный объем
+        """
+        manifest = self._read_manifest()
+        entries = manifest.setdefault(self.name, {})
+        stats = {'downloaded': 0, 'skipped': 0, 'failed': 0, 'bytes': 0}
+
+        def process(item) -> None:
+            version = str(item.updated_at)
+            entry = entries.get(item.id)
+            if entry and entry['version'] == version and Path(entry['path']).exists():
+                with self._lock:
+                    stats['skipped'] += 1
+                return
+
+            path = self._fetch_with_retries(item, fetch)
+            with self._lock:
+                if path is None:
+                    stats['failed'] += 1
+                    return
+                entries[item.id] = {'version': version, 'path': str(path)}
+                stats['downloaded'] += 1
+                stats['bytes'] += path.stat().st_size
+
+        started_at = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(bind(process), items))
+        finally:
+            self._write_manifest(manifest)
+
+        elapsed = time.monotonic() - started_at
+        logging.info('Downloaded {} {}: {downloaded} saved, {skipped} unchanged, {failed} failed, '
+                     '{mb:.1f} MB in {elapsed:.1f}s ({speed:.2f} MB/s)'.format(
+                         len(items), self.name, mb=stats['bytes'] / 2 ** 20, elapsed=elapsed,
+                         speed=stats['bytes'] / 2 ** 20 / elapsed if elapsed else 0, **stats))
+        return stats
+
+    def _fetch_with_retries(self, item, fetch: Callable[[object], Path]) -> Optional[Path]:
+        for attempt in range(self.retries + 1):
+            started_at = time.monotonic()
+            try:
+                path = Path(fetch(item))
+            except Exception as e:
+                if attempt == self.retries:
+                    logging.error('Error while save {}: {}'.format(item.name, e))
+                    return None
+                delay = self.backoff * 2 ** attempt * (0.5 + random.random())
+                logging.warning('Error while save {}: {}. Retry in {:.1f}s'.format(item.name, e, delay))
+                time.sleep(delay)
+                continue
+
+            elapsed = time.monotonic() - started_at
+            size = path.stat().st_size
+            logging.info('Saved {} ({:.1f} MB in {:.1f}s, {:.2f} MB/s)'.format(
+                path, size / 2 ** 20, elapsed, size / 2 ** 20 / elapsed if elapsed else 0))
+            return path
+
+    def _read_manifest(self) -> Dict[str, Dict[str, Dict[str, str]]]:
+        if not self.manifest_path.exists():
+            return {}
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest: Dict[str, Dict[str, Dict[str, str]]]) -> None:
+        # Манифест мог обновить другой DownloadManager (другой раздел), перечитываем его перед записью
+        with _manifest_lock:
+            current = self._read_manifest()
+            current[self.name] = manifest[self.name]
+            self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.manifest_path.with_suffix('.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(current, f, indent=2, sort_keys=True)
+            tmp_path.replace(self.manifest_path)
@@ -0,0 +1,83 @@
+"""
+Индекс иерархии проектов Tableau Server
+"""
+from typing import Collection, Dict, Tuple
+
+import pandas as pd
+import tableauserverclient as TSC
+
+
+class ProjectHierarchy(object):
+    """
+    Строится один раз по списку проектов. Цепочка предков каждого проекта вычисляется один раз
+    и запоминается, поэтому весь индекс строится за O(n), независимо от глубины дерева
+    """
+
+    def __init__(self, items: Collection[TSC.ProjectItem]):
+        self.projects = {i.id: i for i in items}
+        self._chains: Dict[str, Tuple[str, ...]] = {}
+        self._paths: Dict[str, str] = {}
+
+    def chain(self, project_id: str) -> Tuple[str, ...]:
+        """
+        id проектов от корня до project_id включительно
+        """
+        if project_id in self._chains:
+            return self._chains[project_id]
+
+        # Поднимаемся до корня или до уже посчитанного предка
+        stack = []
+        current_id = project_id
+        while current_id in self.projects and current_id not in self._chains and current_id not in stack:
+            stack.append(current_id)
+            current_id = self.projects[current_id].parent_id
+
+        chain = self._chains.get(current_id, ())
+        path = self._paths.get(current_id)
+        for node_id in reversed(stack):
+            chain = chain + (node_id,)
+            name = self.projects[node_id].name
+            path = '{}/{}'.format(path, name) if path else name
+            self._chains[node_id] = chain
+            self._paths[node_id] = path
+
+        return self._chains[project_id]
+
+    def path(self, project_id: str) -> str:
+        """
+        Полный путь до проекта: имена от корня через /
+        """
+        self.chain(project_id)
+        return self._paths[project_id]
+
+    def depth(self, project_id: str) -> int:
+        """
+        Глубина проекта, у корневых проектов 0
+        """
+        return len(self.chain(project_id)) - 1
+
+    def root_id(self, project_id: str) -> str:
+        """
+        id корневого проекта
+        """
+        return self.chain(project_id)[0]
+
+    def ancestor_ids(self, project_id: str) -> Tuple[str, ...]:
+        """
+        id всех предков от корня до родителя
+        """
+        return self.chain(project_id)[:-1]
+
+    def to_df(self) -> pd.DataFrame:
+        """
+        DataFrame со столбцами id, path, depth, root_project_id, ancestor_ids (через запятую) для всех проектов
+        """
+        ids = list(self.projects)
+        chains = [self.chain(i) for i in ids]
+        return pd.DataFrame({
+            'id'             : ids,
+            'path'           : [self._paths[i] for i in ids],
+            'depth'          : [len(c) - 1 for c in chains],
+            'root_project_id': [c[0] for c in chains],
+            'ancestor_ids'   : [','.join(c[:-1]) for c in chains],
+        })
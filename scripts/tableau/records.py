@@ -0,0 +1,58 @@
+"""
+Компактные записи вложенных сущностей для populate.
+Вместо полных объектов TSC (ConnectionItem, ViewItem, ...) хранятся только атрибуты, которые попадают в таблицы,
+и id родителя. Записи с __slots__ не держат __dict__ и ссылок на исходные объекты
+"""
+from typing import Dict, Tuple, Type
+
+
+class Record(object):
+    """
+    Базовая запись: fields - атрибуты, копируемые из объекта TSC, parent_id - id родителя
+    """
+    __slots__ = ('parent_id',)
+    fields: Tuple[str, ...] = ()
+
+    @classmethod
+    def from_item(cls, item: object, parent_id: str) -> 'Record':
+        record = cls.__new__(cls)
+        for field in cls.fields:
+            setattr(record, field, getattr(item, field, None))
+        record.parent_id = parent_id
+        return record
+
+    def __repr__(self) -> str:
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            '{}={!r}'.format(f, getattr(self, f)) for f in ('parent_id', *self.fields)))
+
+
+class LinkRecord(Record):
+    """
+    Строка таблицы связи: id вложенной сущности и id родителя (users_workbooks, groups_users)
+    """
+    __slots__ = fields = ('id',)
+
+
+class ConnectionRecord(Record):
+    __slots__ = fields = ('id', 'connection_type', 'datasource_id', 'datasource_name', 'embed_password',
+                          'password', 'server_address', 'server_port', 'username')
+
+
+class ViewRecord(Record):
+    __slots__ = fields = ('id', 'content_url', 'created_at', 'name', 'owner_id', 'project_id', 'sheet_type',
+                          'tags', 'updated_at', 'workbook_id')
+
+
+class RevisionRecord(Record):
+    __slots__ = fields = ('revision_number', 'published_at', 'deleted', 'current', 'size_in_bytes',
+                          'publisher_id', 'publisher_name')
+
+
+# populate_method -> тип записи
+RECORD_TYPES: Dict[str, Type[Record]] = {
+    'connections': ConnectionRecord,
+    'views'      : ViewRecord,
+    'revisions'  : RevisionRecord,
+    'workbooks'  : LinkRecord,
+    'users'      : LinkRecord,
+}
@@ -1,5 +1,7 @@
+import io
 # noinspection PyPep8Naming
 import xml.etree.ElementTree as ET
+from typing import Dict, List
 
 from tableauserverclient.datetime_helpers import parse_datetime
 
@@ -8,6 +10,8 @@ class RevisionItem(object):
     """
     https://help.tableau.com/current/api/rest_api/en-us/REST/rest_api_ref_revisions.htm
     """
+    __slots__ = ('revision_number', 'published_at', 'deleted', 'current', 'size_in_bytes',
+                 'publisher_id', 'publisher_name')
 
     def __init__(self):
         self.revision_number = None
@@ -71,6 +75,37 @@ class RevisionItem(object):
         return revision_number, published_at, deleted, current, size_in_bytes, publisher_id, publisher_name
 
 
+REVISION_COLUMNS = ('revision_number', 'published_at', 'deleted', 'current',
+                    'size_in_bytes', 'publisher_id', 'publisher_name')
+
+
+def revisions_to_columns(resp, ns) -> Dict[str, List]:
+    """
+    Потоковый разбор ответа GET .../revisions сразу в столбцы, без объектов RevisionItem.
+    published_at остается строкой ISO 8601: его быстрее привести к datetime целым столбцом
+    """
+    columns = {c: [] for c in REVISION_COLUMNS}
+    revision_tag = '{{{}}}revision'.format(ns['t'])
+    publisher_tag = '{{{}}}publisher'.format(ns['t'])
+
+    for _, element in ET.iterparse(io.BytesIO(resp), events=('start',)):
+        if element.tag == revision_tag:
+            revision_number = element.get('revisionNumber')
+            size_in_bytes = element.get('sizeInBytes')
+            columns['revision_number'].append(int(revision_number) if revision_number else None)
+            columns['published_at'].append(element.get('publishedAt'))
+            columns['deleted'].append(string_to_bool(element.get('deleted')))
+            columns['current'].append(string_to_bool(element.get('current')))
+            columns['size_in_bytes'].append(int(size_in_bytes) if size_in_bytes else None)
+            columns['publisher_id'].append(None)
+            columns['publisher_name'].append(None)
+        elif element.tag == publisher_tag and columns['publisher_id']:
+            columns['publisher_id'][-1] = element.get('id')
+            columns['publisher_name'][-1] = element.get('name')
+
+    return columns
+
+
 # Used to convert string represented boolean to a boolean type
 def string_to_bool(s):
     if not s:
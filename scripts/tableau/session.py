@@ -0,0 +1,160 @@
+"""
+Сессия Tableau Server: подключение, вход и endpoints создаются при первом обращении, а не при импорте модулей.
+
+Настройки по умолчанию берутся из переменных окружения в момент создания сессии:
+TABLEAU_SERVER_URL, TABLEAU_TOKEN_NAME, TABLEAU_TOKEN_VALUE, TABLEAU_SITENAME и настройки кэша
+TABLEAU_CACHE, TABLEAU_CACHE_TTL, TABLEAU_CACHE_MAX_MB (см. tableau.cache). Ограничения частоты
+и повторы запросов - в tableau.throttle
+"""
+import logging
+import os
+import threading
+from functools import partial
+from typing import Dict, Optional
+
+import tableauserverclient as TSC
+
+from metrics import metrics
+
+from .cache import ResponseCache, install_cache
+from .throttle import RequestGovernor, install_governor
+from .workbooks_endpoint import WorkbooksWithRevisions
+
+
+class TableauSession(object):
+    """
+    Подключение к одному сайту Tableau Server. Вход выполняется один раз при первом обращении к server
+    или endpoint, потокобезопасно
+    """
+
+    def __init__(self, server_url: Optional[str] = None, token_name: Optional[str] = None,
+                 token_value: Optional[str] = None, site: Optional[str] = None, cache_mode: Optional[str] = None,
+                 cache: Optional[ResponseCache] = None):
+        """
+        :param server_url: адрес Tableau Server
+        :param token_name: имя Personal Access Token
+        :param token_value: значение Personal Access Token
+        :param site: content url сайта
+        :param cache_mode: off, on или replay (см. tableau.cache)
+        :param cache: хранилище кэша, по умолчанию ResponseCache с TABLEAU_CACHE_TTL и TABLEAU_CACHE_MAX_MB
+        """
+        self.server_url = server_url or os.getenv('TABLEAU_SERVER_URL')
+        self.token_name = token_name or os.getenv('TABLEAU_TOKEN_NAME')
+        self.token_value = token_value or os.getenv('TABLEAU_TOKEN_VALUE')
+        self.site = site if site is not None else os.getenv('TABLEAU_SITENAME')
+        self.cache_mode = cache_mode or os.getenv('TABLEAU_CACHE', 'off')
+        self._cache = cache
+        self._server: Optional[TSC.Server] = None
+        self._endpoints: Optional[Dict[str, object]] = None
+        self.governor: Optional[RequestGovernor] = None
+        self._lock = threading.Lock()
+        self._auth_lock = threading.Lock()
+
+    @property
+    def server(self) -> TSC.Server:
+        """
+        TSC.Server с выполненным входом
+        """
+        if self._server is None:
+            with self._lock:
+                if self._server is None:
+                    self._server = self._connect()
+        return self._server
+
+    @property
+    def endpoints(self) -> Dict[str, object]:
+        if self._endpoints is None:
+            server = self.server
+            with self._lock:
+                if self._endpoints is None:
+                    self._endpoints = self._make_endpoints(server)
+        return self._endpoints
+
+    @staticmethod
+    def _make_endpoints(server: TSC.Server) -> Dict[str, object]:
+        return {
+            'workbooks'    : WorkbooksWithRevisions(server),
+            'views'        : server.views,
+            'datasources'  : server.datasources,
+            'projects'     : server.projects,
+            'users'        : server.users,
+            'groups'       : server.groups,
+            'subscriptions': server.subscriptions,
+            'schedules'    : server.schedules,
+            'sites'        : server.sites,
+            'jobs'         : server.jobs,
+            'server_info'  : server.server_info,
+        }
+
+    def endpoint(self, method: str) -> object:
+        return self.endpoints[method]
+
+    def sign_in(self, server: TSC.Server) -> None:
+        server.auth.sign_in(TSC.PersonalAccessTokenAuth(self.token_name, self.token_value, self.site))
+
+    def refresh_token(self, server: TSC.Server, expired_token: Optional[str]) -> str:
+        """
+        Повторный вход после ответа 401 на запрос с токеном expired_token. Если токен уже обновил
+        другой поток, вход не повторяется. Возвращает действующий токен
+        """
+        with self._auth_lock:
+            if server.auth_token == expired_token:
+                logging.warning('Tableau token expired, signing in to {} again'.format(self.server_url))
+                self.sign_in(server)
+            return server.auth_token
+
+    def sign_out(self) -> None:
+        if self._server is not None and self._server.is_signed_in():
+            self._server.auth.sign_out()
+
+    def _connect(self) -> TSC.Server:
+        if not self.server_url:
+            raise ValueError('Tableau Server URL is not set: pass server_url or set TABLEAU_SERVER_URL')
+
+        server = TSC.Server(self.server_url)
+        # Частота, число одновременных запросов и повторы; кэш подключается поверх, чтобы ответы из кэша
+        # не расходовали лимиты
+        self.governor = install_governor(server.session, reauthenticate=partial(self.refresh_token, server))
+        if self.cache_mode != 'off':
+            cache = self._cache or ResponseCache(ttl=float(os.getenv('TABLEAU_CACHE_TTL', 24 * 3600)),
+                                                 max_bytes=int(os.getenv('TABLEAU_CACHE_MAX_MB', 1024)) * 2 ** 20)
+            install_cache(server.session, self.cache_mode, cache)
+
+        # Время, размер и статус каждого ответа - в метрики текущего шага
+        server.session.hooks['response'].append(metrics.record_response)
+
+        self.sign_in(server)
+        server.use_server_version()
+        logging.info('Signed in to {} (REST API {})'.format(self.server_url, server.version))
+        return server
+
+    def __enter__(self) -> 'TableauSession':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.sign_out()
+
+
+_session: Optional[TableauSession] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> TableauSession:
+    """
+    Сессия запуска: создается при первом вызове из переменных окружения
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = TableauSession()
+        return _session
+
+
+def set_session(session: Optional[TableauSession]) -> Optional[TableauSession]:
+    """
+    Заменяет сессию запуска (например, сессией на другой сервер или заглушку). Возвращает прежнюю
+    """
+    global _session
+    with _session_lock:
+        previous, _session = _session, session
+    return previous
@@ -0,0 +1,255 @@
+"""
+Управление запросами к Tableau Server: ограничение частоты (TokenBucket), адаптивное ограничение
+числа одновременных запросов (AdaptiveConcurrency) и повтор неудачных запросов (RequestGovernor).
+
+RequestGovernor подключается к requests.Session сервера как HTTPAdapter (под кэшем, см. tableau.session),
+поэтому через него идут все запросы TSC: страницы get_items, populate, ревизии, скачивания и вход
+"""
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+import requests
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
+
+from metrics import metrics
+
+from .cache import SIGNIN_SUFFIX
+
+# Потолок запросов в секунду на сервер (0 - без ограничения) и сколько запросов можно отправить подряд
+MAX_REQUESTS_PER_SECOND = float(os.getenv('TABLEAU_MAX_REQUESTS_PER_SECOND', 10))
+BURST = int(os.getenv('TABLEAU_BURST', 10))
+
+# Одновременные запросы: начальный и максимальный предел AdaptiveConcurrency
+INITIAL_CONCURRENCY = int(os.getenv('TABLEAU_INITIAL_CONCURRENCY', 4))
+MAX_CONCURRENCY = int(os.getenv('TABLEAU_MAX_CONCURRENCY', 16))
+
+# Повторы: сколько раз и базовая и максимальная пауза перед повтором в секундах
+MAX_RETRIES = int(os.getenv('TABLEAU_MAX_RETRIES', 5))
+BACKOFF = 0.5
+MAX_BACKOFF = 60.0
+
+# Повторяются только запросы, которые ничего не меняют на сервере
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# Сервер перегружен: предел одновременных запросов уменьшается
+OVERLOAD_STATUSES = frozenset({429, 503})
+
+AUTH_HEADER = 'X-Tableau-Auth'
+
+
+class TokenBucket(object):
+    """
+    Не больше rate запросов в секунду в среднем и не больше burst подряд. Потокобезопасен:
+    рассчитан на вызов из пула потоков
+    """
+
+    def __init__(self, rate: Optional[float] = None, burst: int = 1):
+        self.rate = rate or 0.0
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Блокирует поток до момента, когда можно отправить следующий запрос. Возвращает время ожидания
+        """
+        if not self.rate:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            # Токен берется сразу, даже в долг: следующие потоки ждут дольше, порядок сохраняется
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class AdaptiveConcurrency(object):
+    """
+    Предел одновременных запросов по схеме AIMD: после каждого успешного ответа растет на 1/limit
+    (примерно на 1 за каждые limit ответов), после ответа о перегрузке (429, 503) уменьшается вдвое.
+    Ответы на запросы, отправленные до последнего уменьшения, предел больше не уменьшают:
+    одна волна перегрузки - одно уменьшение
+    """
+
+    def __init__(self, initial: int = INITIAL_CONCURRENCY, minimum: int = 1, maximum: int = MAX_CONCURRENCY):
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.in_flight = 0
+        self._decreased_at = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> float:
+        """
+        Блокирует поток, пока число запросов в работе не меньше предела. Возвращает время ожидания
+        """
+        started_at = time.monotonic()
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+        return time.monotonic() - started_at
+
+    def release(self, status: Optional[int], sent_at: float) -> None:
+        """
+        Запрос, отправленный в sent_at, завершился со статусом status (None - ошибка соединения)
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if status in OVERLOAD_STATUSES:
+                if sent_at >= self._decreased_at:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._decreased_at = time.monotonic()
+                    logging.warning('Tableau Server is overloaded ({}): concurrency limit {}'.format(
+                        status, int(self.limit)))
+            elif status is not None and status < 500:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class RequestGovernor(HTTPAdapter):
+    """
+    HTTPAdapter, который пропускает запросы к inner через TokenBucket и AdaptiveConcurrency.
+    Идемпотентные запросы (GET) после 429, 5xx и ошибок соединения повторяются с экспоненциальной паузой
+    со случайной составляющей (не меньше Retry-After сервера, но не больше max_backoff). После 401 (истек токен)
+    выполняется повторный вход через reauthenticate и запрос повторяется с новым токеном, один раз
+    """
+
+    def __init__(self, bucket: Optional[TokenBucket] = None, concurrency: Optional[AdaptiveConcurrency] = None,
+                 inner: Optional[HTTPAdapter] = None, retries: int = MAX_RETRIES, backoff: float = BACKOFF,
+                 max_backoff: float = MAX_BACKOFF, reauthenticate: Optional[Callable[[Optional[str]], str]] = None,
+                 **kwargs):
+        """
+        :param bucket: ограничение частоты, по умолчанию MAX_REQUESTS_PER_SECOND и BURST
+        :param concurrency: ограничение одновременных запросов, по умолчанию INITIAL_CONCURRENCY и MAX_CONCURRENCY
+        :param inner: адаптер, который отправляет запросы
+        :param retries: сколько раз повторять запрос
+        :param backoff: пауза перед первым повтором, дальше удваивается
+        :param max_backoff: максимальная пауза
+        :param reauthenticate: функция (истекший токен) -> новый токен
+        """
+        super(RequestGovernor, self).__init__(**kwargs)
+        self.bucket = bucket or TokenBucket(MAX_REQUESTS_PER_SECOND, BURST)
+        self.concurrency = concurrency or AdaptiveConcurrency()
+        self.inner = inner or HTTPAdapter()
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.reauthenticate = reauthenticate
+
+    def send(self, request: requests.PreparedRequest, stream: bool = False, **kwargs) -> requests.Response:
+        idempotent = request.method in IDEMPOTENT_METHODS
+        signin = request.url.split('?', 1)[0].endswith(SIGNIN_SUFFIX)
+        reauthenticated = False
+        attempt = 0
+        while True:
+            waited = self.concurrency.acquire()
+            waited += self.bucket.acquire()
+            if waited > 0:
+                metrics.add('http_wait_s', waited)
+
+            sent_at = time.monotonic()
+            response, status = None, None
+            try:
+                response = self.inner.send(request, stream=stream, **kwargs)
+                status = response.status_code
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if not idempotent or attempt >= self.retries:
+                    raise
+                reason = type(e).__name__
+            finally:
+                # Слот освобождается до повторного входа и паузы: вход сам идет через этот адаптер
+                self.concurrency.release(status, sent_at)
+
+            if status == 401 and self.reauthenticate is not None and not signin and not reauthenticated:
+                reauthenticated = True
+                discard(response)
+                request.headers[AUTH_HEADER] = self.reauthenticate(request.headers.get(AUTH_HEADER))
+                continue
+
+            if response is not None:
+                if status not in RETRY_STATUSES or not idempotent or attempt >= self.retries:
+                    return response
+                reason = str(status)
+                # Retry-After сервера ограничен max_backoff: иначе один ответ может остановить поток на часы
+                delay = max(self.delay(attempt), min(retry_after(response), self.max_backoff))
+                discard(response)
+            else:
+                delay = self.delay(attempt)
+
+            attempt += 1
+            metrics.add('http_retries', 1)
+            logging.warning('{} {}: {}, retry {} of {} in {:.1f}s'.format(
+                request.method, request.url, reason, attempt, self.retries, delay))
+            time.sleep(delay)
+
+    def delay(self, attempt: int) -> float:
+        """
+        Экспоненциальная пауза перед повтором attempt + 1 со случайной составляющей (full jitter):
+        одновременно упавшие запросы повторяются в разное время
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def close(self) -> None:
+        self.inner.close()
+        super(RequestGovernor, self).close()
+
+
+def discard(response: requests.Response) -> None:
+    """
+    Закрывает ответ, который не будет возвращен. Тело ошибки дочитывается, чтобы соединение вернулось в пул,
+    а не закрывалось
+    """
+    try:
+        response.content
+    except requests.exceptions.RequestException:
+        pass
+    response.close()
+
+
+def retry_after(response: requests.Response) -> float:
+    """
+    Пауза из заголовка Retry-After в секундах: число секунд или HTTP-дата. 0, если заголовка нет
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return 0.0
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def install_governor(session: requests.Session, reauthenticate: Optional[Callable[[Optional[str]], str]] = None,
+                     **kwargs) -> RequestGovernor:
+    """
+    Подключает RequestGovernor ко всем http(s) запросам session (server.session у TSC).
+    Прежние адаптеры становятся внутренними
+    """
+    concurrency = kwargs.pop('concurrency', None) or AdaptiveConcurrency()
+    inner = session.get_adapter('https://')
+    if type(inner) is HTTPAdapter:
+        # В пуле urllib3 по умолчанию 10 соединений: при большем пределе лишние соединения закрывались бы
+        # после каждого запроса
+        inner = HTTPAdapter(pool_maxsize=max(concurrency.maximum, DEFAULT_POOLSIZE))
+    governor = RequestGovernor(concurrency=concurrency, inner=inner, reauthenticate=reauthenticate, **kwargs)
+    session.mount('https://', governor)
+    session.mount('http://', governor)
+    logging.info('Tableau request governor: {} requests/s, concurrency {}..{}, {} retries'.format(
+        governor.bucket.rate or 'unlimited', int(governor.concurrency.limit), governor.concurrency.maximum,
+        governor.retries))
+    return governor
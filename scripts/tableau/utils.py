@@ -1,112 +1,310 @@
 """
 Функции и утилиты для работы с Tableau Server
 """
+import asyncio
+import json
 import logging
 import os
-from collections import defaultdict
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from operator import attrgetter
 from pathlib import Path
-from typing import Collection, Dict, List, Tuple, Union
+from typing import Any, Callable, Collection, Dict, List, Optional, Tuple, TypeVar, Union
 
 import pandas as pd
 import tableauserverclient as TSC
 
+from metrics import bind, metrics
+
+from .async_client import PAGE_WORKERS, fetch_all_pages
+from .project_hierarchy import ProjectHierarchy
+from .records import RECORD_TYPES, LinkRecord, Record
+from .revision_item import REVISION_COLUMNS
+from .session import get_session
+from .throttle import MAX_CONCURRENCY
 from .workbooks_endpoint import WorkbooksWithRevisions
 
-tableau_auth = TSC.PersonalAccessTokenAuth(os.getenv('TABLEAU_TOKEN_NAME'),
-                                           os.getenv('TABLEAU_TOKEN_VALUE'),
-                                           os.getenv('TABLEAU_SITENAME'))
-server = TSC.Server(os.getenv('TABLEAU_SERVER_URL'))
 request_options = TSC.RequestOptions(pagesize=1000)
 
-# Sign in
-server.auth.sign_in(tableau_auth)
-server.use_server_version()
-
-# mapping
-endpoints = {
-    'workbooks'    : WorkbooksWithRevisions(server),
-    'views'        : server.views,
-    'datasources'  : server.datasources,
-    'projects'     : server.projects,
-    'users'        : server.users,
-    'groups'       : server.groups,
-    'subscriptions': server.subscriptions,
-    'schedules'    : server.schedules,
-    'sites'        : server.sites,
-    'jobs'         : server.jobs,
-    'server_info'  : server.server_info,
-}
-
-
-def get_items(method: str) -> \
+# Начальная часть ссылок Tableau Server, которая удаляется из webpage_url
+TABLEAU_URL_PREFIX = 'http://tableau4/#/site/NetologyGroup/'
+
+# Строковые и логические значения булевых атрибутов TSC
+BOOL_VALUES = {True: True, False: False, 'true': True, 'false': False}
+
+# Параллельный populate: число потоков. Сколько запросов из них одновременно уходит на сервер и как часто,
+# решает RequestGovernor сессии (tableau.throttle), поэтому потоков столько же, сколько его максимальный предел
+POPULATE_WORKERS = int(os.getenv('TABLEAU_POPULATE_WORKERS', MAX_CONCURRENCY))
+
+T = TypeVar('T')
+
+
+def get_endpoint(method: str) -> TSC.server.endpoint.endpoint.Endpoint:
+    """
+    endpoint сессии запуска: workbooks, views, datasources, projects, users, groups, subscriptions, schedules,
+    sites, jobs, server_info. При первом вызове выполняется вход на сервер (tableau.session)
+    """
+    return get_session().endpoint(method)
+
+
+def updated_since_options(watermark: Optional[str]) -> TSC.RequestOptions:
+    """
+    Параметры запроса с серверным фильтром updatedAt >= watermark. Без watermark - все объекты
+    """
+    opts = TSC.RequestOptions(pagesize=request_options.pagesize)
+    if watermark:
+        opts.filter.add(TSC.Filter(TSC.RequestOptions.Field.UpdatedAt,
+                                   TSC.RequestOptions.Operator.GreaterThanOrEqual,
+                                   watermark))
+    return opts
+
+
+def sorted_options(field: str) -> TSC.RequestOptions:
+    """
+    Параметры запроса с сортировкой по field (TSC.RequestOptions.Field): без сортировки порядок сущностей
+    в постраничном списке не определен и может меняться между запросами
+    """
+    opts = TSC.RequestOptions(pagesize=request_options.pagesize)
+    opts.sort.add(TSC.Sort(field, TSC.RequestOptions.Direction.Asc))
+    return opts
+
+
+def count_items(method: str, req_options: Optional[TSC.RequestOptions] = None) -> int:
+    """
+    Число сущностей method на сервере с фильтрами req_options: один запрос страницы из одной сущности
+    """
+    opts = TSC.RequestOptions(pagenumber=1, pagesize=1)
+    if req_options:
+        opts.filter, opts.sort = req_options.filter, req_options.sort
+    _, pagination = get_endpoint(method).get(opts)
+    return pagination.total_available
+
+
+def get_items(method: str, req_options: Optional[TSC.RequestOptions] = None, **get_kwargs) -> \
         Tuple[Collection[Union[TSC.DatasourceItem, TSC.GroupItem, TSC.ProjectItem,
                                TSC.ScheduleItem, TSC.SubscriptionItem,
                                TSC.UserItem, TSC.ViewItem, TSC.WorkbookItem]],
               TSC.server.endpoint.endpoint.QuerysetEndpoint]:
     """
-    Забирает все сущности указанного method. Вызывает функцию get
+    Забирает все сущности указанного method. Вызывает функцию get постранично, страницы после первой - параллельно
+
+    :param method: имя endpoint для get_endpoint
+    :param req_options: размер страницы, фильтры и сортировка
+    :param get_kwargs: дополнительные аргументы get, например usage=True для views
+    """
+    return get_items_many([method], {method: req_options} if req_options else None,
+                          {method: get_kwargs} if get_kwargs else None)[method]
+
+
+@metrics.timed('get_items')
+def get_items_many(methods: Collection[str], req_options: Optional[Dict[str, TSC.RequestOptions]] = None,
+                   get_kwargs: Optional[Dict[str, Dict[str, Any]]] = None) -> \
+        Dict[str, Tuple[Collection[object], TSC.server.endpoint.endpoint.QuerysetEndpoint]]:
     """
-    endpoint = endpoints.get(method)
-    _, pagination_item = endpoint.get(TSC.RequestOptions())
-    items = list(TSC.Pager(endpoint, request_options))
-    logging.info("There are {} {} on site. Get {}".format(
-        pagination_item.total_available, method, len(items)))
-    return items, endpoint
+    Забирает все сущности сразу для нескольких endpoints. Выгрузки идут одновременно
+    и делят общий пул потоков, поэтому занимают время самой долгой из них, а не сумму
+
+    :param methods: имена endpoints для get_endpoint
+    :param req_options: {method: параметры запроса} для отдельных endpoints, например с фильтром по updatedAt
+    :param get_kwargs: {method: дополнительные аргументы get} для отдельных endpoints
+    :return: {method: (items, endpoint)}
+    """
+    req_options = req_options or {}
+    get_kwargs = get_kwargs or {}
+
+    async def gather() -> List[Tuple[List[object], Optional[int]]]:
+        semaphore = asyncio.Semaphore(PAGE_WORKERS)
+        with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as executor:
+            return await asyncio.gather(*[
+                fetch_all_pages(partial(get_endpoint(method).get, **get_kwargs.get(method, {})),
+                                req_options.get(method) or request_options, executor, semaphore)
+                for method in methods
+            ])
 
+    result = {}
+    for method, (items, total_available) in zip(methods, asyncio.run(gather())):
+        logging.info("There are {} {} on site. Get {}".format(total_available, method, len(items)))
+        result[method] = (items, get_endpoint(method))
+    return result
 
+
+@metrics.timed('get_populate_items')
 def get_populate_items(items: Collection[Union[TSC.DatasourceItem, TSC.GroupItem, TSC.UserItem, TSC.ViewItem, TSC.WorkbookItem]],
                        endpoint: TSC.server.endpoint.endpoint.QuerysetEndpoint,
-                       populate_method: str) -> List[Tuple[object, Union[int, str]]]:
+                       populate_method: str,
+                       workers: int = POPULATE_WORKERS) -> List[Record]:
     """
     Вызывает функцию populate_method для каждого объекта в items
     https://tableau.github.io/server-client-python/docs/populate-connections-views
+    Вложенные сущности сразу переводятся в компактные записи (tableau.records) с id родителя в parent_id,
+    объекты TSC после этого не хранятся
+
+    :param items: объекты, для которых нужно получить вложенные сущности
+    :param endpoint: endpoint, у которого есть функция populate_<populate_method>
+    :param populate_method: revisions/connections/views/workbooks/users
+    :param workers: число параллельных потоков, 1 - последовательный режим
     """
     # Определяем функцию вызова в зависимости от endpoint
     populate_func = getattr(endpoint, 'populate_{}'.format(populate_method))
 
-    populate_items = []
-    for i in items:
+    record_type = RECORD_TYPES[populate_method]
+
+    def populate(i) -> List[Record]:
+        """
+        Загружает вложенные сущности одного объекта. Ленивый fetcher вызывается здесь же, в потоке пула
+        """
         populate_func(i)
-        for x in getattr(i, populate_method):
-            populate_items.append((x, i.id))
+        return [record_type.from_item(x, i.id) for x in getattr(i, populate_method)]
+
+    results = map_items(populate, items, workers)
+
+    populate_items = [x for result in results for x in result]
     logging.info("There are {} {} in {} {}".format(
         len(populate_items), populate_method, len(items), endpoint.baseurl.rsplit('/', 1)[-1]))
 
     return populate_items
 
 
+@metrics.timed('get_populate_links')
+def get_populate_links(items: Collection[object],
+                       endpoint: TSC.server.endpoint.endpoint.Endpoint,
+                       fetch_page: Callable[[object, TSC.RequestOptions], Tuple[List[object], TSC.PaginationItem]]) \
+        -> List[LinkRecord]:
+    """
+    Связи items с вложенными сущностями, которые сервер отдает постранично (например, пользователи групп).
+    Все страницы всех items запрашиваются в общем пуле потоков: первая страница каждого item,
+    затем остальные страницы параллельно. Связи сразу переводятся в LinkRecord (id вложенной сущности, parent_id)
+
+    :param items: объекты-родители
+    :param endpoint: endpoint, через который идут запросы
+    :param fetch_page: блокирующая функция вида (item, req_options) -> (вложенные сущности, pagination_item)
+    """
+
+    async def gather() -> List[Tuple[List[object], Optional[int]]]:
+        semaphore = asyncio.Semaphore(PAGE_WORKERS)
+        with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as executor:
+            return await asyncio.gather(*[
+                fetch_all_pages(partial(fetch_page, i), TSC.RequestOptions(pagesize=request_options.pagesize),
+                                executor, semaphore)
+                for i in items
+            ])
+
+    links = [LinkRecord.from_item(x, i.id) for i, (children, _) in zip(items, asyncio.run(gather())) for x in children]
+    logging.info("There are {} links in {} {}".format(len(links), len(items), endpoint.baseurl.rsplit('/', 1)[-1]))
+
+    return links
+
+
+def get_group_users_page(group: TSC.GroupItem, req_options: Optional[TSC.RequestOptions] = None) \
+        -> Tuple[List[TSC.UserItem], TSC.PaginationItem]:
+    """
+    Одна страница пользователей группы: GET /sites/site-id/groups/group-id/users.
+    Публичный populate_users TSC проходит страницы только последовательно, а его закрытый
+    _get_users_for_group может измениться между версиями TSC, поэтому запрос страницы - здесь,
+    на тех же get_request и from_response, что и у WorkbooksWithRevisions
+    """
+    endpoint = get_endpoint('groups')
+    url = '{}/{}/users'.format(endpoint.baseurl, group.id)
+    server_response = endpoint.get_request(url, req_options)
+    namespace = endpoint.parent_srv.namespace
+    return (TSC.UserItem.from_response(server_response.content, namespace),
+            TSC.PaginationItem.from_response(server_response.content, namespace))
+
+
+def get_group_members(groups: Collection[TSC.GroupItem]) -> List[LinkRecord]:
+    """
+    Связи пользователей со всеми groups (id пользователя, id группы): все страницы, группы и страницы - параллельно
+    """
+    return get_populate_links(groups, get_endpoint('groups'), get_group_users_page)
+
+
+def map_items(func: Callable[[object], T], items: Collection[object], workers: int = POPULATE_WORKERS) -> List[T]:
+    """
+    Вызывает func для каждого объекта в items в пуле потоков. Результаты в порядке items
+
+    :param func: функция, которая делает запросы к серверу
+    :param workers: число параллельных потоков, 1 - последовательный режим
+    """
+    if workers > 1:
+        # map сохраняет порядок items, поэтому результат совпадает с последовательным режимом
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(bind(func), items))
+    return [func(i) for i in items]
+
+
+@metrics.timed('get_revisions_df')
+def get_revisions_df(items: Collection[TSC.WorkbookItem],
+                     endpoint: WorkbooksWithRevisions,
+                     dtypes: Optional[Dict[str, str]] = None,
+                     since: Optional[Dict[str, int]] = None,
+                     workers: int = POPULATE_WORKERS) -> pd.DataFrame:
+    """
+    Ревизии всех workbooks одной таблицей со столбцом workbook_id.
+    Ответы разбираются сразу в столбцы (revisions_to_columns), без промежуточных RevisionItem,
+    и склеиваются в один DataFrame, где каждый столбец приводится к типу один раз.
+    Забираются все страницы истории, страницы одного workbook после первой - параллельно
+
+    :param items: workbooks
+    :param endpoint: WorkbooksWithRevisions
+    :param dtypes: типы столбцов, как в make_df
+    :param since: {workbook_id: последний сохраненный revision_number} - забрать только ревизии начиная с него
+    """
+    since = since or {}
+    with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as page_executor:
+        results = map_items(lambda i: endpoint.get_revision_columns(i, since.get(i.id), page_executor),
+                            items, workers)
+
+    columns = {c: [] for c in REVISION_COLUMNS}
+    workbook_ids = []
+    for i, result in zip(items, results):
+        for c in REVISION_COLUMNS:
+            columns[c].extend(result[c])
+        workbook_ids.extend([i.id] * len(result['revision_number']))
+
+    df = pd.DataFrame({c: cast_column(values, dtypes.get(c, 'str') if dtypes is not None else None)
+                       for c, values in columns.items()}, columns=list(REVISION_COLUMNS))
+    df['workbook_id'] = pd.Series(workbook_ids, dtype='string')
+    logging.info("There are {} revisions in {} workbooks".format(len(df), len(items)))
+
+    return df
+
+
 def download(obj: Union[TSC.models.workbook_item.WorkbookItem, TSC.models.datasource_item.DatasourceItem],
-             method: str = 'workbooks', no_extract: bool = False) -> None:
+             method: str = 'workbooks', no_extract: bool = False) -> Path:
     """
     Скачать workbook или datasource в папку data.
+    Файл скачивается во временную папку рядом и переименовывается в конечный одной операцией,
+    поэтому недокачанный файл никогда не заменяет предыдущую версию.
     https://help.tableau.com/current/api/rest_api/en-us/REST/rest_api_ref.htm#download_workbook
     https://help.tableau.com/current/api/rest_api/en-us/REST/rest_api_ref.htm#download_data_source
 
     :param obj: workbook или datasource
     :param method: workbooks/datasources
     :param no_extract: Specifies whether to download the file without the extract
+    :return: путь к сохраненному файлу
     """
     name = obj.name.replace('/', '|').strip()
-    path = Path.cwd().parent / 'data' / method / name
+    path = Path.cwd().parent / 'data' / method
     path.mkdir(parents=True, exist_ok=True)
 
     saved_path = None
-    endpoint = endpoints.get(method)
-    if method == 'workbooks':
-        saved_path = endpoint.download(obj.id, filepath=path, no_extract=no_extract)
-    elif method == 'datasources':
-        saved_path = endpoint.download(obj.id, filepath=path, include_extract=not no_extract)
+    endpoint = get_endpoint(method)
+    with tempfile.TemporaryDirectory(dir=path) as tmp_path:
+        if method == 'workbooks':
+            saved_path = endpoint.download(obj.id, filepath=tmp_path, no_extract=no_extract)
+        elif method == 'datasources':
+            saved_path = endpoint.download(obj.id, filepath=tmp_path, include_extract=not no_extract)
 
-    saved_path = Path(saved_path)
-    suffix = saved_path.suffix
-    new_path = path.with_suffix(suffix)
+        saved_path = Path(saved_path)
+        new_path = path / (name + saved_path.suffix)
+        saved_path.replace(new_path)
 
-    saved_path.rename(new_path)
     logging.info('Saved {}'.format(new_path))
-    path.rmdir()
+    return new_path
 
 
-def download_png(obj: TSC.models.workbook_item.WorkbookItem) -> None:
+def download_png(obj: TSC.models.workbook_item.WorkbookItem) -> Path:
     """
     Скачивает preview_image
     """
@@ -114,26 +312,53 @@ def download_png(obj: TSC.models.workbook_item.WorkbookItem) -> None:
     path.mkdir(parents=True, exist_ok=True)
 
     filename = path / '{}.png'.format(obj.id)
-    with open(filename, 'wb') as f:
+    tmp_filename = filename.with_suffix('.png.tmp')
+    with open(tmp_filename, 'wb') as f:
         f.write(obj.preview_image)
+    tmp_filename.replace(filename)
     logging.info('Saved {}'.format(filename))
+    return filename
 
 
-def make_df(objs: Collection, attrs: Collection[str]) -> pd.DataFrame:
+def cast_column(values: List[object], dtype: Optional[str] = None) -> pd.Series:
     """
-    Создает Pandas DataFrame из объектов objs со столбцами, описанными в attrs
+    Создает столбец из значений одного атрибута с типом dtype из helper.dtypes. Без dtype тип определяет pandas
     """
+    series = pd.Series(values, dtype=object)
+    if dtype is None:
+        return pd.Series(values)
+    if dtype == 'datetime':
+        return pd.to_datetime(series, utc=True)
+    if dtype == 'bool':
+        return series.map(BOOL_VALUES).astype('boolean')
+    if dtype == 'int':
+        return pd.to_numeric(series, errors='coerce').astype('Int64')
+    if dtype == 'tags':
+        return pd.Series([json.dumps(sorted(x), ensure_ascii=False) if x is not None else None for x in values],
+                         dtype='string')
+    if dtype == 'object':
+        return series
+    return series.astype('string')
 
-    def replace_url(url: str) -> str:
-        """
-        Удаляет начальную часть ссылки Tableau Server
-        """
-        return url.replace('http://tableau4/#/site/NetologyGroup/', '')
 
-    data = [[getattr(obj, a) for a in attrs] for obj in objs]
-    df = pd.DataFrame(data, columns=attrs)
+@metrics.timed('make_df')
+def make_df(objs: Collection, attrs: Collection[str], dtypes: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    """
+    Создает Pandas DataFrame из объектов objs со столбцами, описанными в attrs.
+    Таблица собирается по столбцам, каждый столбец приводится к своему типу из dtypes (helper.dtypes),
+    атрибуты, которых нет в dtypes, становятся строками
+    """
+    attrs = list(attrs)
+    getter = attrgetter(*attrs)
+    rows = [getter(obj) for obj in objs]
+    columns = list(zip(*rows)) if len(attrs) > 1 else [rows]
+    if not rows:
+        columns = [[] for _ in attrs]
+
+    df = pd.DataFrame({a: cast_column(list(values), dtypes.get(a, 'str') if dtypes is not None else None)
+                       for a, values in zip(attrs, columns)}, columns=attrs)
     if 'webpage_url' in df:
-        df['webpage_url'] = df['webpage_url'].apply(replace_url)
+        df['webpage_url'] = df['webpage_url'].str.replace(TABLEAU_URL_PREFIX, '', regex=False)
 
     return df
 
@@ -142,22 +367,13 @@ def make_project_path(items: Collection[TSC.ProjectItem]) -> Dict[Union[str, int
     """
     Возвращает полный путь до проекта
     """
-    project_dict = {}
-    for i in items:
-        project_dict[i.id] = i
-
-    project_path = defaultdict(list)
-    for i in items:
-        parent_id = i.parent_id
-        project_path[i.id].insert(0, i.name)
-        while parent_id:
-            parent = project_dict[parent_id]
-            project_path[i.id].insert(0, parent.name)
-            parent_id = parent.parent_id
+    hierarchy = ProjectHierarchy(items)
+    projects = hierarchy.projects
 
+    project_path = {}
     for i in items:
-        path = project_path[i.id]
+        path = [projects[x].name for x in hierarchy.chain(i.id)]
+        project_path[i.id] = path
         i.path = path
 
-    del project_dict
     return project_path
@@ -0,0 +1,56 @@
+"""
+High-water mark по updated_at для инкрементальной выгрузки.
+Хранится в json-файле: {endpoint: максимальный updated_at, ISO 8601 UTC}
+"""
+import json
+import logging
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Collection, Optional
+
+WATERMARKS_PATH = Path.cwd().parent / 'data' / 'state' / 'watermarks.json'
+
+
+def get_watermark(method: str, path: Path = WATERMARKS_PATH) -> Optional[str]:
+    """
+    Возвращает сохраненный high-water mark для endpoint method или None, если его еще нет
+    """
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f).get(method)
+
+
+def set_watermark(method: str, value: str, path: Path = WATERMARKS_PATH) -> None:
+    """
+    Сохраняет high-water mark для endpoint method. Файл перезаписывается атомарно
+    """
+    watermarks = {}
+    if path.exists():
+        with open(path) as f:
+            watermarks = json.load(f)
+    watermarks[method] = value
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(watermarks, f, indent=2, sort_keys=True)
+    tmp_path.replace(path)
+    logging.info('Watermark for {} set to {}'.format(method, value))
+
+
+def max_updated_at(items: Collection[object]) -> Optional[str]:
+    """
+    Максимальный updated_at среди items в формате фильтра Tableau REST API
+    """
+    dates = [i.updated_at for i in items if i.updated_at]
+    if not dates:
+        return None
+    return format_watermark(max(dates))
+
+
+def format_watermark(value: datetime) -> str:
+    """
+    Переводит datetime в формат фильтра Tableau REST API
+    """
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
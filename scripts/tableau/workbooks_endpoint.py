@@ -1,15 +1,20 @@
+import asyncio
 import logging
 
-from tableauserverclient.server import PaginationItem
+from tableauserverclient.server import PaginationItem, RequestOptions
 from tableauserverclient.server.endpoint.endpoint import api
-from tableauserverclient.server.endpoint.exceptions import MissingRequiredFieldError
+from tableauserverclient.server.endpoint.exceptions import MissingRequiredFieldError, ServerResponseError
 from tableauserverclient.server.endpoint.workbooks_endpoint import Workbooks
 
-from .revision_item import RevisionItem
+from .async_client import fetch_all_pages
+from .revision_item import REVISION_COLUMNS, RevisionItem, revisions_to_columns
 from .workbook_item import WorkbookItemWithRevisions
 
 logger = logging.getLogger('tableau.endpoint.workbooks')
 
+# Max page size of Tableau REST API
+REVISIONS_PAGE_SIZE = 1000
+
 
 class WorkbooksWithRevisions(Workbooks):
     def __init__(self, parent_srv):
@@ -30,12 +35,67 @@ class WorkbooksWithRevisions(Workbooks):
 
     def _get_workbook_revisions(self, workbook_item, req_options=None):
         """
-        GET /api/api-version/sites/site-id/workbooks/workbook-id/revision
+        GET /api/api-version/sites/site-id/workbooks/workbook-id/revisions
+        All pages, the pages after the first one are requested concurrently
+        """
+        req_options = req_options or RequestOptions(pagesize=REVISIONS_PAGE_SIZE)
+        revisions, _ = self._get_revision_pages(workbook_item, RevisionItem.from_response, req_options)
+        return revisions
+
+    def _get_revision_pages(self, workbook_item, parse, req_options, executor=None):
+        """
+        Pages of revisions starting from req_options.pagenumber, each page parsed by parse(content, ns).
+        Returns list of parsed items in page order and total_available
         """
         url = "{0}/{1}/revisions".format(self.baseurl, workbook_item.id)
-        server_response = self.get_request(url, req_options)
-        connections = RevisionItem.from_response(server_response.content, self.parent_srv.namespace)
-        return connections
+
+        def fetch_page(page_options):
+            server_response = self.get_request(url, page_options)
+            pagination_item = PaginationItem.from_response(server_response.content, self.parent_srv.namespace)
+            return parse(server_response.content, self.parent_srv.namespace), pagination_item
+
+        return asyncio.run(fetch_all_pages(fetch_page, req_options, executor))
+
+    # Get all revisions of workbook as columns
+    @api(version="2.0")
+    def get_revision_columns(self, workbook_item, since_revision=None, executor=None):
+        """
+        Revisions of workbook as {column: values}, parsed without RevisionItem objects.
+        since_revision - last stored revision number: only revisions >= since_revision are returned
+        and only pages that contain them are requested. The stored revision itself is returned again,
+        because its current flag changes when a new revision is published
+        """
+        if not workbook_item.id:
+            error = "Workbook item missing ID. Workbook must be retrieved from server first."
+            raise MissingRequiredFieldError(error)
+
+        def parse_page(content, ns):
+            return [revisions_to_columns(content, ns)]
+
+        pages = None
+        first_page = (since_revision - 1) // REVISIONS_PAGE_SIZE + 1 if since_revision else 1
+        if first_page > 1:
+            # Revisions are numbered from 1 in ascending order, so the page of since_revision is known
+            # unless old revisions were removed on server. Then numbers are shifted and all pages are requested
+            try:
+                pages, _ = self._get_revision_pages(
+                    workbook_item, parse_page, RequestOptions(pagenumber=first_page, pagesize=REVISIONS_PAGE_SIZE),
+                    executor)
+            except ServerResponseError:
+                pages = None
+            first_numbers = pages[0]['revision_number'] if pages else None
+            if not first_numbers or first_numbers[0] > since_revision:
+                pages = None
+        if pages is None:
+            pages, _ = self._get_revision_pages(
+                workbook_item, parse_page, RequestOptions(pagesize=REVISIONS_PAGE_SIZE), executor)
+
+        columns = {c: [] for c in REVISION_COLUMNS}
+        for page in pages:
+            keep = [since_revision is None or (n is not None and n >= since_revision) for n in page['revision_number']]
+            for c in REVISION_COLUMNS:
+                columns[c].extend(v for v, k in zip(page[c], keep) if k)
+        return columns
 
     # Get all workbooks on site
     @api(version="2.0")
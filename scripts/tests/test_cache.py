@@ -0,0 +1,127 @@
+"""
+Кэш ответов Tableau: попадания и ttl, режим replay, вытеснение по размеру и то, что токен входа
+никогда не записывается на диск
+"""
+import os
+import time
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from tableau.cache import REPLAY_TOKEN, CacheMissError, CachingAdapter, ResponseCache
+
+SERVER = 'https://tableau.example.com/api/3.7'
+TOKEN = 'Xk9-secret-session-token|site'
+SIGNIN_RESPONSE = ('<tsResponse><credentials token="{}" estimatedTimeToExpiration="365:00:00">'
+                   '<site id="site-1" contentUrl=""/><user id="user-1"/></credentials></tsResponse>').format(TOKEN)
+
+
+class FakeServer(HTTPAdapter):
+    """
+    Внутренний адаптер: отвечает на запросы без сети и считает их
+    """
+
+    def __init__(self):
+        super(FakeServer, self).__init__()
+        self.requests = []
+
+    def send(self, request, stream=False, **kwargs):
+        self.requests.append((request.method, request.url))
+        response = requests.Response()
+        response.status_code = 200
+        response.url = request.url
+        response.request = request
+        if request.url.endswith('/auth/signin'):
+            response._content = SIGNIN_RESPONSE.encode('utf-8')
+            response.headers['X-Tableau-Auth'] = TOKEN
+            response.headers['Set-Cookie'] = 'workgroup_session_id={}; Path=/'.format(TOKEN)
+        else:
+            response._content = '<tsResponse url="{}" n="{}"/>'.format(request.url, len(self.requests)).encode('utf-8')
+        response.headers['Content-Type'] = 'application/xml'
+        return response
+
+
+def make_session(cache, mode):
+    server = FakeServer()
+    session = requests.Session()
+    session.mount('https://', CachingAdapter(cache, mode, inner=server))
+    return session, server
+
+
+def test_cached_get_until_ttl(tmp_path):
+    cache = ResponseCache(tmp_path, ttl=3600)
+    session, server = make_session(cache, 'on')
+
+    first = session.get(SERVER + '/sites/site-1/workbooks')
+    second = session.get(SERVER + '/sites/site-1/workbooks')
+
+    assert second.content == first.content
+    assert len(server.requests) == 1
+
+    cache.ttl = 0
+    time.sleep(0.01)
+    session.get(SERVER + '/sites/site-1/workbooks')
+    assert len(server.requests) == 2
+
+
+def test_replay_miss(tmp_path):
+    session, server = make_session(ResponseCache(tmp_path), 'replay')
+
+    with pytest.raises(CacheMissError, match='is not in Tableau cache snapshot'):
+        session.get(SERVER + '/sites/site-1/workbooks')
+    assert server.requests == []
+
+
+def test_replay_ignores_ttl(tmp_path):
+    cache = ResponseCache(tmp_path, ttl=0)
+    on, _ = make_session(cache, 'on')
+    recorded = on.get(SERVER + '/sites/site-1/views')
+
+    replay, server = make_session(cache, 'replay')
+
+    assert replay.get(SERVER + '/sites/site-1/views').content == recorded.content
+    assert server.requests == []
+
+
+def test_eviction_removes_least_recently_read(tmp_path):
+    cache = ResponseCache(tmp_path)
+    session, _ = make_session(cache, 'on')
+    urls = [SERVER + '/sites/site-1/workbooks?pageNumber={}'.format(i) for i in range(4)]
+    for i, url in enumerate(urls):
+        session.get(url)
+        # Время последнего чтения - по mtime записи индекса
+        index_file = tmp_path / 'index' / '{}.json'.format(cache.key('GET', url))
+        os.utime(index_file, (i, i))
+    session.get(urls[0])
+
+    size = sum(p.stat().st_size for p in (tmp_path / 'objects').iterdir())
+    cache.max_bytes = size // 2
+    cache.evict()
+
+    assert cache.get(cache.key('GET', urls[0])) is not None
+    assert cache.get(cache.key('GET', urls[1])) is None
+    assert sum(p.stat().st_size for p in (tmp_path / 'objects').iterdir()) <= cache.max_bytes
+
+
+def test_signin_token_is_never_written(tmp_path):
+    cache = ResponseCache(tmp_path)
+    session, server = make_session(cache, 'on')
+
+    signed_in = session.post(SERVER + '/auth/signin', data=b'<tsRequest/>')
+    session.get(SERVER + '/sites/site-1/workbooks')
+    # Вход всегда запрашивается заново
+    session.post(SERVER + '/auth/signin', data=b'<tsRequest/>')
+
+    assert TOKEN.encode('utf-8') in signed_in.content
+    assert [m for m, _ in server.requests] == ['POST', 'GET', 'POST']
+    for path in tmp_path.rglob('*'):
+        if path.is_file():
+            assert TOKEN.encode('utf-8') not in path.read_bytes(), path
+
+    replay, _ = make_session(cache, 'replay')
+    replayed = replay.post(SERVER + '/auth/signin', data=b'<tsRequest/>')
+    assert b'token="' + REPLAY_TOKEN + b'"' in replayed.content
+    assert b'<site id="site-1"' in replayed.content
+    assert 'X-Tableau-Auth' not in replayed.headers
+    assert 'Set-Cookie' not in replayed.headers
@@ -0,0 +1,143 @@
+"""
+Сохранение результатов шагов (Parquet, pickle, несохраняемые результаты) и продолжение запуска: --resume и --only
+"""
+import threading
+
+import pandas as pd
+import pytest
+
+from checkpoints import DONE, FAILED, RunState
+from pipeline import Pipeline
+
+
+class Interval(object):
+    """
+    Объект в столбце DataFrame, который Parquet не сохраняет (как interval_item у schedules)
+    """
+
+    def __init__(self, hours):
+        self.hours = hours
+
+    def __eq__(self, other):
+        return isinstance(other, Interval) and other.hours == self.hours
+
+
+def counting(calls, name, result):
+    def func(results):
+        calls[name] = calls.get(name, 0) + 1
+        return result
+
+    return func
+
+
+def test_dataframe_to_parquet(tmp_path):
+    state = RunState(tmp_path)
+    df = pd.DataFrame({'id': pd.Series(['a', None], dtype='string'), 'n': pd.Series([1, None], dtype='Int64')})
+
+    state.save('transform:workbooks', df, 1.0)
+
+    assert (tmp_path / 'transform__workbooks.parquet').exists()
+    assert state.is_restorable('transform:workbooks')
+    pd.testing.assert_frame_equal(RunState(tmp_path).load('transform:workbooks'), df)
+
+
+def test_dataframe_with_objects_to_pickle(tmp_path):
+    state = RunState(tmp_path)
+    df = pd.DataFrame({'id': ['s1', 's2'], 'interval_item': [Interval(1), Interval(24)]})
+
+    state.save('transform:schedules', df, 1.0)
+
+    assert not (tmp_path / 'transform__schedules.parquet').exists()
+    assert (tmp_path / 'transform__schedules.pickle').exists()
+    pd.testing.assert_frame_equal(RunState(tmp_path).load('transform:schedules'), df)
+
+
+def test_other_results_to_pickle(tmp_path):
+    state = RunState(tmp_path)
+
+    state.save('download:workbooks', {'downloaded': 3, 'skipped': 1}, 1.0)
+
+    assert RunState(tmp_path).load('download:workbooks') == {'downloaded': 3, 'skipped': 1}
+
+
+def test_result_that_can_not_be_saved(tmp_path):
+    state = RunState(tmp_path)
+
+    state.save('extract:workbooks', threading.Lock(), 1.0)
+
+    restored = RunState(tmp_path)
+    assert restored.status('extract:workbooks') == DONE
+    assert not restored.is_restorable('extract:workbooks')
+    assert not list(tmp_path.glob('*.tmp'))
+
+
+def make_pipeline(tmp_path, calls, fail_load=False):
+    def load(results):
+        if fail_load:
+            raise RuntimeError('Vertica is down')
+        return counting(calls, 'load', 'loaded')(results)
+
+    pipeline = Pipeline(limits={'tableau': 1, 'cpu': 1, 'vertica': 1}, state=RunState(tmp_path))
+    # Результат extract (блокировка, как у несохраняемых объектов) на диск не попадает
+    pipeline.add('extract', counting(calls, 'extract', threading.Lock()))
+    pipeline.add('transform', counting(calls, 'transform', pd.DataFrame({'id': ['a', 'b']})),
+                 deps=['extract'], backend='cpu')
+    pipeline.add('load', load, deps=['transform'], backend='vertica')
+    pipeline.add('report', counting(calls, 'report', 'report'), deps=['load'], backend='cpu')
+    return pipeline
+
+
+def test_resume_skips_done_stages(tmp_path):
+    calls = {}
+    with pytest.raises(RuntimeError):
+        make_pipeline(tmp_path, calls, fail_load=True).run()
+    assert RunState(tmp_path).status('load') == FAILED
+
+    results = make_pipeline(tmp_path, calls).run(resume=True)
+
+    assert calls == {'extract': 1, 'transform': 1, 'load': 1, 'report': 1}
+    assert results['report'] == 'report'
+    assert RunState(tmp_path).status('load') == DONE
+
+
+def test_only_restores_dependencies(tmp_path):
+    calls = {}
+    make_pipeline(tmp_path, calls).run()
+
+    pipeline = make_pipeline(tmp_path, calls)
+    assert pipeline.plan(only=['load']) == (['load'], ['transform'])
+    results = pipeline.run(only=['load'])
+
+    assert calls == {'extract': 1, 'transform': 1, 'load': 2, 'report': 1}
+    pd.testing.assert_frame_equal(results['transform'], pd.DataFrame({'id': ['a', 'b']}))
+
+
+def test_only_runs_dependencies_that_are_not_saved(tmp_path):
+    calls = {}
+    make_pipeline(tmp_path, calls).run()
+
+    # Результата extract на диске нет: для transform он выполняется заново
+    to_run, restored = make_pipeline(tmp_path, calls).plan(only=['trans*'])
+    assert (to_run, restored) == (['extract', 'transform'], [])
+
+    # report зависит от load, который тоже выбран: из состояния берется только transform
+    assert make_pipeline(tmp_path, calls).plan(only=['load', 'report']) == (['load', 'report'], ['transform'])
+
+
+def test_new_run_resets_state(tmp_path):
+    calls = {}
+    make_pipeline(tmp_path, calls).run()
+
+    make_pipeline(tmp_path, calls).run()
+
+    assert calls == {'extract': 2, 'transform': 2, 'load': 2, 'report': 2}
+
+
+def test_only_needs_state(tmp_path):
+    pipeline = Pipeline()
+    pipeline.add('extract', lambda results: None)
+
+    with pytest.raises(ValueError, match='without state'):
+        pipeline.run(only=['extract'])
+    with pytest.raises(ValueError, match='No stages match'):
+        Pipeline(state=RunState(tmp_path)).plan(only=['load:*'])
@@ -0,0 +1,61 @@
+"""
+Отпечатки строк: ключи row_fingerprints совпадают с ключами, которые delete_keys строит в Vertica
+("col"::VARCHAR через |), а загрузки мимо load_changed удаляют сохраненные отпечатки
+"""
+import pandas as pd
+import pytest
+
+from vertica import utils
+from vertica.fingerprints import SCHEMA_KEY, diff_fingerprints, row_fingerprints
+from vertica.sinks import LocalSink
+
+
+@pytest.fixture
+def sink():
+    sink = LocalSink()
+    previous = utils.use_sink(sink)
+    yield sink
+    utils.use_sink(previous)
+
+
+def revisions(numbers, names):
+    return pd.DataFrame({'workbook_id'    : pd.Series(['w1'] * len(numbers), dtype='string'),
+                         'revision_number': pd.Series(numbers, dtype='Int64'),
+                         'name'           : pd.Series(names, dtype='string')})
+
+
+def test_row_key_matches_varchar_cast():
+    current = row_fingerprints(revisions([1, 12], ['a', None]), ['workbook_id', 'revision_number'])
+
+    # INT::VARCHAR в Vertica - без дробной части
+    assert current['row_key'].tolist() == ['w1|1', 'w1|12']
+
+
+def test_diff_fingerprints():
+    previous = row_fingerprints(revisions([1, 2, 3], ['a', 'b', 'c']), ['workbook_id', 'revision_number'])
+    stored = dict(zip(previous['row_key'], previous['row_hash']))
+    stored[SCHEMA_KEY] = 'schema'
+    current = row_fingerprints(revisions([1, 2, 4], ['a', 'changed', 'd']), ['workbook_id', 'revision_number'])
+
+    changed, removed = diff_fingerprints(current, stored)
+
+    assert changed.tolist() == [False, True, True]
+    assert removed == {'w1|3'}
+
+
+def test_delete_keys_sql(sink):
+    utils.delete_keys('tableau_workbooks_revisions', ['workbook_id', 'revision_number'], {"w1|3", "w'2|1"})
+
+    assert sink.statements == [
+        "DELETE FROM netology_temp.tableau_workbooks_revisions "
+        "WHERE \"workbook_id\"::VARCHAR || '|' || \"revision_number\"::VARCHAR IN ('w''2|1', 'w1|3');"]
+
+
+def test_merge_forgets_fingerprints(sink):
+    sink.table('netology_temp.tableau_fingerprints')
+    df = pd.DataFrame({'id': ['v1'], 'workbook_id': ['w1'], 'position': [1]})
+
+    utils.merge(df, table_name='views', delete_by='workbook_id', delete_ids=['w1'], copy_format='json')
+
+    assert sink.statements[-1] == \
+        "DELETE FROM netology_temp.tableau_fingerprints WHERE table_name = 'tableau_views'"
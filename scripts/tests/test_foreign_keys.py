@@ -0,0 +1,50 @@
+"""
+План FOREIGN KEY: по одному ALTER TABLE на столбец, имена ограничений не повторяются
+"""
+from vertica.utils import plan_foreign_keys
+
+
+class CatalogCursor(object):
+    """
+    Курсор, который отвечает на запросы plan_foreign_keys к каталогу: сначала столбцы, потом ограничения
+    """
+
+    def __init__(self, columns, constraints):
+        self.results = [columns, constraints]
+
+    def execute(self, sql):
+        pass
+
+    def fetchall(self):
+        return self.results.pop(0)
+
+
+def test_two_keys_to_same_table():
+    cursor = CatalogCursor(columns=[('tableau_projects', 'id'),
+                                    ('tableau_projects', 'parent_id'),
+                                    ('tableau_projects', 'root_project_id'),
+                                    ('tableau_projects', 'owner_id')],
+                           constraints=[])
+
+    plan = plan_foreign_keys(cursor, schema='s', table_prefix='tableau_')
+
+    assert plan == [
+        'ALTER TABLE s.tableau_projects ADD CONSTRAINT tableau_projects_parent_id_fk '
+        'FOREIGN KEY (parent_id) REFERENCES s.tableau_projects;',
+        'ALTER TABLE s.tableau_projects ADD CONSTRAINT tableau_projects_root_project_id_fk '
+        'FOREIGN KEY (root_project_id) REFERENCES s.tableau_projects;',
+        'ALTER TABLE s.tableau_projects ADD CONSTRAINT tableau_projects_owner_id_fk '
+        'FOREIGN KEY (owner_id) REFERENCES s.tableau_users;',
+    ]
+    names = [sql.split()[5] for sql in plan]
+    assert len(set(names)) == len(names)
+
+
+def test_existing_keys_are_skipped():
+    cursor = CatalogCursor(columns=[('tableau_projects', 'parent_id'), ('tableau_projects', 'root_project_id')],
+                           constraints=[('tableau_projects', 'parent_id', 's', 'tableau_projects')])
+
+    plan = plan_foreign_keys(cursor, schema='s', table_prefix='tableau_')
+
+    assert plan == ['ALTER TABLE s.tableau_projects ADD CONSTRAINT tableau_projects_root_project_id_fk '
+                    'FOREIGN KEY (root_project_id) REFERENCES s.tableau_projects;']
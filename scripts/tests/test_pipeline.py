@@ -0,0 +1,129 @@
+"""
+Планировщик шагов на шагах-заглушках: порядок зависимостей, ограничения backend, ошибки и критический путь
+"""
+import threading
+import time
+
+import pytest
+
+from pipeline import Pipeline
+
+
+def recorder(log, name, result=None, sleep=0.0):
+    def func(results):
+        log.append(('start', name))
+        time.sleep(sleep)
+        log.append(('finish', name))
+        return name if result is None else result
+
+    return func
+
+
+def test_dependencies_run_first():
+    log = []
+    pipeline = Pipeline(limits={'tableau': 4, 'cpu': 4})
+    # Зависимость объявлена раньше шага, на который она ссылается
+    pipeline.add('transform', lambda results: results['extract'] + '+transform', deps=['extract'], backend='cpu')
+    pipeline.add('extract', recorder(log, 'extract', sleep=0.05))
+    pipeline.add('load', lambda results: results['transform'] + '+load', deps=['transform'], backend='cpu')
+
+    results = pipeline.run()
+
+    assert results == {'extract': 'extract', 'transform': 'extract+transform', 'load': 'extract+transform+load'}
+
+
+def test_backend_limits():
+    lock = threading.Lock()
+    running = {'tableau': 0, 'cpu': 0}
+    peak = {'tableau': 0, 'cpu': 0}
+
+    def stage(backend):
+        def func(results):
+            with lock:
+                running[backend] += 1
+                peak[backend] = max(peak[backend], running[backend])
+            time.sleep(0.05)
+            with lock:
+                running[backend] -= 1
+
+        return func
+
+    pipeline = Pipeline(limits={'tableau': 2, 'cpu': 1})
+    for i in range(5):
+        pipeline.add('tableau:{}'.format(i), stage('tableau'))
+        pipeline.add('cpu:{}'.format(i), stage('cpu'), backend='cpu')
+
+    pipeline.run()
+
+    assert peak == {'tableau': 2, 'cpu': 1}
+
+
+def test_unknown_dependency():
+    pipeline = Pipeline()
+    pipeline.add('load', lambda results: None, deps=['transform'])
+
+    with pytest.raises(ValueError, match='unknown stages'):
+        pipeline.run()
+
+
+def test_dependency_cycle():
+    pipeline = Pipeline(limits={'tableau': 2})
+    pipeline.add('a', lambda results: None, deps=['b'])
+    pipeline.add('b', lambda results: None, deps=['a'])
+
+    with pytest.raises(RuntimeError, match='dependency cycle'):
+        pipeline.run()
+
+
+def test_duplicate_stage():
+    pipeline = Pipeline()
+    pipeline.add('a', lambda results: None)
+
+    with pytest.raises(ValueError, match='already exists'):
+        pipeline.add('a', lambda results: None)
+
+
+def test_failure_stops_dependents():
+    log = []
+
+    def fail(results):
+        time.sleep(0.01)
+        raise KeyError('broken')
+
+    pipeline = Pipeline(limits={'tableau': 2, 'cpu': 1})
+    pipeline.add('extract', fail)
+    pipeline.add('slow', recorder(log, 'slow', sleep=0.1))
+    pipeline.add('transform', recorder(log, 'transform'), deps=['extract'], backend='cpu')
+    pipeline.add('after_slow', recorder(log, 'after_slow'), deps=['slow'], backend='cpu')
+
+    with pytest.raises(KeyError, match='broken'):
+        pipeline.run()
+
+    # Уже запущенный шаг дорабатывает, новые шаги после ошибки не запускаются
+    assert log == [('start', 'slow'), ('finish', 'slow')]
+    assert 'extract' not in pipeline.results
+
+
+def test_critical_path():
+    pipeline = Pipeline(limits={'tableau': 2, 'cpu': 2})
+    pipeline.add('extract:a', lambda results: time.sleep(0.02))
+    pipeline.add('extract:b', lambda results: time.sleep(0.15))
+    pipeline.add('transform:a', lambda results: time.sleep(0.02), deps=['extract:a'], backend='cpu')
+    pipeline.add('load', lambda results: time.sleep(0.02), deps=['transform:a', 'extract:b'], backend='cpu')
+
+    pipeline.run()
+    path, length = pipeline.critical_path()
+
+    assert path == ['extract:b', 'load']
+    assert length == pytest.approx(pipeline.stages['extract:b'].duration + pipeline.stages['load'].duration)
+
+
+def test_keep():
+    pipeline = Pipeline()
+    pipeline.add('extract', lambda results: None)
+    pipeline.add('transform', lambda results: None, deps=['extract'])
+    pipeline.add('other', lambda results: None)
+
+    pipeline.keep(['transform'])
+
+    assert list(pipeline.stages) == ['extract', 'transform']
@@ -0,0 +1,101 @@
+"""
+Разбиение на части по crc32 и проверка частей перед сборкой (--merge-shards)
+"""
+import json
+from collections import namedtuple
+
+import pandas as pd
+import pytest
+
+from checkpoints import RunState
+from shards import SHARD_INFO_FILE, Shard, check_shards, merge_shard_results
+
+Item = namedtuple('Item', ['id', 'project_id'])
+
+FLAGS = {'incremental': True, 'revisions_only_new': False, 'views_bulk': False,
+         'watermarks': {'workbooks': '2026-10-17T00:00:00Z', 'datasources': '2026-10-17T00:00:00Z'}}
+
+
+@pytest.fixture
+def items():
+    return [Item('wb-{}'.format(i), 'project-{}'.format(i % 7)) for i in range(1000)] + [Item(None, None)]
+
+
+@pytest.mark.parametrize('by', ['id', 'project'])
+@pytest.mark.parametrize('count', [1, 3, 8])
+def test_shards_partition_items(items, count, by):
+    parts = [Shard(index, count, by).select(items) for index in range(count)]
+
+    # Каждая сущность ровно в одной части
+    assert sorted(map(id, (i for part in parts for i in part))) == sorted(map(id, items))
+    if by == 'id':
+        assert all(parts)
+
+
+def test_project_in_one_shard(items):
+    shards = [Shard(index, 4, 'project') for index in range(4)]
+
+    for project_id in {i.project_id for i in items}:
+        owners = {s.index for s in shards for i in items if i.project_id == project_id and s.owns(i)}
+        assert len(owners) == 1
+
+
+def test_shard_is_stable():
+    # crc32, а не hash(): в другом процессе с другим PYTHONHASHSEED часть та же
+    assert [Shard(index, 4).owns(Item('wb-1', None)) for index in range(4)] == [False, False, True, False]
+    assert Shard(2, 4, 'project').owns(Item('other', 'wb-1'))
+
+
+@pytest.mark.parametrize('spec', ['4/4', '-1/4', '0/0', '1', 'a/b'])
+def test_parse_rejects_bad_shards(spec):
+    with pytest.raises(ValueError):
+        Shard.parse(spec)
+
+
+def test_merge_finished_shards(tmp_path):
+    state_path = tmp_path / 'pipeline'
+    for index in range(2):
+        shard = Shard(index, 2)
+        RunState(shard.state_path(state_path)).save('populate:connections', pd.DataFrame({'id': [str(index)]}), 1.0)
+        shard.save_info('2026-10-18', FLAGS, state_path)
+
+    check_shards(2, 'id', '2026-10-18', FLAGS, state_path)
+    assert merge_shard_results('populate:connections', 2, state_path)['id'].tolist() == ['0', '1']
+
+
+def test_missing_shard_is_rejected(tmp_path):
+    state_path = tmp_path / 'pipeline'
+    Shard(0, 3).save_info('2026-10-18', FLAGS, state_path)
+
+    with pytest.raises(RuntimeError) as e:
+        check_shards(3, 'id', '2026-10-18', FLAGS, state_path)
+
+    assert 'shard 1/3 by id: no finished run' in str(e.value)
+    assert 'shard 2/3 by id: no finished run' in str(e.value)
+
+
+def test_stale_or_mismatched_shards_are_rejected(tmp_path):
+    state_path = tmp_path / 'pipeline'
+    # Часть прошлого цикла, часть с другим флагом и часть с другим ключом разбиения
+    Shard(0, 3).save_info('2026-10-17', FLAGS, state_path)
+    Shard(1, 3).save_info('2026-10-18', dict(FLAGS, revisions_only_new=True), state_path)
+    Shard(2, 3, 'project').save_info('2026-10-18', FLAGS, state_path)
+    # У части по project состояние в той же папке, что у части по id
+    info_file = Shard(2, 3).state_path(state_path) / SHARD_INFO_FILE
+
+    with pytest.raises(RuntimeError) as e:
+        check_shards(3, 'id', '2026-10-18', FLAGS, state_path)
+
+    message = str(e.value)
+    assert "shard 0/3 by id: cycle_id is '2026-10-17', expected '2026-10-18'" in message
+    assert 'shard 1/3 by id: flags is' in message
+    assert "shard 2/3 by id: by is 'project', expected 'id'" in message
+    assert json.loads(info_file.read_text())['by'] == 'project'
+
+
+def test_shard_without_result_is_rejected(tmp_path):
+    state_path = tmp_path / 'pipeline'
+    RunState(Shard(0, 2).state_path(state_path)).save('populate:connections', pd.DataFrame({'id': ['0']}), 1.0)
+
+    with pytest.raises(RuntimeError, match='Shard 1/2 has no result of stage populate:connections'):
+        merge_shard_results('populate:connections', 2, state_path)
@@ -0,0 +1,58 @@
+"""
+Поток COPY в формате delimited (iter_df_as_delimited) разбирается так же, как его разберет Vertica (DelimitedParser)
+"""
+import pandas as pd
+import pytest
+
+from vertica.sinks import DelimitedParser
+from vertica.table_importer import DELIMITER, TableImporter, iter_df_as_delimited
+
+COLUMN_TYPES = {'id': 'UUID', 'name': 'VARCHAR(255)', 'has_extracts': 'BOOLEAN', 'size': 'INT',
+                'updated_at': 'TIMESTAMPTZ'}
+
+
+def parse(df: pd.DataFrame, step: int = 2):
+    parser = DelimitedParser(DELIMITER, list(df.columns))
+    records = []
+    for chunk in iter_df_as_delimited(df, COLUMN_TYPES, step):
+        records.extend(parser.feed(chunk.encode('utf-8')))
+    parser.close()
+    return records
+
+
+def test_delimited_round_trip():
+    df = pd.DataFrame({
+        'id'          : ['a', 'b', 'c', 'd', 'e'],
+        'name'        : ['plain', 'pipe | and \\ slash', 'line\nbreak\r', None, 'юникод'],
+        'has_extracts': [True, False, 'true', 'false', None],
+        'size'        : [1, None, 3, 4, 5],
+        'updated_at'  : ['2020-01-02T03:04:05Z', None, '2020-01-02T03:04:05+03:00', None, None],
+    })
+
+    assert parse(df) == [
+        ['a', 'plain', 't', '1', '2020-01-02 03:04:05'],
+        ['b', 'pipe | and \\ slash', 'f', None, None],
+        ['c', 'line\nbreak\r', 't', '3', '2020-01-02 00:04:05'],
+        ['d', None, 'f', '4', None],
+        ['e', 'юникод', None, '5', None],
+    ]
+
+
+def test_delimited_unknown_boolean_is_kept_as_text():
+    df = pd.DataFrame({'id': ['a', 'b'], 'has_extracts': ['yes', True]})
+
+    assert parse(df) == [['a', 'yes'], ['b', 't']]
+
+
+def test_delimited_column_not_in_ddl():
+    df = pd.DataFrame({'id': ['a'], 'extra': [1]})
+
+    with pytest.raises(ValueError, match='extra'):
+        iter_df_as_delimited(df, COLUMN_TYPES, 10)
+
+
+def test_step_argument_overrides_environment(monkeypatch):
+    monkeypatch.setenv('step', '500')
+
+    assert TableImporter(['id'], table_name='tableau_views').step == 500
+    assert TableImporter(['id'], table_name='tableau_views', step=10).step == 10
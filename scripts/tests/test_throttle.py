@@ -0,0 +1,134 @@
+"""
+Ограничение частоты, AIMD и повторы RequestGovernor, в том числе на локальной замене сервера
+(bench.tableau_stub) со сбоями (error_rate) и истекающими токенами (token_ttl)
+"""
+import random
+import time
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from bench.tableau_stub import StubServer, SyntheticSite
+from tableau.session import TableauSession
+from tableau.throttle import AdaptiveConcurrency, RequestGovernor, TokenBucket
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**kwargs) -> StubServer:
+        server = StubServer(SyntheticSite(workbooks=20, projects=30, users=10, groups=2, datasources=5,
+                                          subscriptions=2, schedules=2), **kwargs)
+        server.start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def session_for(server: StubServer) -> TableauSession:
+    session = TableauSession(server_url=server.url, token_name='test', token_value='test', site='')
+    assert session.server.is_signed_in()
+    session.governor.backoff = 0.01
+    return session
+
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(rate=50, burst=5)
+
+    started_at = time.monotonic()
+    waits = [bucket.acquire() for _ in range(15)]
+    elapsed = time.monotonic() - started_at
+
+    assert waits[:5] == [0.0] * 5
+    # 10 запросов сверх burst при 50 в секунду
+    assert 0.18 <= elapsed < 0.5
+
+
+def test_token_bucket_unlimited():
+    assert TokenBucket(rate=0).acquire() == 0.0
+
+
+def test_adaptive_concurrency_aimd():
+    concurrency = AdaptiveConcurrency(initial=4, maximum=8)
+
+    for _ in range(4):
+        concurrency.acquire()
+        concurrency.release(200, time.monotonic())
+    assert concurrency.limit == pytest.approx(5, abs=0.1)
+
+    sent_before = time.monotonic()
+    concurrency.acquire()
+    concurrency.acquire()
+    concurrency.release(429, sent_before)
+    limit = concurrency.limit
+    assert limit == pytest.approx(2.5, abs=0.1)
+
+    # Ответ той же волны перегрузки предел второй раз не уменьшает
+    concurrency.release(503, sent_before)
+    assert concurrency.limit == limit
+    assert concurrency.in_flight == 0
+
+
+def test_retries_injected_errors(stub):
+    random.seed(0)
+    server = stub(error_rate=0.3)
+    session = session_for(server)
+
+    for _ in range(20):
+        projects, pagination = session.endpoint('projects').get()
+        assert len(projects) == pagination.total_available == 30
+
+    errors = sum(n for route, n in server.stats()['requests'].items() if route.startswith('error:'))
+    assert errors > 0
+    # Перегрузка уменьшает предел одновременных запросов
+    assert session.governor.concurrency.limit < session.governor.concurrency.maximum
+
+
+def test_sign_in_again_after_token_expired(stub):
+    server = stub(token_ttl=0.3)
+    session = session_for(server)
+    first_token = session.server.auth_token
+
+    time.sleep(0.4)
+    projects, _ = session.endpoint('projects').get()
+
+    assert len(projects) == 30
+    assert session.server.auth_token != first_token
+    assert server.stats()['requests']['signin'] == 2
+
+
+class SequenceAdapter(HTTPAdapter):
+    """
+    Отвечает статусами statuses по очереди
+    """
+
+    def __init__(self, statuses, headers=None):
+        super(SequenceAdapter, self).__init__()
+        self.statuses = list(statuses)
+        self.headers = headers or {}
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.status_code = self.statuses.pop(0)
+        response.headers.update(self.headers)
+        response._content = b''
+        response.request = request
+        return response
+
+
+def test_retry_after_is_capped():
+    governor = RequestGovernor(bucket=TokenBucket(), inner=SequenceAdapter([429, 200], {'Retry-After': '3600'}),
+                               max_backoff=0.05)
+    request = requests.Request('GET', 'http://tableau/api/3.7/sites/s/projects').prepare()
+
+    started_at = time.monotonic()
+    response = governor.send(request)
+
+    assert response.status_code == 200
+    assert time.monotonic() - started_at < 1
@@ -3,7 +3,10 @@ import os
 
 
 class Config:
-    def __init__(self):
+    # rows per chunk streamed to COPY
+    default_step = 250000
+
+    def __init__(self, table_name=None, step=None):
         self.vertica_host = os.getenv("VERTICA_HOST")
         self.vertica_port = os.getenv("VERTICA_PORT")
         self.vertica_user = os.getenv("VERTICA_USER_W")
@@ -11,7 +14,8 @@ class Config:
         self.vertica_database = "DWH"
         self.vertica_schema_staging = "netology_staging"
         self.vertica_schema = "netology_temp"
-        self.vertica_configs = json.loads(os.getenv("VERTICA_CONFIGS"))
+        # VERTICA_CONFIGS needed only to connect: importers writing to another sink work without it
+        self.vertica_configs = json.loads(os.getenv("VERTICA_CONFIGS", "{}"))
 
         # config for table converter
         self.sql_credentials = {
@@ -24,19 +28,21 @@ class Config:
                 "password"    : self.vertica_password,
                 "connect_args": {
                     "connection_load_balance": True,
-                    "backup_server_node"     : self.vertica_configs["backup_server_node"],
+                    "backup_server_node"     : self.vertica_configs.get("backup_server_node", []),
                 },
             },
         }
-        self.table_name = os.getenv("table_name")
+        # table_name is passed explicitly by loads running in parallel threads: the environment is process-wide
+        self.table_name = table_name or os.getenv("table_name")
         if self.table_name is None:
             raise Exception(
                 "Error. You must to add at least a name of the table_name  in dags/config/config.json"
             )
+        # step is passed explicitly to vary the chunk size per load, the environment sets it for the whole run
         try:
-            self.step = int(os.getenv("step"))
+            self.step = step or int(os.getenv("step"))
         except TypeError:
-            self.step = 250000
+            self.step = self.default_step
         self.json_columns = os.getenv("json_column")
         if self.json_columns is not None:
             self.json_columns = self.json_columns.split(',')
@@ -0,0 +1,56 @@
+"""
+Отпечатки содержимого таблиц: хеш каждой строки по ключу, чтобы загружать в Vertica только изменившиеся строки
+"""
+import hashlib
+from pathlib import Path
+from typing import Collection, Dict, Set, Tuple
+
+import pandas as pd
+
+from .table_importer import DDL_PATH
+
+# Служебный ключ: хеш списка столбцов и DDL таблицы. Если он изменился, таблица перезагружается целиком
+SCHEMA_KEY = '__schema__'
+KEY_SEPARATOR = '|'
+
+
+def schema_hash(df: pd.DataFrame, schema: str, table: str, ddl_path: Path = DDL_PATH) -> str:
+    """
+    Хеш столбцов df и текста DDL таблицы из db/vertica
+    """
+    ddl_file = Path(ddl_path) / schema / '{}.sql'.format(table)
+    ddl = ddl_file.read_text() if ddl_file.exists() else ''
+    return hashlib.md5('{}\n{}'.format(','.join(df.columns), ddl).encode('utf-8')).hexdigest()[:16]
+
+
+def row_fingerprints(df: pd.DataFrame, key_columns: Collection[str]) -> pd.DataFrame:
+    """
+    DataFrame со столбцами row_key (значения key_columns через |), row_hash (16 hex-символов)
+    и row_bytes (примерный размер строки в COPY) для каждой строки df.
+    Хеш считается векторно по текстовому представлению строки, поэтому не зависит от типов pandas
+    """
+    text = df.astype('string')
+    key_columns = list(key_columns)
+    keys = text[key_columns[0]].fillna('')
+    if len(key_columns) > 1:
+        keys = keys.str.cat(text[key_columns[1:]].fillna(''), sep=KEY_SEPARATOR)
+
+    hashes = pd.util.hash_pandas_object(text, index=False, categorize=False)
+    row_bytes = sum(text[c].str.len().fillna(0) for c in text.columns) + len(text.columns)
+
+    return pd.DataFrame({
+        'row_key'  : keys.astype(object).to_numpy(),
+        'row_hash' : ['{:016x}'.format(h) for h in hashes.to_numpy()],
+        'row_bytes': row_bytes.astype('int64').to_numpy(),
+    })
+
+
+def diff_fingerprints(current: pd.DataFrame, stored: Dict[str, str]) -> Tuple[pd.Series, Set[str]]:
+    """
+    Сравнивает отпечатки строк current (row_fingerprints) с сохраненными {row_key: row_hash}
+
+    :return: маска новых и измененных строк current, ключи строк, которых больше нет
+    """
+    changed = current['row_hash'] != current['row_key'].map(stored)
+    removed = set(stored) - set(current['row_key']) - {SCHEMA_KEY}
+    return changed, removed
@@ -0,0 +1,113 @@
+"""
+Пул соединений с Vertica на весь запуск ETL
+"""
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+from vconnector.vertica_connector import VerticaConnector
+
+from .sinks import LoadSink
+
+
+class ConnectionPool(LoadSink):
+    """
+    Держит до size открытых VerticaConnector и выдает их по очереди.
+    Перед выдачей соединение проверяется запросом SELECT 1 и при необходимости переоткрывается.
+    Потокобезопасен: таблицы можно грузить параллельно
+    """
+
+    def __init__(self, factory: Callable[[], VerticaConnector], size: int = 4, timeout: float = 600):
+        """
+        :param factory: создает новый (еще не открытый) VerticaConnector
+        :param size: максимальное число открытых соединений
+        :param timeout: сколько секунд ждать свободное соединение
+        """
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self) -> Iterator[VerticaConnector]:
+        """
+        Выдает открытый VerticaConnector на время блока with.
+        Незакоммиченная транзакция откатывается при возврате, как при закрытии соединения: на autocommit
+        коннектора полагаться нельзя, код, который меняет данные (DELETE, INSERT, MERGE), вызывает cnx.commit() сам
+        """
+        connector = self._acquire()
+        try:
+            yield connector
+        finally:
+            self._release(connector)
+
+    def close(self) -> None:
+        """
+        Закрывает все свободные соединения
+        """
+        while True:
+            try:
+                connector = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close(connector)
+
+    def _acquire(self) -> VerticaConnector:
+        try:
+            connector = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self.size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                return self._open()
+            connector = self._idle.get(timeout=self.timeout)
+
+        if self._is_healthy(connector):
+            return connector
+
+        logging.info('Vertica connection is broken, reconnecting')
+        self._close(connector)
+        with self._lock:
+            self._opened += 1
+        return self._open()
+
+    def _release(self, connector: VerticaConnector) -> None:
+        try:
+            connector.cnx.rollback()
+        except Exception:
+            self._close(connector)
+            return
+        self._idle.put(connector)
+
+    def _open(self) -> VerticaConnector:
+        try:
+            return self.factory().__enter__()
+        except Exception:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    def _close(self, connector: VerticaConnector) -> None:
+        with self._lock:
+            self._opened -= 1
+        try:
+            connector.__exit__(None, None, None)
+        except Exception as e:
+            logging.warning('Error while closing Vertica connection: {}'.format(e))
+
+    @staticmethod
+    def _is_healthy(connector: VerticaConnector) -> bool:
+        try:
+            cursor = connector.cnx.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
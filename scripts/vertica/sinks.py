@@ -0,0 +1,306 @@
+"""
+Приемники загрузок (LoadSink): куда vertica.utils и TableImporter отправляют SQL и потоки COPY.
+
+Приемник выдает соединения с интерфейсом VerticaConnector (cnx.cursor() с execute/copy/fetchall,
+create_staging_table, reload_main_table, exec_multiple_sql). Основной приемник - пул соединений
+с Vertica (vertica.pool.ConnectionPool), LocalSink - локальная замена без базы для бенчмарков:
+принимает те же потоки COPY, разбирает их тем же форматом (FJSONPARSER или DELIMITER) и считает
+строки и байты
+"""
+import codecs
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# COPY <table> [(<columns>)] FROM STDIN ... [DELIMITER '<d>']
+COPY_PATTERN = re.compile(r"^\s*COPY\s+(?P<table>[\w.]+)\s*(?:\((?P<columns>[^)]*)\))?\s+FROM\s+STDIN"
+                          r"(?P<options>.*)$", re.IGNORECASE | re.DOTALL)
+DELIMITER_PATTERN = re.compile(r"DELIMITER\s+'(?P<delimiter>[^']+)'", re.IGNORECASE)
+COUNT_PATTERN = re.compile(r"^\s*SELECT\s+COUNT\(\*\).*\bFROM\s+(?P<table>[\w.]+)", re.IGNORECASE | re.DOTALL)
+DROP_PATTERN = re.compile(r"^\s*DROP\s+TABLE\s+(?:IF\s+EXISTS\s+)?(?P<table>[\w.]+)", re.IGNORECASE)
+DML_PATTERN = re.compile(r"^\s*(?:DELETE|INSERT|MERGE|UPDATE)\b", re.IGNORECASE)
+
+# Запись длиннее этого без разделителя записей - ошибка разбора, а не незаконченная порция
+MAX_RECORD_SIZE = 32 * 2 ** 20
+
+
+class CopyParseError(ValueError):
+    """
+    Поток COPY не разбирается форматом из COPY или не совпадает со списком столбцов
+    """
+
+
+class UncommittedError(RuntimeError):
+    """
+    Соединение вернулось в приемник с незакоммиченными изменениями: пул соединений их откатил бы
+    """
+
+
+class LoadSink(object):
+    """
+    Интерфейс приемника загрузок
+    """
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """
+        Соединение с интерфейсом VerticaConnector на время блока with
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class LocalTable(object):
+    __slots__ = ('columns', 'rows', 'bytes', 'records')
+
+    def __init__(self, columns: Optional[List[str]] = None):
+        self.columns = columns
+        self.rows = 0
+        self.bytes = 0
+        self.records: List[Any] = []
+
+
+class LocalSink(LoadSink):
+    """
+    Приемник в памяти. Таблицы - {schema.table: LocalTable}, SQL кроме COPY только записывается в statements.
+    parse=False - поток только вычитывается (байты без разбора), keep_records=True - разобранные строки сохраняются
+    """
+
+    def __init__(self, parse: bool = True, keep_records: bool = False):
+        self.parse = parse
+        self.keep_records = keep_records
+        self.tables: Dict[str, LocalTable] = {}
+        self.statements: List[str] = []
+        self.stats = {'copies': 0, 'rows': 0, 'bytes': 0, 'parse_s': 0.0}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self) -> Iterator['LocalConnector']:
+        """
+        Соединение, как из пула: DELETE, INSERT, MERGE и UPDATE без cnx.commit() - ошибка UncommittedError
+        """
+        connector = LocalConnector(self)
+        yield connector
+        if connector.cnx.pending:
+            raise UncommittedError('Uncommitted statements would be rolled back: {}'.format(
+                [sql[:100] for sql in connector.cnx.pending]))
+
+    def reset(self) -> None:
+        with self._lock:
+            self.tables = {}
+            self.statements = []
+            self.stats = {'copies': 0, 'rows': 0, 'bytes': 0, 'parse_s': 0.0}
+
+    def table(self, name: str) -> LocalTable:
+        return self.tables.setdefault(name.lower(), LocalTable())
+
+    def execute(self, sql: str) -> List[Tuple]:
+        """
+        Записывает SQL и возвращает строки результата для тех запросов, которые нужны загрузкам
+        """
+        with self._lock:
+            self.statements.append(sql)
+            count = COUNT_PATTERN.match(sql)
+            if count:
+                table = self.tables.get(count.group('table').lower())
+                return [(table.rows if table else 0,)]
+            if re.search(r'\bFROM\s+all_tables\b', sql, re.IGNORECASE):
+                return [(name.split('.', 1)[-1],) for name in self.tables]
+            drop = DROP_PATTERN.match(sql)
+            if drop:
+                self.tables.pop(drop.group('table').lower(), None)
+        return []
+
+    def copy(self, sql: str, stream: Any, buffer_size: int) -> int:
+        """
+        Вычитывает поток COPY порциями buffer_size, как клиент Vertica, и разбирает строки. Возвращает число строк
+        """
+        match = COPY_PATTERN.match(sql)
+        if not match:
+            raise CopyParseError('Not a COPY FROM STDIN statement: {}'.format(sql))
+        columns = [c.strip().strip('"') for c in match.group('columns').split(',')] \
+            if match.group('columns') else None
+        delimiter = DELIMITER_PATTERN.search(match.group('options'))
+        parser = (DelimitedParser(delimiter.group('delimiter'), columns) if delimiter else JsonParser(columns)) \
+            if self.parse else None
+
+        rows, size, parse_s = 0, 0, 0.0
+        records = []
+        while True:
+            data = stream.read(buffer_size)
+            if not data:
+                break
+            size += len(data)
+            if parser is not None:
+                started_at = time.perf_counter()
+                parsed = parser.feed(data)
+                parse_s += time.perf_counter() - started_at
+                rows += len(parsed)
+                if self.keep_records:
+                    records.extend(parsed)
+        if parser is not None:
+            parser.close()
+
+        with self._lock:
+            table = self.table(match.group('table'))
+            table.columns = table.columns or columns
+            table.rows += rows
+            table.bytes += size
+            table.records.extend(records)
+            self.stats['copies'] += 1
+            self.stats['rows'] += rows
+            self.stats['bytes'] += size
+            self.stats['parse_s'] += parse_s
+        return rows
+
+
+class LocalCursor(object):
+    def __init__(self, sink: LocalSink, connection: Optional['LocalConnection'] = None):
+        self.sink = sink
+        self.connection = connection
+        self._result: List[Tuple] = []
+
+    def execute(self, sql: str) -> None:
+        self._result = self.sink.execute(sql)
+        if self.connection is not None and DML_PATTERN.match(sql):
+            self.connection.pending.append(sql)
+
+    def copy(self, sql: str, data: Any, buffer_size: int = 128 * 2 ** 10) -> None:
+        self.sink.copy(sql, data, buffer_size)
+
+    def fetchall(self) -> List[Tuple]:
+        result, self._result = self._result, []
+        return result
+
+    def fetchone(self) -> Optional[Tuple]:
+        return self._result.pop(0) if self._result else None
+
+    def close(self) -> None:
+        pass
+
+
+class LocalConnection(object):
+    def __init__(self, sink: LocalSink):
+        self.sink = sink
+        # Изменения после последнего commit
+        self.pending: List[str] = []
+
+    def cursor(self, cursor_type: Optional[str] = None) -> LocalCursor:
+        return LocalCursor(self.sink, self)
+
+    def commit(self) -> None:
+        self.pending = []
+
+    def rollback(self) -> None:
+        self.pending = []
+
+
+class LocalConnector(object):
+    """
+    Соединение LocalSink с методами VerticaConnector, которые используют загрузки
+    """
+
+    def __init__(self, sink: LocalSink):
+        self.sink = sink
+        self.cnx = LocalConnection(sink)
+
+    def create_staging_table(self, table_name: str, schema: str, staging_schema: str, ddl_path: str) -> None:
+        with self.sink._lock:
+            self.sink.statements.append('-- create {}.{} like {}.{}'.format(staging_schema, table_name, schema,
+                                                                             table_name))
+            self.sink.tables['{}.{}'.format(staging_schema, table_name).lower()] = LocalTable()
+
+    def reload_main_table(self, table_name: str, schema: str, staging_schema: str) -> None:
+        with self.sink._lock:
+            self.sink.statements.append('-- replace {}.{} with {}.{}'.format(schema, table_name, staging_schema,
+                                                                              table_name))
+            staging = self.sink.tables.pop('{}.{}'.format(staging_schema, table_name).lower(), LocalTable())
+            self.sink.tables['{}.{}'.format(schema, table_name).lower()] = staging
+
+    def exec_multiple_sql(self, sqls: List[str]) -> None:
+        for sql in sqls:
+            self.sink.execute(sql)
+
+
+class JsonParser(object):
+    """
+    Потоковый разбор FJSONPARSER: JSON-объект на строку
+    """
+
+    def __init__(self, columns: Optional[List[str]] = None):
+        self.columns = set(columns) if columns else None
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._pending = ''
+
+    def feed(self, data: bytes) -> List[Dict[str, Any]]:
+        text = self._pending + self._decoder.decode(data)
+        end = text.rfind('\n')
+        if end < 0:
+            self._pending = text
+            return []
+        self._pending = text[end + 1:]
+        records = [json.loads(line) for line in text[:end].split('\n') if line]
+        for record in records:
+            if not isinstance(record, dict):
+                raise CopyParseError('JSON record is not an object: {!r}'.format(record))
+            if self.columns is not None and not self.columns.issuperset(record):
+                raise CopyParseError('Unknown columns {}'.format(sorted(set(record) - self.columns)))
+        return records
+
+    def close(self) -> None:
+        rest = self._pending + self._decoder.decode(b'', final=True)
+        if rest.strip():
+            raise CopyParseError('Unterminated JSON record at the end of stream: {!r}'.format(rest[:100]))
+
+
+class DelimitedParser(object):
+    """
+    Потоковый разбор нативного delimited парсера: поля через delimiter, записи через \\n,
+    обратный слеш экранирует следующий символ, пустое поле - NULL
+    """
+
+    def __init__(self, delimiter: str, columns: Optional[List[str]] = None):
+        self.delimiter = delimiter
+        self.width = len(columns) if columns else None
+        d = re.escape(delimiter)
+        self._field = re.compile(r'((?:[^\\\n{0}]|\\.)*)({0}|\n)'.format(d), re.DOTALL)
+        self._unescape = re.compile(r'\\(.)', re.DOTALL)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._pending = ''
+
+    def feed(self, data: bytes) -> List[List[Optional[str]]]:
+        text = self._pending + self._decoder.decode(data)
+        records, fields = [], []
+        position = consumed = 0
+        # Поля разбираются подряд с начала: поиск с произвольной позиции принял бы экранированный разделитель
+        # за пустое поле. Незаконченное поле в конце порции дочитывается со следующей
+        while True:
+            match = self._field.match(text, position)
+            if match is None:
+                break
+            position = match.end()
+            value = match.group(1)
+            if '\\' in value:
+                value = self._unescape.sub(r'\1', value)
+            fields.append(value if value != '' else None)
+            if match.group(2) == '\n':
+                if self.width is not None and len(fields) != self.width:
+                    raise CopyParseError('Record has {} fields, expected {}: {!r}'.format(
+                        len(fields), self.width, fields[:5]))
+                records.append(fields)
+                fields = []
+                consumed = position
+        if len(text) - consumed > MAX_RECORD_SIZE:
+            raise CopyParseError('Unparsable delimited data: {!r}'.format(text[consumed:consumed + 100]))
+        self._pending = text[consumed:]
+        return records
+
+    def close(self) -> None:
+        rest = self._pending + self._decoder.decode(b'', final=True)
+        if rest:
+            raise CopyParseError('Unterminated delimited record at the end of stream: {!r}'.format(rest[:100]))
@@ -1,19 +1,26 @@
 import csv
-import gc
 import io
 import json
 import logging
-import warnings
+import re
 from pathlib import Path
 
-from converter.database_worker import DataBaseWorker
+import pandas as pd
+
 from vconnector.vertica_connector import VerticaConnector
 
+from metrics import metrics
+
 from .config_files.config_netology import Config
 
-warnings.filterwarnings("ignore")
+COPY_BUFFER_SIZE = 1024 * 1024
+DDL_PATH = Path.cwd().parent / 'db' / 'vertica'
 
-logging.captureWarnings(True)
+# json - FJSONPARSER, delimited - native delimited parser with column types from ddl
+COPY_FORMATS = ("json", "delimited")
+DELIMITER = "|"
+# BOOLEAN values: python and numpy bools, 1/0 and the strings tableauserverclient keeps for some flags
+BOOL_VALUES = {True: "t", False: "f", "true": "t", "false": "f", "True": "t", "False": "f", "t": "t", "f": "f"}
 
 
 def myconverter(o):
@@ -40,62 +47,227 @@ def write_list_as_csv_str(fields, rows):
     return output.getvalue()
 
 
+def iter_df_as_json(df, step):
+    """encode DataFrame as newline-delimited json records, step rows at a time"""
+    for start in range(0, len(df), step):
+        chunk = df.iloc[start:start + step].to_json(
+            orient="records", lines=True, date_unit="s", date_format="iso"
+        )
+        yield chunk if chunk.endswith("\n") else chunk + "\n"
+
+
+def read_ddl_columns(schema, table_name, ddl_path=DDL_PATH):
+    """column names and types from db/vertica/<schema>/<table_name>.sql"""
+    with open(Path(ddl_path) / schema / "{}.sql".format(table_name)) as f:
+        ddl = f.read()
+    body = ddl[ddl.index("(") + 1:]
+    columns = {}
+    for line in body.splitlines():
+        match = re.match(r"\s*(\w+)\s+([A-Za-z]+(?:\(\d+\))?)", line)
+        if match and match.group(1).upper() != "CONSTRAINT":
+            columns[match.group(1)] = match.group(2).upper()
+    return columns
+
+
+def escape_delimited(series):
+    """escape backslash, delimiter and record terminators for the native delimited parser"""
+    for char in ("\\", DELIMITER, "\n", "\r"):
+        series = series.str.replace(char, "\\" + char, regex=False)
+    return series
+
+
+def format_column(series, data_type):
+    """typed text representation of one column, NULL as empty string"""
+    mask = series.isna()
+    if data_type.startswith("TIMESTAMP"):
+        text = pd.to_datetime(series, utc=True).dt.strftime("%Y-%m-%d %H:%M:%S")
+    elif data_type == "BOOLEAN":
+        # anything else is passed as text for Vertica to reject, not turned into NaN
+        text = escape_delimited(series.map(lambda x: BOOL_VALUES.get(x, x)).map(myconverter))
+    elif data_type.startswith("INT"):
+        text = pd.to_numeric(series).astype("Int64").astype(str)
+    elif data_type.startswith("VARBINARY"):
+        text = escape_delimited(series.map(lambda x: json.dumps(sorted(x), default=myconverter)
+                                           if isinstance(x, (set, list, tuple)) else myconverter(x)))
+    else:
+        text = escape_delimited(series.map(myconverter))
+    return text.where(~mask, "").fillna("")
+
+
+def iter_df_as_delimited(df, column_types, step):
+    """encode DataFrame as delimited rows typed by ddl column_types, step rows at a time"""
+    missing = [c for c in df.columns if c not in column_types]
+    if missing:
+        raise ValueError("Columns {} are not in the table ddl, known columns: {}".format(
+            missing, list(column_types)))
+    return _iter_delimited_chunks(df, column_types, step)
+
+
+def _iter_delimited_chunks(df, column_types, step):
+    for start in range(0, len(df), step):
+        chunk = df.iloc[start:start + step]
+        columns = [format_column(chunk[c], column_types[c]) for c in df.columns]
+        rows = columns[0].str.cat(columns[1:], sep=DELIMITER) if len(columns) > 1 else columns[0]
+        yield "\n".join(rows) + "\n"
+
+
+class IterStream:
+    """
+    file-like object over an iterator of str chunks for cursor.copy:
+    only one encoded chunk is held in memory at a time
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b""
+        self.offset = 0
+        self.bytes = 0
+
+    def read(self, size=-1):
+        if self.offset >= len(self.buffer):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.buffer, self.offset = b"", 0
+                return b""
+            self.buffer, self.offset = chunk.encode("utf-8"), 0
+            self.bytes += len(self.buffer)
+        end = len(self.buffer) if size is None or size < 0 else self.offset + size
+        data = self.buffer[self.offset:end]
+        self.offset += len(data)
+        return data
+
+
 class TableImporter(Config):
-    def __init__(self, fields_names):
-        """init connections to upload"""
-        Config.__init__(self)
+    def __init__(self, fields_names, copy_format="json", pool=None, table_name=None, step=None):
+        """init connections to upload, pool - shared ConnectionPool of the run, table_name - target table,
+        step - rows per chunk streamed to COPY (Config.step by default)"""
+        Config.__init__(self, table_name=table_name, step=step)
+        if copy_format not in COPY_FORMATS:
+            raise ValueError("Unknown copy_format {}, expected one of {}".format(copy_format, COPY_FORMATS))
         self.vertica_fields_names = fields_names
+        self.copy_format = copy_format
+        self.pool = pool
         self.json_fields = []
 
-    def get_fields(self):
-        """get columns of source or destiny table"""
-        self.db_worker_to = DataBaseWorker(
-            sql_credentials=self.sql_credentials,
-            db="vertica",
-            tables=[self.table_name]
+    def connect(self):
+        """vertica connection for one upload: from the pool if any, otherwise a new one"""
+        if self.pool is not None:
+            return self.pool.connection()
+        return VerticaConnector(
+            user=self.vertica_user,
+            password=self.vertica_password,
+            database=self.vertica_database,
+            vertica_configs=self.vertica_configs,
+            sec_to_recconect=2,
+            count_retries=3,
         )
 
-    def extract_full(self, df_json):
-        """main function to upload"""
-        self.get_fields()
-
-        end = 1
-        with VerticaConnector(
-                user=self.vertica_user,
-                password=self.vertica_password,
-                database=self.vertica_database,
-                vertica_configs=self.vertica_configs,
-                sec_to_recconect=2,
-                count_retries=3,
-        ) as v_connector:
-            cursor_vertica = v_connector.cnx.cursor("dict")
-            v_connector.create_staging_table(
+    def make_copy(self, df):
+        """COPY statement into staging table and data stream for it in self.copy_format"""
+        columns = ",".join(['"' + v + '"' for v in self.vertica_fields_names])
+
+        if self.copy_format == "delimited":
+            column_types = read_ddl_columns(self.vertica_schema, self.table_name)
+            sql_copy = """COPY {schema}.{table_name} ({columns}) FROM STDIN DELIMITER '{delimiter}'
+                RECORD TERMINATOR E'\\n' ENFORCELENGTH ABORT ON ERROR""".format(
+                schema=self.vertica_schema_staging,
                 table_name=self.table_name,
-                schema=self.vertica_schema,
-                staging_schema=self.vertica_schema_staging,
-                ddl_path=str(Path.cwd().parent / 'db' / 'vertica' / self.vertica_schema)
+                columns=columns,
+                delimiter=DELIMITER,
             )
+            return sql_copy, IterStream(iter_df_as_delimited(df, column_types, self.step))
 
-            for step_num in range(0, end):
-                logging.info("Uploading to vertica")
-                sql_copy = """COPY {schema}.{table_name} ({columns}) FROM STDIN PARSER FJSONPARSER(
-                    RECORD_TERMINATOR=E'\n', flatten_maps=false) ENFORCELENGTH  ABORT ON ERROR""".format(
-                    schema=self.vertica_schema_staging,
-                    table_name=self.table_name,
-                    columns=",".join(
-                        ['"' + v + '"' for v in self.vertica_fields_names]
-                    ),
-                )
-                logging.info(sql_copy)
-                cursor_vertica.copy(sql_copy, df_json)
-                logging.info("Uploading to vertica success")
-                del df_json
-                gc.collect()
+        sql_copy = """COPY {schema}.{table_name} ({columns}) FROM STDIN PARSER FJSONPARSER(
+            RECORD_TERMINATOR=E'\n', flatten_maps=false) ENFORCELENGTH  ABORT ON ERROR""".format(
+            schema=self.vertica_schema_staging,
+            table_name=self.table_name,
+            columns=columns,
+        )
+        return sql_copy, IterStream(iter_df_as_json(df, self.step))
 
+    def copy_to_staging(self, v_connector, df):
+        """create staging table from ddl and stream data into it by self.step rows"""
+        cursor_vertica = v_connector.cnx.cursor("dict")
+        v_connector.create_staging_table(
+            table_name=self.table_name,
+            schema=self.vertica_schema,
+            staging_schema=self.vertica_schema_staging,
+            ddl_path=str(DDL_PATH / self.vertica_schema)
+        )
+
+        logging.info("Uploading to vertica")
+        sql_copy, stream = self.make_copy(df)
+        logging.info(sql_copy)
+        cursor_vertica.copy(sql_copy, stream, buffer_size=COPY_BUFFER_SIZE)
+        metrics.add("rows", len(df))
+        metrics.add("bytes", stream.bytes)
+        logging.info("Uploading to vertica success: {} rows, {:.1f} MB".format(len(df), stream.bytes / 2 ** 20))
+
+    @metrics.timed("extract_full")
+    def extract_full(self, df):
+        """main function to upload"""
+        with self.connect() as v_connector:
+            self.copy_to_staging(v_connector, df)
             v_connector.reload_main_table(
                 table_name=self.table_name,
                 schema=self.vertica_schema,
                 staging_schema=self.vertica_schema_staging
             )
+            # the pool rolls back on return: nothing may be left uncommitted
+            v_connector.cnx.commit()
 
         logging.info("uploaded")
+
+    @metrics.timed("extract_merge")
+    def extract_merge(self, df, key_columns=None, delete_by=None, delete_ids=None, step=1000):
+        """
+        upload delta: copy to staging table, then in one transaction
+        MERGE into main table by key_columns or, if delete_by is set,
+        delete all rows with delete_by in delete_ids (by default delete_by values of staging rows)
+        and insert staging rows: parents in delete_ids without staging rows lose all their rows
+        """
+        staging = "{}.{}".format(self.vertica_schema_staging, self.table_name)
+        main = "{}.{}".format(self.vertica_schema, self.table_name)
+        columns = ['"' + v + '"' for v in self.vertica_fields_names]
+
+        if delete_by:
+            if delete_ids is None:
+                delete_ids = df[delete_by].dropna().astype(str)
+            ids = sorted(set(delete_ids))
+            sqls = [
+                'DELETE FROM {main} WHERE "{key}" IN ({values});'.format(
+                    main=main, key=delete_by,
+                    values=", ".join(["'{}'".format(i.replace("'", "''")) for i in ids[start:start + step]]))
+                for start in range(0, len(ids), step)
+            ]
+            sqls.append("INSERT INTO {main} ({columns}) SELECT {columns} FROM {staging};".format(
+                main=main, staging=staging, columns=",".join(columns)))
+        else:
+            key_columns = key_columns or [self.key_column]
+            update = ",".join(["{0} = s.{0}".format(c) for c in columns if c.strip('"') not in key_columns])
+            sqls = [
+                "MERGE INTO {main} t USING {staging} s ON {on} "
+                "{matched}"
+                "WHEN NOT MATCHED THEN INSERT ({columns}) VALUES ({values});".format(
+                    main=main,
+                    staging=staging,
+                    on=" AND ".join(['t."{0}" = s."{0}"'.format(k) for k in key_columns]),
+                    # all columns are key columns in link tables: nothing to update
+                    matched="WHEN MATCHED THEN UPDATE SET {} ".format(update) if update else "",
+                    columns=",".join(columns),
+                    values=",".join(["s." + c for c in columns]),
+                ),
+            ]
+
+        with self.connect() as v_connector:
+            self.copy_to_staging(v_connector, df)
+            cursor = v_connector.cnx.cursor()
+            for sql in sqls:
+                cursor.execute(sql)
+            # DELETE and INSERT are committed together: readers never see the parents without rows.
+            # DROP is DDL and commits by itself in Vertica, so it goes after the commit
+            v_connector.cnx.commit()
+            cursor.execute("DROP TABLE IF EXISTS {} CASCADE;".format(staging))
+            cursor.close()
+
+        logging.info("merged: {} statements in one transaction".format(len(sqls)))
@@ -2,27 +2,81 @@
 Функции и утилиты для работы с Vertica
 """
 
+import atexit
 import json
 import logging
-import logging.config
 import os
+import threading
 from typing import Any, Collection, Dict, List, Optional
 
 import pandas as pd
 from vconnector.vertica_connector import VerticaConnector
 
+from metrics import metrics
+
 from .config_files.config_vertica import SCHEMA, TABLE_PREFIX, table_foreign_keys
-from .table_importer import TableImporter
+from .config_files.config_netology import Config
+from .fingerprints import SCHEMA_KEY, diff_fingerprints, row_fingerprints, schema_hash
+from .pool import ConnectionPool
+from .sinks import LoadSink
+from .table_importer import COPY_BUFFER_SIZE, IterStream, TableImporter, iter_df_as_json
+
+# Формат COPY для таблиц с DDL: delimited (нативный парсер, типы из DDL) или json (FJSONPARSER)
+COPY_FORMAT = os.getenv('VERTICA_COPY_FORMAT', 'delimited')
+
+# Таблица отпечатков строк для load_changed
+FINGERPRINTS_TABLE = 'fingerprints'
 
-# # Logging
-logging.config.fileConfig('logging.conf')
+# Сколько данных не пришлось загружать за запуск благодаря отпечаткам: {table_name: bytes}
+bytes_saved: Dict[str, int] = {}
 
-# # Коннектор
-vertica_configs = json.loads(os.getenv("VERTICA_CONFIGS"))
-v_connector = VerticaConnector(user=os.getenv("VERTICA_USER_W"),
-                               password=os.getenv("VERTICA_PASSWORD_W"),
-                               database=os.getenv("VERTICA_DATABASE"),
-                               vertica_configs=vertica_configs)
+# Загрузки идут параллельно, а первая запись пересоздает таблицу отпечатков
+_fingerprints_lock = threading.Lock()
+
+# Пул соединений на весь запуск: все функции модуля и TableImporter берут соединения из него.
+# Это основной приемник загрузок (vertica.sinks.LoadSink). Создается при первом обращении (get_sink),
+# use_sink подменяет его
+POOL_SIZE = int(os.getenv("VERTICA_POOL_SIZE", 4))
+_sink: Optional[LoadSink] = None
+_sink_lock = threading.Lock()
+
+
+def make_pool(size: int = POOL_SIZE) -> ConnectionPool:
+    """
+    Пул соединений с Vertica по переменным окружения VERTICA_USER_W, VERTICA_PASSWORD_W, VERTICA_DATABASE
+    и VERTICA_CONFIGS. Соединения открываются при первой выдаче
+    """
+    vertica_configs = json.loads(os.getenv("VERTICA_CONFIGS"))
+    return ConnectionPool(lambda: VerticaConnector(user=os.getenv("VERTICA_USER_W"),
+                                                   password=os.getenv("VERTICA_PASSWORD_W"),
+                                                   database=os.getenv("VERTICA_DATABASE"),
+                                                   vertica_configs=dict(vertica_configs),
+                                                   sec_to_recconect=2,
+                                                   count_retries=3),
+                          size=size)
+
+
+def get_sink() -> LoadSink:
+    """
+    Приемник загрузок запуска. При первом вызове создается пул соединений с Vertica (make_pool)
+    """
+    global _sink
+    with _sink_lock:
+        if _sink is None:
+            _sink = make_pool()
+            atexit.register(_sink.close)
+        return _sink
+
+
+def use_sink(sink: LoadSink) -> Optional[LoadSink]:
+    """
+    Направляет все загрузки и запросы модуля в sink вместо пула соединений с Vertica
+    (например, в LocalSink для бенчмарков). Возвращает прежний приемник
+    """
+    global _sink
+    with _sink_lock:
+        previous, _sink = _sink, sink
+    return previous
 
 
 def column_constraint(column: Dict[str, Any]) -> str:
@@ -90,8 +144,10 @@ def make_reference_column(table_name: str, schema: str = SCHEMA, table_prefix: s
     return column
 
 
+@metrics.timed('load_custom')
 def load_custom(df: pd.DataFrame, table_name: str, schema: Optional[str] = SCHEMA, table_prefix: Optional[str] = TABLE_PREFIX,
-                skip_truncate: bool = False, table_type: str = 'FLEX TABLE', columns: Optional[List[Dict[str, Any]]] = None) -> None:
+                skip_truncate: bool = False, table_type: str = 'FLEX TABLE', columns: Optional[List[Dict[str, Any]]] = None,
+                step: Optional[int] = None) -> None:
     """
     Загружает DataFrame df в таблицу table_name, с возможностью создания TABLE или FLEX TABLE и заранее определенными столбцами
 
@@ -102,8 +158,11 @@ def load_custom(df: pd.DataFrame, table_name: str, schema: Optional[str] = SCHEM
     :param skip_truncate: не очищать существующую таблицу
     :param table_type: TABLE или FLEX TABLE
     :param columns: список столбцов
+    :param step: сколько строк сериализовать в json за раз при потоковом COPY, по умолчанию Config.step
+        (переменная окружения step), как у TableImporter
     """
     full_table_name = '{}.{}{}'.format(schema, table_prefix, table_name)
+    step = step or Config(table_name=table_prefix + table_name).step
 
     # templates
     sql = {
@@ -119,7 +178,7 @@ def load_custom(df: pd.DataFrame, table_name: str, schema: Optional[str] = SCHEM
         sql['create'] += ', '.join([column_definition(c) for c in columns])
     sql['create'] += ')'
 
-    with v_connector:
+    with get_sink().connection() as v_connector:
         cursor = v_connector.cnx.cursor()
 
         logging.info(sql['create'])
@@ -130,7 +189,11 @@ def load_custom(df: pd.DataFrame, table_name: str, schema: Optional[str] = SCHEM
             cursor.execute(sql['truncate'])  # truncate
 
         logging.info(sql['copy'])
-        cursor.copy(sql['copy'], df.to_json(orient='records', date_format='iso', date_unit='s'))  # copy
+        stream = IterStream(iter_df_as_json(df, step))
+        cursor.copy(sql['copy'], stream, buffer_size=COPY_BUFFER_SIZE)  # copy
+        v_connector.cnx.commit()
+        metrics.add('rows', len(df))
+        metrics.add('bytes', stream.bytes)
 
         if table_type == 'FLEX TABLE':
             logging.info(sql['compute'])
@@ -144,19 +207,185 @@ def load_custom(df: pd.DataFrame, table_name: str, schema: Optional[str] = SCHEM
         cursor.close()
 
 
-def load(df: pd.DataFrame, table_name: str, table_prefix: Optional[str] = TABLE_PREFIX) -> None:
+@metrics.timed('load')
+def load(df: pd.DataFrame, table_name: str, table_prefix: Optional[str] = TABLE_PREFIX, copy_format: str = COPY_FORMAT,
+         keep_fingerprints: bool = False, step: Optional[int] = None) -> None:
     """
     Загружает DataFrame df в таблицу table_name при помощи коннектора TalentTech:
-    сначала создает временную таблицу в STAGING_SCHEMA, копирует в нее json данные,
-    затем удаляет оригинальную таблицу и переименовывает временную
+    сначала создает временную таблицу в STAGING_SCHEMA, потоком копирует в нее данные порциями по Config.step строк,
+    затем удаляет оригинальную таблицу и переименовывает временную.
+    Для delimited строки типизируются по DDL из db/vertica, пустая строка загружается как NULL
+
+    :param df: DataFrame
+    :param table_name: имя таблицы
+    :param table_prefix: префикс имени таблицы
+    :param copy_format: delimited или json
+    :param keep_fingerprints: не удалять отпечатки строк таблицы (их обновляет вызывающий, load_changed)
+    :param step: сколько строк сериализовать за раз при потоковом COPY, по умолчанию Config.step
+    """
+    c = TableImporter(fields_names=df.columns, copy_format=copy_format, pool=get_sink(),
+                      table_name=table_prefix + table_name, step=step)
+    c.extract_full(df)
+    if not keep_fingerprints:
+        forget_fingerprints(table_prefix + table_name)
+
+
+@metrics.timed('merge')
+def merge(df: pd.DataFrame, table_name: str, key_columns: Optional[List[str]] = None, delete_by: Optional[str] = None,
+          delete_ids: Optional[Collection[str]] = None, table_prefix: Optional[str] = TABLE_PREFIX,
+          copy_format: str = COPY_FORMAT, keep_fingerprints: bool = False, step: Optional[int] = None) -> None:
+    """
+    Загружает дельту df в существующую таблицу table_name: копирует данные во временную таблицу в STAGING_SCHEMA,
+    затем в одной транзакции делает MERGE по key_columns или, если задан delete_by, удаляет все строки
+    со значениями delete_by из delete_ids и вставляет строки df (так перезаливаются вложенные сущности
+    измененных родителей, например все views одного workbook). delete_ids - id всех измененных родителей,
+    включая тех, у кого вложенных сущностей не осталось; по умолчанию - значения delete_by в df.
+    Сохраненные отпечатки строк таблицы удаляются: после дельты они не совпадают с таблицей,
+    и следующая load_changed перезагрузит ее целиком
 
     :param df: DataFrame
     :param table_name: имя таблицы
+    :param key_columns: ключ для MERGE, по умолчанию id
+    :param delete_by: столбец с id родителя
+    :param delete_ids: id родителей, строки которых заменяются
+    :param table_prefix: префикс имени таблицы
+    :param copy_format: delimited или json
+    :param keep_fingerprints: не удалять отпечатки строк таблицы (их обновляет вызывающий, load_changed)
+    :param step: сколько строк сериализовать за раз при потоковом COPY, по умолчанию Config.step
+    """
+    if df.empty and not (delete_by and delete_ids):
+        logging.info('Nothing to merge into {}{}'.format(table_prefix, table_name))
+        return
+
+    c = TableImporter(fields_names=df.columns, copy_format=copy_format, pool=get_sink(),
+                      table_name=table_prefix + table_name, step=step)
+    c.extract_merge(df, key_columns=key_columns, delete_by=delete_by, delete_ids=delete_ids)
+    if not keep_fingerprints:
+        forget_fingerprints(table_prefix + table_name)
+
+
+@metrics.timed('load_changed')
+def load_changed(df: pd.DataFrame, table_name: str, key_columns: Optional[List[str]] = None,
+                 table_prefix: str = TABLE_PREFIX, copy_format: str = COPY_FORMAT) -> Dict[str, int]:
+    """
+    Загружает df как полную копию таблицы table_name, но передает в Vertica только изменения.
+    Отпечатки строк сравниваются с сохраненными в tableau_fingerprints: если ничего не изменилось, загрузка
+    пропускается целиком, иначе новые и измененные строки загружаются MERGE по key_columns,
+    а строки, которых больше нет, удаляются. Без сохраненных отпечатков, при изменении столбцов или DDL
+    и при неуникальном ключе таблица перезагружается как в load
+
+    :param df: DataFrame со всеми строками таблицы
+    :param table_name: имя таблицы
+    :param key_columns: ключ строки, по умолчанию id
     :param table_prefix: префикс имени таблицы
+    :param copy_format: delimited или json
+    :return: число новых и измененных, удаленных и неизменных строк и сэкономленный объем
+    """
+    key_columns = key_columns or ['id']
+    table = table_prefix + table_name
+    current = row_fingerprints(df, key_columns)
+    current_schema = schema_hash(df, SCHEMA, table)
+    stored = get_fingerprints(table)
+
+    stats = {'changed': len(df), 'removed': 0, 'unchanged': 0, 'bytes_saved': 0}
+    if stored.get(SCHEMA_KEY) != current_schema or not current['row_key'].is_unique:
+        logging.info('Fingerprints of {}: full reload'.format(table))
+        load(df, table_name=table_name, table_prefix=table_prefix, copy_format=copy_format, keep_fingerprints=True)
+    else:
+        changed, removed = diff_fingerprints(current, stored)
+        stats.update(changed=int(changed.sum()), removed=len(removed), unchanged=int((~changed).sum()),
+                     bytes_saved=int(current.loc[~changed, 'row_bytes'].sum()))
+        if not stats['changed'] and not removed:
+            logging.info('Fingerprints of {}: no changes, load skipped'.format(table))
+            bytes_saved[table] = stats['bytes_saved']
+            return stats
+
+        merge(df[changed.to_numpy()], table_name=table_name, key_columns=key_columns,
+              table_prefix=table_prefix, copy_format=copy_format, keep_fingerprints=True)
+        if removed:
+            delete_keys(table, key_columns, removed)
+
+    fingerprints = pd.concat([pd.DataFrame({'row_key': [SCHEMA_KEY], 'row_hash': [current_schema]}),
+                              current[['row_key', 'row_hash']]], ignore_index=True)
+    save_fingerprints(table, fingerprints)
+
+    bytes_saved[table] = stats['bytes_saved']
+    logging.info('Fingerprints of {}: {changed} changed, {removed} removed, {unchanged} unchanged, '
+                 '{mb:.1f} MB not loaded'.format(table, mb=stats['bytes_saved'] / 2 ** 20, **stats))
+    return stats
+
+
+def get_fingerprints(table: str, schema: str = SCHEMA) -> Dict[str, str]:
+    """
+    Сохраненные отпечатки строк таблицы table: {row_key: row_hash}. Пустой словарь, если их нет
+    """
+    fingerprints_table = TABLE_PREFIX + FINGERPRINTS_TABLE
+    sql = u"SELECT row_key, row_hash FROM {}.{} WHERE table_name = '{}'".format(schema, fingerprints_table, table)
+
+    with _fingerprints_lock:
+        if fingerprints_table not in get_tables(schema=schema):
+            return {}
+        with get_sink().connection() as v_connector:
+            cursor = v_connector.cnx.cursor()
+            cursor.execute(sql)
+            fingerprints = dict(cursor.fetchall())
+            cursor.close()
+
+    return fingerprints
+
+
+def save_fingerprints(table: str, fingerprints: pd.DataFrame, schema: str = SCHEMA) -> None:
+    """
+    Заменяет сохраненные отпечатки строк таблицы table (столбцы row_key, row_hash)
+    """
+    df = fingerprints.assign(table_name=table)[['table_name', 'row_key', 'row_hash']]
+    with _fingerprints_lock:
+        if TABLE_PREFIX + FINGERPRINTS_TABLE in get_tables(schema=schema):
+            merge(df, table_name=FINGERPRINTS_TABLE, delete_by='table_name', delete_ids=[table],
+                  keep_fingerprints=True)
+        else:
+            load(df, table_name=FINGERPRINTS_TABLE, keep_fingerprints=True)
+
+
+def forget_fingerprints(table: str, schema: str = SCHEMA) -> None:
+    """
+    Удаляет сохраненные отпечатки строк таблицы table. Нужно после любого изменения таблицы мимо load_changed:
+    иначе строка, вставленная дельтой и потом удаленная в Tableau, не попадет ни в сохраненные, ни в текущие
+    отпечатки и никогда не удалится. Без отпечатков следующая load_changed перезагружает таблицу целиком
     """
-    os.environ["table_name"] = "{}{}".format(table_prefix, table_name)
-    c = TableImporter(fields_names=df.columns)
-    c.extract_full(df.to_json(orient='records', date_unit='s', date_format='iso'))
+    fingerprints_table = TABLE_PREFIX + FINGERPRINTS_TABLE
+    sql = u"DELETE FROM {}.{} WHERE table_name = '{}'".format(schema, fingerprints_table, table)
+
+    with _fingerprints_lock:
+        if fingerprints_table not in get_tables(schema=schema):
+            return
+        with get_sink().connection() as v_connector:
+            cursor = v_connector.cnx.cursor()
+            cursor.execute(sql)
+            cursor.close()
+            v_connector.cnx.commit()
+    logging.info('Fingerprints of {} removed: the next load_changed reloads it in full'.format(table))
+
+
+def delete_keys(table: str, key_columns: List[str], keys: Collection[str], schema: str = SCHEMA,
+                step: int = 1000) -> None:
+    """
+    Удаляет из таблицы строки с ключами keys (значения key_columns через |, как в row_fingerprints)
+    """
+    key_expression = " || '|' || ".join(['"{}"::VARCHAR'.format(c) for c in key_columns])
+    keys = sorted(keys)
+    sqls = []
+    for start in range(0, len(keys), step):
+        values = ', '.join(["'{}'".format(k.replace("'", "''")) for k in keys[start:start + step]])
+        sqls.append(u"DELETE FROM {}.{} WHERE {} IN ({});".format(schema, table, key_expression, values))
+
+    with get_sink().connection() as v_connector:
+        cursor = v_connector.cnx.cursor()
+        for sql in sqls:
+            cursor.execute(sql)
+        cursor.close()
+        v_connector.cnx.commit()
+    logging.info('Deleted {} rows from {}.{}'.format(len(keys), schema, table))
 
 
 def get_tables(schema: str = SCHEMA, table_prefix: str = TABLE_PREFIX) -> List[str]:
@@ -175,7 +404,7 @@ def get_tables(schema: str = SCHEMA, table_prefix: str = TABLE_PREFIX) -> List[s
         """.format(schema, table_prefix),
     }
 
-    with v_connector:
+    with get_sink().connection() as v_connector:
         cursor = v_connector.cnx.cursor()
 
         cursor.execute(sql['get'])  # count
@@ -201,7 +430,7 @@ def get_columns(schema: str, table: str) -> List[str]:
         """.format(table, schema),
     }
 
-    with v_connector:
+    with get_sink().connection() as v_connector:
         cursor = v_connector.cnx.cursor()
 
         cursor.execute(sql['get_columns'])
@@ -231,7 +460,7 @@ def get_constraints(schema: str, table: str) -> Dict[str, Dict[str, List[str]]]:
         """.format(table, schema),
     }
 
-    with v_connector:
+    with get_sink().connection() as v_connector:
         cursor = v_connector.cnx.cursor()
 
         cursor.execute(sql['get_constraints'])
@@ -249,16 +478,48 @@ def get_constraints(schema: str, table: str) -> Dict[str, Dict[str, List[str]]]:
     return constraint_to_table
 
 
-def make_foreign_keys(schema: str = SCHEMA, table_prefix: str = TABLE_PREFIX) -> None:
+def referenced_tables(columns: Collection[str], table_name: Optional[str] = None) -> List[str]:
     """
-    Проходится по всем таблицам в схеме с префиксом table_prefix и при нахождении столбца с именем из table_foreign_keys, создает FOREIGN KEY
+    Возвращает таблицы (без префикса), на которые ссылаются столбцы columns по table_foreign_keys.
+    Ссылки таблицы table_name на саму себя пропускаются
+
+    :param columns: столбцы таблицы
+    :param table_name: имя таблицы без префикса
+    """
+    tables = []
+    for t, keys in table_foreign_keys.items():
+        if t != table_name and t not in tables and any(k in columns for k in keys):
+            tables.append(t)
+    return tables
+
+
+def plan_foreign_keys(cursor, schema: str = SCHEMA, table_prefix: str = TABLE_PREFIX) -> List[str]:
+    """
+    Возвращает ALTER TABLE для недостающих FOREIGN KEY. Столбцы и существующие ограничения всех таблиц схемы
+    с префиксом table_prefix читаются из каталога двумя запросами, план строится в памяти по table_foreign_keys
     """
     # templates
     # noinspection SyntaxError
     sql = {
-        'add_fk'         : u"ALTER TABLE {SCHEMA}.{TABLE} ADD CONSTRAINT {TABLE}_{fk_table}_id_fk "
+        'get_columns'    : u"""
+            SELECT table_name, column_name
+            FROM v_catalog.columns
+            WHERE table_schema = '{}'
+              AND table_name ILIKE '{}%'
+              AND table_name NOT ILIKE '%_keys'
+            ORDER BY table_name, ordinal_position
+        """.format(schema, table_prefix),
+        'get_constraints': u"""
+            SELECT table_name, column_name, reference_table_schema, reference_table_name
+            FROM v_catalog.constraint_columns
+            WHERE table_schema = '{}'
+              AND table_name ILIKE '{}%'
+              AND constraint_type = 'f'
+        """.format(schema, table_prefix),
+        # Имя ограничения - по столбцу: у таблицы может быть несколько ключей на одну таблицу (parent_id и
+        # root_project_id у projects)
+        'add_fk'         : u"ALTER TABLE {SCHEMA}.{TABLE} ADD CONSTRAINT {TABLE}_{fk}_fk "
                            u"FOREIGN KEY ({fk}) REFERENCES {fk_schema}.{fk_table};",
-        'set_search_path': u'set search_path = "{}"'.format(schema),
     }
 
     fk_to_table = {}
@@ -266,36 +527,64 @@ def make_foreign_keys(schema: str = SCHEMA, table_prefix: str = TABLE_PREFIX) ->
         for k in keys:
             fk_to_table[k] = '{}{}'.format(table_prefix, t)
 
-    tables = get_tables(schema, table_prefix)
+    cursor.execute(sql['get_columns'])
+    columns = cursor.fetchall()
 
-    with v_connector:
-        cursor = v_connector.cnx.cursor()
+    cursor.execute(sql['get_constraints'])
+    constraints = {(table, column, '{}.{}'.format(ref_schema, ref_table))
+                   for table, column, ref_schema, ref_table in cursor.fetchall()}
+    logging.info('Total columns: {}, foreign constraints: {} in {}.{}*'.format(
+        len(columns), len(constraints), schema, table_prefix))
 
-        for table in tables:
-            columns = get_columns(schema=schema, table=table)
-            constraints = get_constraints(schema=schema, table=table)
-
-            for column in columns:
-                if column in fk_to_table:
-                    fk_table = fk_to_table[column]
-
-                    if column in constraints:
-                        fk_full_table_name = '{}.{}'.format(schema, fk_table)
-                        if fk_full_table_name in constraints[column].keys():
-                            logging.info('The foreign key {} has already been defined for relation {}'.format(column, fk_full_table_name))
-                            continue
-
-                    s = sql['add_fk'].format(SCHEMA=schema, TABLE=table, fk=column,
-                                             fk_schema=schema, fk_table=fk_table)
-                    try:
-                        cursor.execute(s)
-                        logging.info(s)
-                    except Exception as e:
-                        logging.error(s)
-                        raise e
+    plan = []
+    for table, column in columns:
+        if column not in fk_to_table:
+            continue
 
+        fk_table = fk_to_table[column]
+        fk_full_table_name = '{}.{}'.format(schema, fk_table)
+        if (table, column, fk_full_table_name) in constraints:
+            logging.info('The foreign key {} has already been defined for relation {}'.format(column, fk_full_table_name))
+            continue
+
+        plan.append(sql['add_fk'].format(SCHEMA=schema, TABLE=table, fk=column,
+                                         fk_schema=schema, fk_table=fk_table))
+
+    return plan
+
+
+@metrics.timed('make_foreign_keys')
+def make_foreign_keys(schema: str = SCHEMA, table_prefix: str = TABLE_PREFIX, dry_run: bool = False) -> List[str]:
+    """
+    Проходится по всем таблицам в схеме с префиксом table_prefix и при нахождении столбца с именем из table_foreign_keys, создает FOREIGN KEY.
+    ALTER TABLE ... ADD CONSTRAINT - DDL, в Vertica каждый коммитится сам, поэтому при ошибке уже созданные ключи
+    остаются. План каждый раз строится заново по каталогу: повторный запуск создает только недостающие ключи
+
+    :param schema: схема
+    :param table_prefix: префикс имени таблицы
+    :param dry_run: только вывести план, ничего не менять
+    :return: план - список ALTER TABLE
+    """
+    with get_sink().connection() as v_connector:
+        cursor = v_connector.cnx.cursor()
+        plan = plan_foreign_keys(cursor, schema, table_prefix)
+
+        if dry_run:
+            cursor.close()
+            print('\n'.join(plan) or 'All foreign keys are already defined')
+            return plan
+
+        for done, sql in enumerate(plan):
+            try:
+                cursor.execute(sql)
+            except Exception as e:
+                logging.error('Error while making foreign keys, {} of {} created: {}'.format(done, len(plan), e))
+                raise e
         cursor.close()
 
+    logging.info('Foreign keys created: {}'.format(len(plan)))
+    return plan
+
 
 def get_table(table_name: str, schema: Optional[str] = SCHEMA, table_prefix: Optional[str] = TABLE_PREFIX, columns: List[str] = None) -> pd.DataFrame:
     """
@@ -318,7 +607,7 @@ def get_table(table_name: str, schema: Optional[str] = SCHEMA, table_prefix: Opt
         'get': u"SELECT {} FROM {}".format(', '.join(columns) if columns else '*', full_table_name),
     }
 
-    with v_connector:
+    with get_sink().connection() as v_connector:
         cursor = v_connector.cnx.cursor()
         cursor.execute(sql['get'])
         data = cursor.fetchall()
@@ -330,13 +619,33 @@ def get_table(table_name: str, schema: Optional[str] = SCHEMA, table_prefix: Opt
     return df
 
 
+def get_max_values(table_name: str, key_column: str, value_column: str, schema: str = SCHEMA,
+                   table_prefix: str = TABLE_PREFIX) -> Dict[Any, Any]:
+    """
+    Максимальное значение value_column для каждого значения key_column: {key: max}.
+    Пустой словарь, если таблицы еще нет
+    """
+    table = table_prefix + table_name
+    if table not in get_tables(schema=schema, table_prefix=table_prefix):
+        return {}
+
+    sql = u"SELECT {0}, MAX({1}) FROM {2}.{3} GROUP BY {0}".format(key_column, value_column, schema, table)
+
+    with get_sink().connection() as v_connector:
+        cursor = v_connector.cnx.cursor()
+        cursor.execute(sql)
+        max_values = {str(key): value for key, value in cursor.fetchall() if value is not None}
+        cursor.close()
+
+    logging.info('Get max {} for {} {} from {}.{}'.format(value_column, len(max_values), key_column, schema, table))
+    return max_values
+
+
 def make_link_table(populate_items: Collection, method: str, populate_method: str) -> (pd.DataFrame, list):
     """
-    Создает таблицу связи между двумя сущностями
+    Создает таблицу связи между двумя сущностями из записей get_populate_items (id и parent_id)
     """
-    links = []
-    for populate_item, ref_id in populate_items:
-        links.append((populate_item.id, ref_id))
+    links = [(x.id, x.parent_id) for x in populate_items]
 
     columns = [make_reference_column(x) for x in (populate_method, method)]
     df = pd.DataFrame(links, columns=[x['name'] for x in columns])